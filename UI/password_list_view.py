@@ -0,0 +1,373 @@
+from bisect import bisect_left, bisect_right
+
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, QRect, QRectF, QSize, Qt, QEvent, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QIcon, QPainter
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+
+# 行内操作按钮：(动作名, 显示文字)，从左到右排列在每行右侧
+ROW_ACTIONS = (('copy', "复制密码"), ('qr_code', "二维码"), ('attachment', "附件"), ('delete', "删除"))
+ROW_HEIGHT = 90
+
+RecordIdRole = Qt.ItemDataRole.UserRole + 1
+SiteRole = Qt.ItemDataRole.UserRole + 2
+UserNameRole = Qt.ItemDataRole.UserRole + 3
+AttachmentsRole = Qt.ItemDataRole.UserRole + 4
+
+# 每行只保存 (id, site, user_name, 附件数) 元组，不保存密码
+_ID, _SITE, _USER_NAME, _ATTACHMENTS = range(4)
+
+
+class PasswordListModel(QAbstractListModel):
+    """密码列表模型，只保存显示所需的字段
+
+    数据按页懒加载：视图滚动到底部时 Qt 调用 fetchMore，模型发出 fetch_requested(after_id)，
+    由窗口在工作线程中按键集分页读取下一页后调用 append_page。
+    按 id 的查找通过维护的 id 集合和 id -> 行号索引完成，不逐行扫描。
+    """
+    fetch_requested = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        # 已加载的记录 id，以及 id -> 行号 - _offset 的索引：在开头或末尾插入、删除时只更新涉及的行
+        # （开头的变化记在 _offset 中），在中间插入或删除后置为 None，下次查找时重建
+        self._ids = set()
+        self._positions = {}
+        self._offset = 0
+        # 分页状态：是否还有下一页、是否有请求在进行中、已加载的最后一条记录 id
+        self._has_more = False
+        self._fetching = False
+        self._cursor = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role in (Qt.ItemDataRole.DisplayRole, SiteRole):
+            return row[_SITE]
+        if role == UserNameRole:
+            return row[_USER_NAME]
+        if role == RecordIdRole:
+            return row[_ID]
+        if role == AttachmentsRole:
+            return row[_ATTACHMENTS]
+        return None
+
+    def record(self, row):
+        """返回第 row 行的记录字典"""
+        record_id, site, user_name, attachments = self._rows[row]
+        return {'id': record_id, 'site': site, 'user_name': user_name, 'attachments': attachments}
+
+    @staticmethod
+    def _to_row(data):
+        return data['id'], data['site'], data['user_name'], data.get('attachments', 0)
+
+    def _row_positions(self):
+        if self._positions is None:
+            self._positions = {data[_ID]: row for row, data in enumerate(self._rows)}
+            self._offset = 0
+        return self._positions
+
+    def _insert_rows(self, position, rows):
+        self.beginInsertRows(QModelIndex(), position, position + len(rows) - 1)
+        if self._positions is not None:
+            if position == 0:
+                self._offset += len(rows)
+                self._positions.update((row[_ID], i - self._offset) for i, row in enumerate(rows))
+            elif position == len(self._rows):
+                self._positions.update((row[_ID], position + i - self._offset) for i, row in enumerate(rows))
+            else:
+                self._positions = None
+        self._rows[position:position] = rows
+        self._ids.update(row[_ID] for row in rows)
+        self.endInsertRows()
+
+    def _remove_rows(self, first, last):
+        self.beginRemoveRows(QModelIndex(), first, last)
+        removed = self._rows[first:last + 1]
+        del self._rows[first:last + 1]
+        self._ids.difference_update(row[_ID] for row in removed)
+        if self._positions is not None:
+            if first == 0 or first == len(self._rows):
+                for row in removed:
+                    del self._positions[row[_ID]]
+                if first == 0:
+                    self._offset -= len(removed)
+            else:
+                self._positions = None
+        self.endRemoveRows()
+
+    def clear(self, has_more=False):
+        """清空列表，has_more 为 True 时从第一页重新懒加载"""
+        self.beginResetModel()
+        self._rows = []
+        self._ids = set()
+        self._positions = {}
+        self._offset = 0
+        self._has_more = has_more
+        self._fetching = False
+        self._cursor = None
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._has_more and not self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._fetching = True
+        self.fetch_requested.emit(self._cursor)
+
+    def append_page(self, datas, has_more):
+        """追加一页数据库中读出的记录，已由变更通知插入的记录不再重复追加"""
+        self._fetching = False
+        self._has_more = has_more
+        if datas:
+            self._cursor = datas[-1]['id']
+            datas = [data for data in datas if data['id'] not in self._ids]
+        self.append_records(datas)
+
+    def fetch_failed(self):
+        """读取失败时停止懒加载，避免反复重试"""
+        self._fetching = False
+        self._has_more = False
+
+    def append_records(self, datas):
+        """在末尾追加多条记录"""
+        if datas:
+            self._insert_rows(len(self._rows), [self._to_row(data) for data in datas])
+
+    def insert_record(self, data, row=0):
+        """在第 row 行插入一条记录，默认插入到最前面"""
+        self._insert_rows(row, [self._to_row(data)])
+
+    def has_record(self, record_id):
+        return record_id in self._ids
+
+    def row_of(self, record_id):
+        """返回记录所在行，不存在时返回 -1"""
+        if record_id not in self._ids:
+            return -1
+        return self._row_positions()[record_id] + self._offset
+
+    def ids_with_user_name(self, user_name):
+        """返回显示为 user_name 的记录 id，用于解锁后刷新加密的用户名"""
+        return [data[_ID] for data in self._rows if data[_USER_NAME] == user_name]
+
+    def update_records(self, datas):
+        """按 id 更新已加载的记录
+        :return: 列表中不存在的记录
+        """
+        missing = []
+        for data in datas:
+            row = self.row_of(data['id'])
+            if row < 0:
+                missing.append(data)
+                continue
+            new = self._to_row(data)
+            if new != self._rows[row]:
+                self._rows[row] = new
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+        return missing
+
+    def _position_of(self, record_id):
+        """浏览模式下（按 id 降序）记录应插入的行"""
+        return bisect_left(self._rows, -record_id, key=lambda data: -data[_ID])
+
+    def insert_records(self, datas):
+        """按 id 倒序把新记录插入到对应位置，只用于浏览模式
+
+        已加载的记录和排在未加载页中的记录（id 小于分页游标）跳过，由懒加载读取。
+        """
+        if self._has_more and self._cursor is None:
+            return
+        datas = sorted((data for data in datas if data['id'] not in self._ids
+                        and not (self._has_more and data['id'] < self._cursor)),
+                       key=lambda data: data['id'], reverse=True)
+        # 插入到同一位置的记录合并为一次插入，从后往前插入使前面的位置保持有效
+        groups = []
+        for data in datas:
+            position = self._position_of(data['id'])
+            if groups and groups[-1][0] == position:
+                groups[-1][1].append(self._to_row(data))
+            else:
+                groups.append((position, [self._to_row(data)]))
+        for position, rows in reversed(groups):
+            self._insert_rows(position, rows)
+
+    def set_attachments(self, record_id, count):
+        """更新记录的附件数"""
+        row = self.row_of(record_id)
+        if row < 0:
+            return
+        self._rows[row] = self._rows[row][:_ATTACHMENTS] + (count,)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [AttachmentsRole])
+
+    def remove_record(self, record_id):
+        row = self.row_of(record_id)
+        if row < 0:
+            return False
+        self._remove_rows(row, row)
+        return True
+
+    def truncate(self, cursor):
+        """只保留 id 不小于 cursor 的记录，其余的由懒加载重新读取，用于一次新增大量记录时"""
+        start = bisect_right(self._rows, -cursor, key=lambda data: -data[_ID])
+        if start < len(self._rows):
+            self._remove_rows(start, len(self._rows) - 1)
+        self._has_more = True
+        self._fetching = False
+        self._cursor = cursor
+
+    def remove_records(self, record_ids):
+        """删除多条记录，相邻的行合并为一次删除"""
+        rows = sorted(self.row_of(record_id) for record_id in set(record_ids) if record_id in self._ids)
+        while rows:
+            last = first = rows.pop()
+            while rows and rows[-1] == first - 1:
+                first = rows.pop()
+            self._remove_rows(first, last)
+
+
+class PasswordItemDelegate(QStyledItemDelegate):
+    """绘制密码列表的每一行，并通过点击位置判断触发的操作
+
+    只绘制可见的行，不为每条记录创建控件。
+    """
+    action_triggered = pyqtSignal(str, dict)
+    site_clicked = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.site_font = QFont("Arial", 12, QFont.Weight.Bold)
+        self.button_font = QFont()
+        self.button_font.setPixelSize(14)
+        self.icon_pixmap = QIcon("icons/website.png").pixmap(40, 40)
+        metrics = QFontMetrics(self.button_font)
+        self.button_widths = [metrics.horizontalAdvance(text) + 24 for _, text in ROW_ACTIONS]
+        # 鼠标所在的 (行, 动作)，用于高亮按钮
+        self.hover = (-1, None)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    @staticmethod
+    def card_rect(rect):
+        return rect.adjusted(5, 5, -5, -5)
+
+    def button_rects(self, rect):
+        """返回 {动作: 按钮区域}"""
+        content = self.card_rect(rect).adjusted(15, 10, -15, -10)
+        spacing = 6
+        left = content.right() - sum(self.button_widths) - spacing * (len(ROW_ACTIONS) - 1)
+        rects = {}
+        for (action, _), width in zip(ROW_ACTIONS, self.button_widths):
+            rects[action] = QRect(left, content.center().y() - 16, width, 32)
+            left += width + spacing
+        return rects
+
+    def site_rect(self, rect):
+        content = self.card_rect(rect).adjusted(15, 10, -15, -10)
+        text_left = content.left() + 40 + 12
+        text_right = min(r.left() for r in self.button_rects(rect).values()) - 10
+        return QRect(text_left, content.top(), max(0, text_right - text_left), content.height() // 2)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        card = self.card_rect(option.rect)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor("#2E2E2E"))
+        painter.drawRoundedRect(QRectF(card), 6, 6)
+
+        content = card.adjusted(15, 10, -15, -10)
+        if not self.icon_pixmap.isNull():
+            painter.drawPixmap(content.left(), content.center().y() - 20, self.icon_pixmap)
+
+        site_rect = self.site_rect(option.rect)
+        painter.setFont(self.site_font)
+        painter.setPen(QColor("#FFFFFF"))
+        site = QFontMetrics(self.site_font).elidedText(index.data(SiteRole), Qt.TextElideMode.ElideRight,
+                                                       site_rect.width())
+        painter.drawText(site_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignBottom, site)
+
+        user_rect = QRect(site_rect.left(), site_rect.bottom() + 4, site_rect.width(), site_rect.height())
+        painter.setFont(option.font)
+        painter.setPen(QColor("#AAAAAA"))
+        user_text = index.data(UserNameRole)
+        if index.data(AttachmentsRole):
+            user_text = f"📎{index.data(AttachmentsRole)}  {user_text}"
+        user_name = option.fontMetrics.elidedText(user_text, Qt.TextElideMode.ElideRight, user_rect.width())
+        painter.drawText(user_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, user_name)
+
+        painter.setFont(self.button_font)
+        button_rects = self.button_rects(option.rect)
+        for action, text in ROW_ACTIONS:
+            rect = button_rects[action]
+            if self.hover == (index.row(), action):
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor("#3E3E3E"))
+                painter.drawRoundedRect(QRectF(rect), 4, 4)
+            painter.setPen(QColor(255, 255, 255))
+            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, text)
+        painter.restore()
+
+    def hit_test(self, rect, pos):
+        """返回点击位置对应的动作，'site' 表示网站名，未命中返回 None"""
+        for action, button in self.button_rects(rect).items():
+            if button.contains(pos):
+                return action
+        if self.site_rect(rect).contains(pos):
+            return 'site'
+        return None
+
+    def editorEvent(self, event, model, option, index):
+        event_type = event.type()
+        if event_type == QEvent.Type.MouseMove:
+            action = self.hit_test(option.rect, event.position().toPoint())
+            self.set_hover(index.row(), action)
+            return False
+        if event_type == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            action = self.hit_test(option.rect, event.position().toPoint())
+            if action == 'site':
+                self.site_clicked.emit(index.data(SiteRole))
+                return True
+            if action is not None:
+                self.action_triggered.emit(action, model.record(index.row()))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+    def set_hover(self, row, action):
+        if self.hover == (row, action):
+            return
+        self.hover = (row, action)
+        view = self.parent()
+        if isinstance(view, QListView):
+            cursor = Qt.CursorShape.ArrowCursor if action is None else Qt.CursorShape.PointingHandCursor
+            view.viewport().setCursor(cursor)
+            view.viewport().update()
+
+
+class PasswordListView(QListView):
+    """只绘制可见行的密码列表"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setUniformItemSizes(True)
+        self.setMouseTracking(True)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setStyleSheet("QListView { background-color: #1E1E1E; border: none; }")
+        self.list_model = PasswordListModel(self)
+        self.delegate = PasswordItemDelegate(self)
+        self.setModel(self.list_model)
+        self.setItemDelegate(self.delegate)
+
+    def leaveEvent(self, event):
+        self.delegate.set_hover(-1, None)
+        super().leaveEvent(event)
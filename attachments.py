@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from cryptography.fernet import InvalidToken
+
+from encrypted_file import DEFAULT_FILE_CHUNK_SIZE, EncryptedMessage, atomic_write, encrypted_file_size
+from db.db_tools import SQLiteDB
+from db.migrations import ATTACHMENT_TABLE, USER_TABLE
+from blind_index import ENCRYPTED_PLACEHOLDER
+
+# 附件内容的算法和分块大小
+ATTACHMENT_BACKEND = 'aes-gcm'
+ATTACHMENT_CHUNK_SIZE = DEFAULT_FILE_CHUNK_SIZE
+# 写入附件时每个事务写入的密文字节数，事务之间释放写锁，其他连接的写入不会等到整个文件写完
+ATTACHMENT_COMMIT_SIZE = 8 << 20
+# 未写完的附件超过这个秒数仍未完成，视为进程中断遗留，下次添加附件时清理
+ATTACHMENT_STALE_SECONDS = 24 * 3600
+# 列出附件时读取的列，不包含内容
+ATTACHMENT_COLUMNS = ['id', 'record_id', 'name', 'size', 'created_at']
+
+
+def add_attachment(db_path, cipher: EncryptedMessage, record_id: int, path, name: Optional[str] = None,
+                   chunk_size: int = ATTACHMENT_CHUNK_SIZE, max_workers: Optional[int] = None) -> Dict:
+    """把文件加密后作为记录的附件存入数据库
+
+    每个附件使用随机生成的内容密钥，内容密钥由库密钥加密保存，密钥轮换时只需重新加密内容密钥。
+    先按加密后的大小插入 record_id 为 NULL 的 zeroblob 行并提交，再把密文按 ATTACHMENT_COMMIT_SIZE
+    分批在短事务中通过 blobopen 写入，写完后才设置 record_id；大文件不会长时间占用写锁，
+    内存占用与文件大小无关。未完成的行不会出现在列表、导出和备份中，失败时删除。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器
+    :param record_id: 所属记录 id
+    :param path: 文件路径
+    :param name: 附件名，默认为文件名
+    :param chunk_size: 每块明文的字节数
+    :param max_workers: 并行加密的并发数
+    :return: 附件信息，见 list_attachments
+    :raises ValueError: 文件超过 SQLite 单个 BLOB 的大小上限，或读取过程中大小发生变化
+    :raises LookupError: 写入过程中记录已被删除
+    """
+    name = name or os.path.basename(path)
+    size = os.path.getsize(path)
+    data_size = encrypted_file_size(size, chunk_size)
+    data_key = EncryptedMessage.generate_secret_key()
+    with SQLiteDB(db_path, pooled=True) as db:
+        if data_size > db.connection.getlimit(sqlite3.SQLITE_LIMIT_LENGTH):
+            raise ValueError(f"附件过大：{size} 字节")
+        delete_incomplete_attachments(db, time.time() - ATTACHMENT_STALE_SECONDS)
+        with db.transaction():
+            row = {'record_id': None, 'name': cipher.encrypt_bytes(name), 'size': size,
+                   'data_key': cipher.encrypt_bytes(data_key), 'created_at': time.time()}
+            db.cursor.execute(f"INSERT INTO {ATTACHMENT_TABLE} ({', '.join(row)}, data) "
+                              f"VALUES ({', '.join('?' * len(row))}, zeroblob(?))", (*row.values(), data_size))
+            attachment_id = db.cursor.lastrowid
+        try:
+            writer = _BlobWriter(db, attachment_id, data_size, ATTACHMENT_COMMIT_SIZE)
+            with open(path, 'rb') as src:
+                EncryptedMessage(data_key, ATTACHMENT_BACKEND).encrypt_stream(src, writer, chunk_size, max_workers)
+            writer.flush()
+            if writer.offset != data_size:
+                raise ValueError("文件在读取过程中被修改")
+            with db.transaction():
+                db.cursor.execute(f"UPDATE {ATTACHMENT_TABLE} SET record_id = ? WHERE id = ? "
+                                  f"AND EXISTS (SELECT 1 FROM {USER_TABLE} WHERE id = ?)",
+                                  (record_id, attachment_id, record_id))
+                if db.cursor.rowcount != 1:
+                    raise LookupError("记录不存在")
+        except BaseException:
+            db.delete(ATTACHMENT_TABLE, 'id = ? AND record_id IS NULL', (attachment_id,))
+            raise
+    print(f"已添加附件 {name}（{size} 字节）")
+    return {'id': attachment_id, 'record_id': record_id, 'name': name, 'size': size, 'created_at': row['created_at']}
+
+
+class _BlobWriter:
+    """供 encrypt_stream 使用的 dst，攒够 commit_size 字节后在一个短事务中打开 blob 定位写入
+
+    sqlite3.Blob 打开期间不能提交事务，所以每批都重新打开；加密在事务之外进行，写锁只在写入时持有。
+    """
+    def __init__(self, db: SQLiteDB, attachment_id: int, data_size: int, commit_size: int):
+        self.db = db
+        self.attachment_id = attachment_id
+        self.data_size = data_size
+        self.commit_size = commit_size
+        self.offset = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, data: bytes) -> int:
+        if self.offset + self._pending_size + len(data) > self.data_size:
+            raise ValueError("文件在读取过程中被修改")
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.commit_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self.db.transaction(), \
+                self.db.connection.blobopen(ATTACHMENT_TABLE, 'data', self.attachment_id) as blob:
+            blob.seek(self.offset)
+            for data in self._pending:
+                blob.write(data)
+        self.offset += self._pending_size
+        self._pending, self._pending_size = [], 0
+
+
+def delete_incomplete_attachments(db: SQLiteDB, before: float) -> int:
+    """删除 before 之前开始写入、至今未完成（record_id 为 NULL）的附件，返回删除的行数"""
+    with db.transaction():
+        db.cursor.execute(f"DELETE FROM {ATTACHMENT_TABLE} WHERE record_id IS NULL AND created_at < ?", (before,))
+        return db.cursor.rowcount
+
+
+def list_attachments(db: SQLiteDB, cipher: Optional[EncryptedMessage], record_id: int) -> List[Dict]:
+    """记录的附件列表（不读取内容），cipher 为 None 或无法解密时附件名显示为占位文字"""
+    rows = db.select(ATTACHMENT_TABLE, ATTACHMENT_COLUMNS, 'record_id = ?', (record_id,))
+    for row in rows:
+        encrypted, row['name'] = row['name'], ENCRYPTED_PLACEHOLDER
+        if cipher is not None:
+            try:
+                row['name'] = cipher.decrypt(encrypted)
+            except InvalidToken:
+                pass
+    return rows
+
+
+def count_attachments(db: SQLiteDB, record_ids: List[int]) -> Dict[int, int]:
+    """返回 {记录 id: 附件数}，没有附件的记录不在结果中"""
+    if not record_ids:
+        return {}
+    rows = db.connection.execute(
+        f"SELECT record_id, COUNT(*) FROM {ATTACHMENT_TABLE} "
+        f"WHERE record_id IN ({', '.join('?' * len(record_ids))}) GROUP BY record_id", tuple(record_ids)).fetchall()
+    return dict(rows)
+
+
+def export_attachment(db_path, cipher: EncryptedMessage, attachment_id: int, dst_path,
+                      max_workers: Optional[int] = None) -> int:
+    """把附件解密后写到 dst_path
+
+    通过只读的 blobopen 逐块读取和解密，写入同目录的临时文件，全部通过认证后才替换 dst_path。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器，密钥轮换中时也可解密旧密钥加密的附件
+    :param attachment_id: 附件 id
+    :param dst_path: 导出的文件路径
+    :param max_workers: 并行解密的并发数
+    :return: 写出的字节数
+    :raises LookupError: 附件不存在
+    :raises InvalidToken: 密钥不匹配或附件内容被改动
+    """
+    with SQLiteDB(db_path, pooled=True) as db:
+        rows = db.select(ATTACHMENT_TABLE, ['data_key'], 'id = ? AND record_id IS NOT NULL', (attachment_id,),
+                         fetch_all=False)
+        if not rows:
+            raise LookupError("附件不存在")
+        data_key = cipher.decrypt(rows[0]['data_key'])
+        with db.connection.blobopen(ATTACHMENT_TABLE, 'data', attachment_id, readonly=True) as blob, \
+                atomic_write(dst_path) as dst:
+            return EncryptedMessage(data_key).decrypt_stream(blob, dst, max_workers)
+
+
+def delete_attachments(db: SQLiteDB, record_id: int, attachment_id: Optional[int] = None):
+    """删除记录的全部附件，或其中 attachment_id 指定的一个"""
+    if attachment_id is None:
+        db.delete(ATTACHMENT_TABLE, 'record_id = ?', (record_id,))
+    else:
+        db.delete(ATTACHMENT_TABLE, 'id = ? AND record_id = ?', (attachment_id, record_id))
+
+
+def benchmark_attachments(size_mb: int = 256):
+    """测量 size_mb MB 附件写入和导出的吞吐量与 Python 内存峰值"""
+    import tempfile
+    import tracemalloc
+    from db.migrations import migrate
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        plain_path = os.path.join(tmp, 'plain')
+        with open(plain_path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1 << 20))
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            record_id = db.insert('user', {'site': 'example.com', 'user_name': 'user', 'pwd': cipher.encrypt('pwd')})
+        attachment_id = None
+        for label in ('写入', '导出'):
+            tracemalloc.start()
+            start = time.perf_counter()
+            if attachment_id is None:
+                attachment_id = add_attachment(db_path, cipher, record_id, plain_path)['id']
+            else:
+                export_attachment(db_path, cipher, attachment_id, plain_path + '.out')
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label} {size_mb} MB: {size_mb / elapsed:7.1f} MB/s  内存峰值 {peak / (1 << 20):.1f} MB")
+
+
+if __name__ == '__main__':
+    benchmark_attachments()
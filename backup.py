@@ -0,0 +1,524 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from encrypted_file import EncryptedMessage, atomic_write
+from db.db_tools import SQLiteDB
+from db.meta import META_TABLE
+from db.migrations import ATTACHMENT_TABLE, REPLICA_ID_META_KEY, USER_TABLE, get_schema_version, migrate
+from key_check import verify_secret_key
+
+# 在线备份每步复制的页数和每步之后的停顿（秒），界面和其他写入可以在两步之间使用数据库
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.005
+# 定时备份的间隔（秒）和保留的还原点个数
+BACKUP_INTERVAL = 24 * 3600
+BACKUP_KEEP = 7
+# 增量备份目录中的文件：base.db 是最早的还原点，之后每个还原点是一个页增量文件，
+# latest.db 是最新还原点的完整副本，只用于计算下一次的增量
+BACKUP_MANIFEST = 'manifest.json'
+BACKUP_BASE = 'base.db'
+BACKUP_LATEST = 'latest.db'
+BACKUP_SNAPSHOT = 'snapshot.db'
+# 页增量文件：DELTA_MAGIC + 页大小(4 字节) + 总页数(4 字节)，之后是若干 页号(4 字节) + 页内容
+DELTA_MAGIC = b'LBXD\x01'
+# 加密导出：由库密钥按 encrypt_stream 格式加密的 JSON Lines，记录中的密文保持原样
+EXPORT_FORMAT = 'lockbox-export'
+EXPORT_VERSION = 1
+# 导出时每行附件内容的字节数
+EXPORT_ATTACHMENT_CHUNK = 1 << 20
+
+
+def hot_backup(db_path, dst_path, pages: int = BACKUP_STEP_PAGES, pause: float = BACKUP_STEP_PAUSE,
+               cancel_event: Optional[threading.Event] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """用 Connection.backup 在线复制数据库，复制期间程序可以照常读写
+
+    每步复制 pages 页后停顿 pause 秒；复制过程中数据库被其他连接修改时，SQLite 会在下一步从头重新复制，
+    因此结果总是某一时刻的一致快照。结果先写入同目录的临时文件，通过 quick_check 后才替换 dst_path。
+    :param db_path: 数据库文件路径
+    :param dst_path: 备份文件路径
+    :param pages: 每步复制的页数
+    :param pause: 每步之后的停顿秒数
+    :param cancel_event: 置位后在下一步之前停止，dst_path 保持原样
+    :param progress: 每步之后调用，参数为 (已复制页数, 总页数)
+    :return: 备份的总页数
+    :raises InterruptedError: 被 cancel_event 取消
+    """
+    dst_path = os.path.abspath(dst_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(dst_path)}.', suffix='.tmp',
+                                    dir=os.path.dirname(dst_path))
+    os.close(fd)
+    total = 0
+
+    def step(status, remaining, count):
+        nonlocal total
+        total = count
+        if progress is not None:
+            progress(count - remaining, count)
+        if cancel_event is not None and cancel_event.is_set():
+            raise InterruptedError("备份已取消")
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            with SQLiteDB(db_path, pooled=True) as db:
+                db.connection.backup(target, pages=pages, progress=step)
+            problems = [row[0] for row in target.execute("PRAGMA quick_check") if row[0] != 'ok']
+        finally:
+            target.close()
+        if problems:
+            raise sqlite3.DatabaseError(f"备份校验失败: {problems}")
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return total
+
+
+def _page_size(path) -> int:
+    with open(path, 'rb') as f:
+        size = struct.unpack('>H', f.read(100)[16:18])[0]
+    return 65536 if size == 1 else size
+
+
+def _file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_delta(old_path, new_path, delta_path):
+    """逐页比较两个数据库文件，把 new_path 中不同的页写入增量文件，内存占用与文件大小无关
+    :return: (变化的页数, old_path 的 sha256, new_path 的 sha256)
+    :raises ValueError: 两个文件的页大小不同
+    """
+    page_size = _page_size(new_path)
+    if _page_size(old_path) != page_size:
+        raise ValueError("页大小不同，无法计算增量")
+    page_count = os.path.getsize(new_path) // page_size
+    old_hash, new_hash = hashlib.sha256(), hashlib.sha256()
+    changed = 0
+    with open(old_path, 'rb') as old, open(new_path, 'rb') as new, atomic_write(delta_path) as out:
+        out.write(DELTA_MAGIC + struct.pack('>II', page_size, page_count))
+        for page_no in range(1, page_count + 1):
+            new_page, old_page = new.read(page_size), old.read(page_size)
+            new_hash.update(new_page)
+            old_hash.update(old_page)
+            if new_page != old_page:
+                out.write(struct.pack('>I', page_no) + new_page)
+                changed += 1
+        for block in iter(lambda: old.read(1 << 20), b''):
+            old_hash.update(block)
+    return changed, old_hash.hexdigest(), new_hash.hexdigest()
+
+
+def apply_delta(db_path, delta_path):
+    """把增量文件中的页写入 db_path（不能是正在使用的数据库），重复应用同一个增量结果不变"""
+    with open(delta_path, 'rb') as delta, open(db_path, 'r+b') as target:
+        header = delta.read(len(DELTA_MAGIC) + 8)
+        if header[:len(DELTA_MAGIC)] != DELTA_MAGIC:
+            raise ValueError(f"不是增量备份文件: {delta_path}")
+        page_size, page_count = struct.unpack('>II', header[len(DELTA_MAGIC):])
+        for entry in iter(lambda: delta.read(4), b''):
+            page = delta.read(page_size)
+            if len(entry) != 4 or len(page) != page_size:
+                raise ValueError(f"增量备份文件不完整: {delta_path}")
+            target.seek((struct.unpack('>I', entry)[0] - 1) * page_size)
+            target.write(page)
+        target.truncate(page_count * page_size)
+
+
+def load_manifest(backup_dir) -> Optional[Dict]:
+    """读取增量备份清单，没有备份时返回 None"""
+    path = os.path.join(backup_dir, BACKUP_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(backup_dir, manifest: Dict):
+    with atomic_write(os.path.join(backup_dir, BACKUP_MANIFEST)) as f:
+        f.write(json.dumps(manifest, indent=1).encode('utf-8'))
+
+
+def _points(manifest: Dict) -> List[Dict]:
+    points = [{'created_at': manifest['base']['created_at'], 'sha256': manifest['base']['sha256'], 'pages': None}]
+    points += [{'created_at': delta['created_at'], 'sha256': delta['sha256'], 'pages': delta['pages']}
+               for delta in manifest['deltas']]
+    return [{'index': index, **point} for index, point in enumerate(points)]
+
+
+def list_backups(backup_dir) -> List[Dict]:
+    """按时间顺序返回还原点 [{'index', 'created_at', 'sha256', 'pages'}]"""
+    manifest = load_manifest(backup_dir)
+    return [] if manifest is None else _points(manifest)
+
+
+def _materialize(backup_dir, manifest: Dict, index: int, dst_path):
+    """把第 index 个还原点写到 dst_path 并校验 sha256"""
+    points = _points(manifest)
+    with atomic_write(dst_path) as dst, open(os.path.join(backup_dir, BACKUP_BASE), 'rb') as base:
+        shutil.copyfileobj(base, dst, 1 << 20)
+    for delta in manifest['deltas'][:index]:
+        apply_delta(dst_path, os.path.join(backup_dir, delta['file']))
+    if _file_hash(dst_path) != points[index]['sha256']:
+        os.unlink(dst_path)
+        raise ValueError(f"还原点 {index} 校验失败")
+
+
+def restore_backup(backup_dir, index: int, dst_path):
+    """把增量备份的第 index 个还原点（见 list_backups，-1 为最新）恢复为 dst_path"""
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        raise LookupError("没有备份")
+    index = index % (len(manifest['deltas']) + 1)
+    _materialize(backup_dir, manifest, index, dst_path)
+
+
+def backup_due(backup_dir, interval: float = BACKUP_INTERVAL) -> bool:
+    """是否需要定时备份：还没有备份，或上次备份已超过 interval 秒"""
+    manifest = load_manifest(backup_dir)
+    return manifest is None or time.time() - manifest.get('last_run', 0) > interval
+
+
+def _apply_retention(backup_dir, manifest: Dict, keep: int):
+    """还原点超过 keep 个时把最早的增量合并进 base.db，合并在临时副本上完成后再替换"""
+    base_path = os.path.join(backup_dir, BACKUP_BASE)
+    while len(manifest['deltas']) + 1 > max(keep, 1):
+        delta = manifest['deltas'][0]
+        merged = os.path.join(backup_dir, BACKUP_BASE + '.merge')
+        _materialize(backup_dir, manifest, 1, merged)
+        os.replace(merged, base_path)
+        manifest['base'] = {'created_at': delta['created_at'], 'sha256': delta['sha256']}
+        manifest['deltas'].pop(0)
+        _save_manifest(backup_dir, manifest)
+        os.unlink(os.path.join(backup_dir, delta['file']))
+    # 清除上次中途退出留下、不在清单中的增量文件
+    listed = {delta['file'] for delta in manifest['deltas']}
+    for name in os.listdir(backup_dir):
+        if name.startswith('delta-') and name not in listed:
+            os.unlink(os.path.join(backup_dir, name))
+
+
+def scheduled_backup(db_path, backup_dir, keep: int = BACKUP_KEEP, pages: int = BACKUP_STEP_PAGES,
+                     pause: float = BACKUP_STEP_PAUSE, cancel_event: Optional[threading.Event] = None) -> Dict:
+    """增量备份：在线复制一份快照，与上一个还原点逐页比较，只保存变化的页，并按 keep 保留还原点
+
+    第一次备份或页大小改变（VACUUM 后）时重新开始一条备份链。先写增量文件、再更新清单、最后替换 latest.db，
+    任何一步中途退出，下次备份都能发现 latest.db 与清单不一致并由备份链重建。
+    :param db_path: 数据库文件路径
+    :param backup_dir: 备份目录
+    :param keep: 保留的还原点个数
+    :param pages: 见 hot_backup
+    :param pause: 见 hot_backup
+    :param cancel_event: 见 hot_backup
+    :return: {'created_at', 'pages', 'total_pages', 'elapsed'}，pages 为本次保存的页数，数据库未变化时为 0
+    """
+    start = time.perf_counter()
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = load_manifest(backup_dir)
+    latest = os.path.join(backup_dir, BACKUP_LATEST)
+    snapshot = os.path.join(backup_dir, BACKUP_SNAPSHOT)
+    total_pages = hot_backup(db_path, snapshot, pages, pause, cancel_event)
+    now = time.time()
+    page_size = _page_size(snapshot)
+    if manifest is None or manifest['page_size'] != page_size:
+        shutil.copyfile(snapshot, os.path.join(backup_dir, BACKUP_BASE))
+        manifest = {'page_size': page_size, 'base': {'created_at': now, 'sha256': _file_hash(snapshot)},
+                    'deltas': []}
+        _save_manifest(backup_dir, manifest)
+        os.replace(snapshot, latest)
+        saved = total_pages
+    else:
+        head = manifest['deltas'][-1]['sha256'] if manifest['deltas'] else manifest['base']['sha256']
+        delta_name = f'delta-{int(now * 1000)}.lbd'
+        delta_path = os.path.join(backup_dir, delta_name)
+        saved, old_hash, new_hash = write_delta(latest, snapshot, delta_path)
+        if old_hash != head:
+            _materialize(backup_dir, manifest, len(manifest['deltas']), latest)
+            saved, old_hash, new_hash = write_delta(latest, snapshot, delta_path)
+        if new_hash == old_hash:
+            saved = 0
+            os.unlink(delta_path)
+            os.unlink(snapshot)
+        else:
+            manifest['deltas'].append({'file': delta_name, 'created_at': now, 'sha256': new_hash, 'pages': saved})
+            _save_manifest(backup_dir, manifest)
+            os.replace(snapshot, latest)
+        _apply_retention(backup_dir, manifest, keep)
+    manifest['last_run'] = now
+    _save_manifest(backup_dir, manifest)
+    result = {'created_at': now, 'pages': saved, 'total_pages': total_pages, 'elapsed': time.perf_counter() - start}
+    print(f"备份完成：共 {total_pages} 页，保存 {saved} 页，用时 {result['elapsed']:.2f} 秒")
+    return result
+
+
+class IterReader(io.RawIOBase):
+    """把产出 bytes 的迭代器包装成可读的流"""
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = 0
+        while size < len(buffer):
+            if not self.pending:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.pending = memoryview(chunk)
+            count = min(len(buffer) - size, len(self.pending))
+            buffer[size:size + count] = self.pending[:count]
+            self.pending = self.pending[count:]
+            size += count
+        return size
+
+
+class LineWriter:
+    """按行拆分写入的数据，每一行交给 handler"""
+    def __init__(self, handler: Callable[[bytes], None]):
+        self.handler = handler
+        self.pending = b''
+
+    def write(self, data: bytes):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.handler(line)
+
+    def close(self):
+        if self.pending:
+            raise ValueError("导出文件不完整")
+
+
+def encode_row(row: Dict) -> Dict:
+    return {k: {'b64': base64.b64encode(v).decode('ascii')} if isinstance(v, bytes) else v for k, v in row.items()}
+
+
+def decode_row(row: Dict) -> Dict:
+    return {k: base64.b64decode(v['b64']) if isinstance(v, dict) else v for k, v in row.items()}
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def json_line(kind: str, row: Dict) -> bytes:
+    return _json_encoder.encode({'type': kind, 'row': encode_row(row)}).encode('utf-8') + b'\n'
+
+
+def _export_lines(db: SQLiteDB, counts: Dict, cancel_event: Optional[threading.Event]) -> Iterator[bytes]:
+    yield json_line('header', {'format': EXPORT_FORMAT, 'version': EXPORT_VERSION,
+                           'schema_version': get_schema_version(db), 'created_at': time.time()})
+    # record_id 为 NULL 的附件还在写入中，不导出
+    tables = ((META_TABLE, None, None), (USER_TABLE, None, None),
+              (ATTACHMENT_TABLE, ['id', 'record_id', 'name', 'size', 'data_key', 'created_at',
+                                  'length(data) AS data_size'], 'record_id IS NOT NULL'))
+    for table_name, columns, where in tables:
+        for row in db.iter_select(table_name, columns, where):
+            if cancel_event is not None and cancel_event.is_set():
+                raise InterruptedError("导出已取消")
+            counts[table_name] = counts.get(table_name, 0) + 1
+            yield json_line(table_name, row)
+            if table_name != ATTACHMENT_TABLE:
+                continue
+            # 附件内容已按 encrypt_stream 格式加密，通过 blobopen 分段读出，不整体载入内存
+            with db.connection.blobopen(ATTACHMENT_TABLE, 'data', row['id'], readonly=True) as blob:
+                for offset in range(0, row['data_size'], EXPORT_ATTACHMENT_CHUNK):
+                    yield json_line('attachment_data', {'id': row['id'], 'offset': offset,
+                                                    'data': blob.read(EXPORT_ATTACHMENT_CHUNK)})
+
+
+def export_vault(db_path, cipher: EncryptedMessage, dst_path, max_workers: Optional[int] = None,
+                 cancel_event: Optional[threading.Event] = None) -> Dict:
+    """把整个库流式导出为加密文件，可用 restore_export 恢复
+
+    meta、记录和附件逐行读出，写成 JSON Lines 后直接交给 encrypt_stream 分块加密，内存占用与库的大小无关。
+    记录中的密码、用户名和附件仍是原来的密文，恢复后需要同一个库密钥才能解密。
+    导出在一个读事务中完成，内容是开始时刻的一致快照；WAL 模式下不阻塞其他写入，
+    默认的回滚日志模式下其他写入的提交要等导出结束（超过 busy_timeout 时报错）。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器，导出文件用它的库密钥加密
+    :param dst_path: 导出文件路径，全部写完后原子地替换
+    :param max_workers: 并行加密的并发数
+    :param cancel_event: 置位后停止，dst_path 保持原样
+    :return: {表名: 行数, 'bytes': 导出的明文字节数, 'elapsed': 秒}
+    :raises KeyMismatch: cipher 不是本库的密钥
+    """
+    start = time.perf_counter()
+    counts = {}
+    with SQLiteDB(db_path, pooled=True) as db:
+        verify_secret_key(db, cipher.secret_key)
+        with db.transaction(immediate=False), atomic_write(dst_path) as dst:
+            source = io.BufferedReader(IterReader(_export_lines(db, counts, cancel_event)), 1 << 20)
+            counts['bytes'] = cipher.encrypt_stream(source, dst, max_workers=max_workers)
+    counts['elapsed'] = time.perf_counter() - start
+    print(f"导出完成：{counts.get(USER_TABLE, 0)} 条记录，{counts.get(ATTACHMENT_TABLE, 0)} 个附件，"
+          f"{counts['bytes'] / counts['elapsed'] / (1 << 20):.1f} MB/s")
+    return counts
+
+
+def restore_export(src_path, cipher: EncryptedMessage, db_path, max_workers: Optional[int] = None) -> Dict:
+    """把 export_vault 的导出文件恢复为新的数据库文件
+
+    边解密边按行写入，整个恢复在一个事务中完成，导出文件被改动或不完整时不会留下数据库文件。
+    :param src_path: 导出文件
+    :param cipher: 导出时使用的库密钥
+    :param db_path: 恢复到的数据库文件，不能已存在
+    :return: {表名: 行数}
+    :raises InvalidToken: 密钥不匹配或导出文件被改动
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} 已存在")
+    counts = {}
+    tmp_path = f'{db_path}.restoring'
+
+    def restore_line(line: bytes):
+        record = json.loads(line)
+        kind, row = record['type'], decode_row(record['row'])
+        if kind == 'header':
+            if row.get('format') != EXPORT_FORMAT or row.get('version') != EXPORT_VERSION:
+                raise ValueError("不支持的导出文件格式")
+            return
+        if not counts:
+            raise ValueError("导出文件缺少头部")
+        counts[kind] = counts.get(kind, 0) + 1
+        if kind == META_TABLE:
+            # 恢复出的库是一个新的同步副本，保留 migrate 生成的副本 id
+            if row['key'] != REPLICA_ID_META_KEY:
+                db.execute_sql(f"INSERT OR REPLACE INTO {META_TABLE} (key, value) VALUES (?, ?)",
+                               (row['key'], row['value']))
+        elif kind == ATTACHMENT_TABLE:
+            data_size = row.pop('data_size')
+            db.cursor.execute(f"INSERT INTO {ATTACHMENT_TABLE} ({', '.join(row)}, data) "
+                              f"VALUES ({', '.join('?' * len(row))}, zeroblob(?))", (*row.values(), data_size))
+        elif kind == 'attachment_data':
+            with db.connection.blobopen(ATTACHMENT_TABLE, 'data', row['id']) as blob:
+                blob.seek(row['offset'])
+                blob.write(row['data'])
+        else:
+            db.insert(USER_TABLE, row)
+
+    fts_trigger = f'{USER_TABLE}_fts_ai'
+    try:
+        with SQLiteDB(tmp_path) as db:
+            migrate(db)
+            counts['header'] = 0
+            trigger = db.select('sqlite_master', ['sql'], "type = 'trigger' AND name = ?", (fts_trigger,),
+                                fetch_all=False)
+            with db.transaction(), open(src_path, 'rb') as src:
+                # 新库不逐行维护全文索引，全部写入后一次重建，比逐行触发快一倍多
+                if trigger:
+                    db.execute_sql(f"DROP TRIGGER {fts_trigger}")
+                writer = LineWriter(restore_line)
+                cipher.decrypt_stream(src, writer, max_workers)
+                writer.close()
+                if trigger:
+                    db.execute_sql(f"INSERT INTO {USER_TABLE}_fts ({USER_TABLE}_fts) VALUES ('rebuild')")
+                    db.execute_sql(trigger[0]['sql'])
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(tmp_path + suffix):
+                os.unlink(tmp_path + suffix)
+        raise
+    counts.pop('header')
+    return counts
+
+
+def benchmark_backup(rows: int = 100000):
+    """在 rows 行的临时库上测量在线备份、增量备份和加密导出"""
+    from db.bench import fake_rows
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'vault.db')
+        backup_dir = os.path.join(tmp, 'backups')
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many(USER_TABLE, list(fake_rows(rows)))
+            # 测试数据的 pwd 不是真正的密文，直接采用测试密钥
+            verify_secret_key(db, cipher.secret_key, adopt=True)
+        size_mb = os.path.getsize(db_path) / (1 << 20)
+        for pause in (0, BACKUP_STEP_PAUSE):
+            start = time.perf_counter()
+            hot_backup(db_path, os.path.join(tmp, 'copy.db'), pause=pause)
+            elapsed = time.perf_counter() - start
+            print(f"在线备份 {size_mb:.1f} MB，每步停顿 {pause * 1000:.0f} ms: {elapsed:.2f} 秒")
+        scheduled_backup(db_path, backup_dir)
+        with SQLiteDB(db_path) as db:
+            db.update(USER_TABLE, {'site': 'changed.example.com'}, 'id <= 100')
+        result = scheduled_backup(db_path, backup_dir)
+        delta_size = sum(os.path.getsize(os.path.join(backup_dir, name)) for name in os.listdir(backup_dir)
+                         if name.startswith('delta-'))
+        print(f"修改 100 行后增量备份：{result['pages']}/{result['total_pages']} 页，"
+              f"增量文件 {delta_size / 1024:.0f} KB，{result['elapsed']:.2f} 秒")
+        export_path = os.path.join(tmp, 'vault.lbx')
+        counts = export_vault(db_path, cipher, export_path)
+        start = time.perf_counter()
+        restore_export(export_path, cipher, os.path.join(tmp, 'restored.db'))
+        print(f"加密导出 {counts['bytes'] / (1 << 20):.1f} MB: {counts['elapsed']:.2f} 秒，"
+              f"恢复 {time.perf_counter() - start:.2f} 秒")
+
+
+def main(argv=None):
+    import argparse
+
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+    parser = argparse.ArgumentParser(description="LockBox 备份、加密导出与恢复")
+    parser.add_argument('--db', default=os.path.join(config_dir, 'sqlite_db.db'), help="数据库文件")
+    parser.add_argument('--dir', default=os.path.join(config_dir, 'backups'), help="增量备份目录")
+    parser.add_argument('--key-file', default=os.path.join(config_dir, 'secret_key.skf'),
+                        help="库密钥文件，默认 config/secret_key.skf")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backup', help="立即执行一次增量备份")
+    commands.add_parser('list', help="列出还原点")
+    restore_parser = commands.add_parser('restore', help="把还原点恢复为新文件")
+    restore_parser.add_argument('index', type=int, help="还原点序号，-1 为最新")
+    restore_parser.add_argument('dst')
+    export_parser = commands.add_parser('export', help="加密导出整个库")
+    export_parser.add_argument('dst')
+    import_parser = commands.add_parser('restore-export', help="把加密导出文件恢复为新的数据库文件")
+    import_parser.add_argument('src')
+    import_parser.add_argument('dst')
+    commands.add_parser('bench', help="测量备份和导出的耗时")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        benchmark_backup()
+    elif args.command == 'backup':
+        scheduled_backup(args.db, args.dir)
+    elif args.command == 'list':
+        for point in list_backups(args.dir):
+            print(f"{point['index']:>3}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(point['created_at']))}"
+                  f"  {point['sha256'][:16]}")
+    elif args.command == 'restore':
+        restore_backup(args.dir, args.index, args.dst)
+    else:
+        with open(args.key_file, 'r', encoding='utf-8') as f:
+            cipher = EncryptedMessage(f.read().strip())
+        if args.command == 'export':
+            export_vault(args.db, cipher, args.dst)
+        else:
+            print(restore_export(args.src, cipher, args.dst))
+
+
+if __name__ == '__main__':
+    main()
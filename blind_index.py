@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import os
+import threading
+from typing import Dict, List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta
+from db.migrations import internal_rewrite
+from key_check import verify_secret_key
+
+# meta 表中保存被库密钥包装的盲索引密钥，以及用户名是否已改为加密存储
+BLIND_INDEX_META_KEY = 'blind_index_key'
+USER_NAME_ENCRYPTED_META_KEY = 'user_name_encrypted'
+# 盲索引截取的字节数，16 字节足以避免碰撞，同时不泄露完整的 HMAC
+BLIND_INDEX_SIZE = 16
+USER_NAME_BATCH_SIZE = 500
+# 未解锁时列表中代替加密用户名显示的文字
+ENCRYPTED_PLACEHOLDER = "（已加密）"
+
+
+def normalize(value: str) -> str:
+    """计算盲索引前统一大小写和首尾空白，使精确匹配不区分大小写"""
+    return value.strip().casefold()
+
+
+def compute(index_key: bytes, value: str) -> bytes:
+    """value 的盲索引：HMAC-SHA256 截断到 BLIND_INDEX_SIZE 字节"""
+    return hmac.new(index_key, normalize(value).encode('utf-8'), hashlib.sha256).digest()[:BLIND_INDEX_SIZE]
+
+
+def get_index_key(db: SQLiteDB, secret_key: str, create: bool = False) -> Optional[bytes]:
+    """读取盲索引密钥
+
+    盲索引密钥独立随机生成、由库密钥包装保存，密钥轮换时只需重新包装，已有的盲索引保持不变。
+    :param db: 已连接的 SQLiteDB
+    :param secret_key: 库密钥
+    :param create: 不存在时生成并保存，需在事务中调用
+    :return: 32 字节密钥，不存在且 create 为 False 时返回 None
+    :raises InvalidToken: secret_key 不是本库的密钥
+    """
+    wrapped = get_meta(db, BLIND_INDEX_META_KEY)
+    if wrapped is not None:
+        return Fernet(secret_key).decrypt(wrapped)
+    if not create:
+        return None
+    index_key = os.urandom(32)
+    set_meta(db, BLIND_INDEX_META_KEY, Fernet(secret_key).encrypt(index_key).decode('utf-8'))
+    return index_key
+
+
+def rewrap_index_key(db: SQLiteDB, old_key: str, new_key: str):
+    """密钥轮换时把盲索引密钥改为由新密钥包装"""
+    index_key = get_index_key(db, old_key)
+    if index_key is not None:
+        set_meta(db, BLIND_INDEX_META_KEY, Fernet(new_key).encrypt(index_key).decode('utf-8'))
+
+
+def is_user_name_encrypted(db: SQLiteDB) -> bool:
+    return get_meta(db, USER_NAME_ENCRYPTED_META_KEY) == '1'
+
+
+def user_name_values(db: SQLiteDB, cipher: EncryptedMessage, user_name: str) -> Dict:
+    """新写入记录时 user_name 相关列的值，用户名尚未改为加密存储时原样保存"""
+    if not is_user_name_encrypted(db):
+        return {'user_name': user_name}
+    index_key = get_index_key(db, cipher.secret_key)
+    return {'user_name': None, 'user_name_enc': cipher.encrypt_bytes(user_name),
+            'user_name_bidx': compute(index_key, user_name)}
+
+
+def decrypt_user_names(rows: List[Dict], cipher: Optional[EncryptedMessage]) -> List[Dict]:
+    """把查询结果中加密的用户名解密到 user_name，未解锁或无法解密时显示占位文字
+
+    rows 需包含 user_name 和 user_name_enc 列，返回的字典不再包含 user_name_enc。
+    """
+    for row in rows:
+        encrypted = row.pop('user_name_enc', None)
+        if row['user_name'] is None and encrypted is not None:
+            row['user_name'] = ENCRYPTED_PLACEHOLDER
+            if cipher is not None:
+                try:
+                    row['user_name'] = cipher.decrypt(encrypted)
+                except InvalidToken:
+                    pass
+    return rows
+
+
+def find_by_user_name(db: SQLiteDB, index_key: bytes, user_name: str, site: Optional[str] = None,
+                      columns: List[str] = None, table_name: str = 'user') -> List[Dict]:
+    """按用户名（可同时按网站）精确查找，由盲索引列上的索引完成，不需要解密
+
+    尚未加密的旧记录按明文 user_name 精确比较（区分大小写），同样走索引。
+    :param db: 已连接的 SQLiteDB
+    :param index_key: get_index_key 返回的密钥
+    :param user_name: 用户名，不区分大小写和首尾空白
+    :param site: 网站，None 表示不限
+    :param columns: 要返回的列名列表
+    :param table_name: 表名
+    """
+    where = "(user_name_bidx = ? OR user_name = ?)"
+    params = (compute(index_key, user_name), user_name)
+    if site is not None:
+        where = f"site = ? AND {where}"
+        params = (site,) + params
+    return db.select(table_name, columns, where, params)
+
+
+def encrypt_user_names(db_path, cipher: EncryptedMessage, table_name: str = 'user',
+                       batch_size: int = USER_NAME_BATCH_SIZE, cancel_event: Optional[threading.Event] = None,
+                       enable: bool = False, vacuum: bool = False) -> int:
+    """把明文用户名在线改为加密存储并建立盲索引，需要已解锁的密码器
+
+    加密后用户名不再进入全文索引，只能输入完整用户名精确查找，因此只在用户明确选择后开启（enable）；
+    开启后解锁时再调用，继续未完成的转换或加密同步收到的明文用户名。
+    先确认 cipher 是本库的密钥，避免用错误的密钥加密用户名；之后新写入的记录直接加密，
+    已有记录按 id 分批转换，每批一个短事务，中途取消后再次调用即可继续。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器
+    :param table_name: 表名
+    :param batch_size: 每个事务转换的行数
+    :param cancel_event: 置位后在当前批次结束时停止
+    :param enable: True 时开启用户名加密，False 时尚未开启则什么也不做
+    :param vacuum: 全部转换后 VACUUM 整个库，清除旧页面中残留的明文；期间其他连接无法写入
+    :return: 转换的行数
+    :raises KeyMismatch: cipher 不是本库的密钥
+    """
+    converted = 0
+    with SQLiteDB(db_path, pooled=True) as db:
+        if not enable and not is_user_name_encrypted(db):
+            return 0
+        verify_secret_key(db, cipher.secret_key, table_name=table_name)
+        with db.transaction():
+            index_key = get_index_key(db, cipher.secret_key, create=True)
+            set_meta(db, USER_NAME_ENCRYPTED_META_KEY, '1')
+        # 被改写的明文用零覆盖，不留在空闲页和页内空隙中
+        secure_delete = db.connection.execute("PRAGMA secure_delete").fetchone()[0]
+        db.connection.execute("PRAGMA secure_delete = ON")
+        try:
+            after_id = None
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                rows = db.select_page(table_name, after_id, batch_size, columns=['id', 'user_name'],
+                                      where='user_name IS NOT NULL')
+                if not rows:
+                    if converted or vacuum:
+                        _scrub_user_names(db, table_name, vacuum)
+                    break
+                after_id = rows[-1]['id']
+                # 只改变用户名的存储形式，不作为本地修改同步
+                with db.transaction(), internal_rewrite(db):
+                    for row in rows:
+                        db.cursor.execute(
+                            f"UPDATE {table_name} SET user_name = NULL, user_name_enc = ?, user_name_bidx = ? "
+                            f"WHERE id = ? AND user_name = ?",
+                            (cipher.encrypt_bytes(row['user_name']), compute(index_key, row['user_name']),
+                             row['id'], row['user_name']))
+                        converted += db.cursor.rowcount
+        finally:
+            db.connection.execute(f"PRAGMA secure_delete = {secure_delete}")
+    if converted:
+        print(f"已加密 {converted} 条用户名")
+    return converted
+
+
+def _scrub_user_names(db: SQLiteDB, table_name: str, vacuum: bool):
+    """用户名全部加密后清除全文索引中残留的明文，需在 secure_delete 打开时调用
+
+    改写用户名时触发器写入的删除标记本身带有旧的三元组，按 user 表重建索引后才会消失；
+    重建只改索引内容，表结构仍由迁移维护，user_name 恒为 NULL，不会再进入索引。
+    vacuum 为 True 时再 VACUUM 一次，清除开启 secure_delete 之前留下的空闲页，WAL 模式下同时截断 WAL。
+    """
+    fts = f'{table_name}_fts'
+    if db.select('sqlite_master', ['name'], "type = 'table' AND name = ?", (fts,), fetch_all=False):
+        with db.transaction():
+            db.execute_sql(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    if not vacuum:
+        return
+    db.connection.execute("VACUUM")
+    db.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    print("已清除明文用户名的残留")
@@ -0,0 +1,304 @@
+"""数据库性能测试脚本
+
+用法: python -m db.bench profiles
+在临时目录中生成测试库，不会改动 config 下的真实数据库。
+"""
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from db.db_tools import SQLiteDB, PRAGMA_PROFILES
+from db.migrations import migrate
+from db.pwd_storage import PWD_STORAGE_BLOB, convert_pwd_storage
+
+
+@contextmanager
+def timer(label: str, count: int = 0):
+    """打印代码块耗时，count 不为 0 时同时打印单次耗时"""
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    if count:
+        print(f"  {label:<28} {elapsed * 1000:9.1f} ms  ({elapsed / count * 1e6:8.1f} us/次)")
+    else:
+        print(f"  {label:<28} {elapsed * 1000:9.1f} ms")
+
+
+def fake_rows(count: int, start: int = 1):
+    """生成测试数据，pwd 长度与 Fernet 密文相当"""
+    for i in range(start, start + count):
+        yield {'id': i, 'site': f'site{i % 5000}.example.com', 'user_name': f'user{i}@example.com',
+               'pwd': 'gAAAAA' + 'x' * 94}
+
+
+def bench_profiles(commits: int = 500, rows: int = 100000, lookups: int = 20000):
+    """比较各 PRAGMA 配置下逐条提交、批量插入和按 id 查询的耗时"""
+    for name in PRAGMA_PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            print(f"[{name}]")
+            with SQLiteDB(db_path, profile=name) as db:
+                db.create_table('user', {'id': 'INTEGER', 'user_name': 'TEXT', 'pwd': 'TEXT', 'site': 'TEXT'}, 'id')
+                with timer(f'逐条提交 x{commits}', commits):
+                    for data in fake_rows(commits, start=rows + 1):
+                        db.insert('user', data)
+                with timer(f'批量插入 x{rows}', rows):
+                    db.insert_many('user', list(fake_rows(rows)))
+                with timer(f'按 id 查询 x{lookups}', lookups):
+                    for i in range(lookups):
+                        db.select('user', ['pwd'], 'id = ?', (i * 7 % rows + 1,), fetch_all=False)
+                with timer(f'拼接 SQL 查询 x{lookups}', lookups):
+                    for i in range(lookups):
+                        db.select('user', ['pwd'], f'id={i * 7 % rows + 1}', fetch_all=False)
+
+
+def make_vault(db_path: str, rows: int):
+    """生成含 rows 条记录的测试库"""
+    with SQLiteDB(db_path) as db:
+        db.create_table('user', {'id': 'INTEGER', 'user_name': 'TEXT', 'pwd': 'TEXT', 'site': 'TEXT'}, 'id')
+        db.insert_many('user', list(fake_rows(rows)))
+
+
+def peak_memory(func) -> float:
+    """返回执行 func 期间 Python 堆的峰值（MB）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_streaming(sizes=(10000, 100000)):
+    """比较 select 全量读取、iter_select 流式读取与 select_page 翻页的峰值内存"""
+    columns = ['id', 'user_name', 'pwd', 'site']
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            make_vault(db_path, rows)
+            print(f"[{rows} 行]")
+            with SQLiteDB(db_path) as db:
+                def full():
+                    for _ in db.select('user', columns):
+                        pass
+
+                def stream():
+                    for _ in db.iter_select('user', columns):
+                        pass
+
+                def pages():
+                    after_id = None
+                    while True:
+                        page = db.select_page('user', after_id, 500, columns=columns)
+                        if not page:
+                            break
+                        after_id = page[-1]['id']
+
+                for label, func in (('select', full), ('iter_select', stream), ('select_page', pages)):
+                    with timer(label):
+                        peak = peak_memory(func)
+                    print(f"  {'':<28} 峰值 {peak:6.1f} MB")
+
+
+def bench_indexes(rows: int = 100000, lookups: int = 500):
+    """比较迁移（建索引）前后按网站、用户名查找的耗时"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_vault(db_path, rows)
+        with SQLiteDB(db_path) as db:
+            for label in ('迁移前', '迁移后'):
+                print(f"[{label}, {rows} 行]")
+                with timer(f'按网站查找 x{lookups}', lookups):
+                    for i in range(lookups):
+                        db.select('user', ['id', 'pwd'], 'site = ?', (f'site{i * 7 % 5000}.example.com',))
+                with timer(f'按用户名查找 x{lookups}', lookups):
+                    for i in range(lookups):
+                        db.select('user', ['id', 'pwd'], 'user_name = ?', (f'user{i * 7 % rows + 1}@example.com',))
+                with timer(f'网站+用户名去重 x{lookups}', lookups):
+                    for i in range(lookups):
+                        n = i * 7 % rows + 1
+                        db.select('user', ['id'], 'site = ? AND user_name = ?',
+                                  (f'site{n % 5000}.example.com', f'user{n}@example.com'), fetch_all=False)
+                if label == '迁移前':
+                    with timer('执行迁移'):
+                        migrate(db)
+
+
+def bench_search(rows: int = 100000, queries: int = 200):
+    """比较 FTS5 三元组搜索与 LIKE '%...%' 全表扫描"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_vault(db_path, rows)
+        with SQLiteDB(db_path) as db:
+            with timer('执行迁移（含建立全文索引）'):
+                migrate(db)
+            print(f"[{rows} 行]")
+            with timer(f'search 子串 x{queries}', queries):
+                for i in range(queries):
+                    db.search(f'er{i * 37 % rows}@', 50)
+            with timer(f'LIKE 扫描 x{queries}', queries):
+                for i in range(queries):
+                    pattern = f'%er{i * 37 % rows}@%'
+                    db.select('user', ['id'], 'site LIKE ? OR user_name LIKE ? LIMIT 50', (pattern, pattern))
+
+
+def bench_blob(rows: int = 100000, backends=('fernet', 'aes-gcm')):
+    """比较密文以 base64 TEXT 与原始字节 BLOB 存储时的库文件大小和读取解码耗时"""
+    from encrypted_file import EncryptedMessage
+    key = EncryptedMessage.generate_secret_key()
+    for backend in backends:
+        cipher = EncryptedMessage(key, backend=backend)
+        datas = list(fake_rows(rows))
+        for data in datas:
+            data['pwd'] = cipher.encrypt(f"P@ssw0rd-{data['id']:08d}")
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            with SQLiteDB(db_path) as db:
+                db.create_table('user', {'id': 'INTEGER', 'user_name': 'TEXT', 'pwd': 'TEXT', 'site': 'TEXT'}, 'id')
+                db.insert_many('user', datas)
+                migrate(db)
+            print(f"[{backend}, {rows} 行]")
+            for storage in ('text', PWD_STORAGE_BLOB):
+                if storage == PWD_STORAGE_BLOB:
+                    with timer('在线转换为 BLOB'):
+                        convert_pwd_storage(db_path, PWD_STORAGE_BLOB)
+                with SQLiteDB(db_path) as db:
+                    db.execute_sql("VACUUM")
+                    print(f"  {storage:<5} 库文件 {os.path.getsize(db_path) / 1024 / 1024:6.2f} MB")
+                    values = [row['pwd'] for row in db.iter_select('user', ['pwd'])]
+                with timer(f'{storage} 读取为原始密文', rows):
+                    for value in values:
+                        if isinstance(value, str):
+                            base64.urlsafe_b64decode(value)
+                with timer(f'{storage} 解密', rows):
+                    for value in values:
+                        cipher.decrypt(value)
+
+
+def bench_blind_index(rows: int = 100000, lookups: int = 1000, scans: int = 3):
+    """比较加密用户名按盲索引精确查找与逐条解密扫描的耗时"""
+    import blind_index
+    from encrypted_file import EncryptedMessage
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        datas = list(fake_rows(rows))
+        for data, (pwd, _) in zip(datas, cipher.encrypt_many((data['pwd'] for data in datas), raw=True)):
+            data['pwd'] = pwd
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many('user', datas)
+        with timer(f'加密已有用户名 x{rows}', rows):
+            blind_index.encrypt_user_names(db_path, cipher, enable=True)
+        with SQLiteDB(db_path) as db:
+            index_key = blind_index.get_index_key(db, cipher.secret_key)
+            print(f"[{rows} 行]")
+            with timer(f'盲索引查找 x{lookups}', lookups):
+                for i in range(lookups):
+                    blind_index.find_by_user_name(db, index_key, f'user{i * 97 % rows + 1}@example.com',
+                                                  columns=['id'])
+            with timer(f'网站+盲索引去重 x{lookups}', lookups):
+                for i in range(lookups):
+                    n = i * 97 % rows + 1
+                    blind_index.find_by_user_name(db, index_key, f'user{n}@example.com',
+                                                  site=f'site{n % 5000}.example.com', columns=['id'])
+            with timer(f'解密扫描 x{scans}', scans):
+                for i in range(scans):
+                    target = f'user{rows - i}@example.com'
+                    for row in db.iter_select('user', ['id', 'user_name_enc']):
+                        if cipher.decrypt(row['user_name_enc']) == target:
+                            break
+
+
+def bench_key_check(rows: int = 100000, checks: int = 1000):
+    """比较用校验值确认密钥与并行扫描全库查找其他密钥加密的记录的耗时"""
+    import key_check
+    from encrypted_file import EncryptedMessage
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    foreign = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        datas = list(fake_rows(rows))
+        for data, (pwd, _) in zip(datas, cipher.encrypt_many((data['pwd'] for data in datas), raw=True)):
+            data['pwd'] = pwd
+        # 每 1000 条混入一条其他密钥加密的记录
+        for data in datas[::1000]:
+            data['pwd'] = foreign.encrypt_bytes('foreign')
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many('user', datas)
+            key_check.verify_secret_key(db, cipher.secret_key)
+            print(f"[{rows} 行]")
+            with timer(f'校验值确认密钥 x{checks}', checks):
+                for _ in range(checks):
+                    key_check.verify_secret_key(db, cipher.secret_key)
+        for label, processes in (('线程池', False), ('进程池', True)):
+            with timer(f'扫描其他密钥的记录（{label}）', rows):
+                scanned, found = key_check.find_foreign_rows(db_path, cipher, processes=processes)
+            print(f"  {'':<28} 扫描 {scanned} 条，发现 {len(found)} 条")
+
+
+def bench_scrub(rows: int = 100000, writes: int = 200):
+    """完整性检查的吞吐量，以及检查期间另一个连接逐条写入的延迟"""
+    import threading
+    import scrubber
+    from encrypted_file import EncryptedMessage
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        datas = list(fake_rows(rows))
+        for data, (pwd, _) in zip(datas, cipher.encrypt_many((data['pwd'] for data in datas), raw=True)):
+            data['pwd'] = pwd
+        # 每 1000 行改坏一个密文，检查应当全部发现
+        for data in datas[::1000]:
+            data['pwd'] = data['pwd'][:-1] + bytes([data['pwd'][-1] ^ 1])
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many('user', datas)
+        print(f"[{rows} 行，{len(datas[::1000])} 个损坏]")
+        for round_, duty_cycle in enumerate((1.0, scrubber.SCRUB_DUTY_CYCLE)):
+            result = {}
+
+            def run():
+                start = time.perf_counter()
+                result['state'] = scrubber.scrub_vault(db_path, cipher, duty_cycle=duty_cycle)
+                result['wall'] = time.perf_counter() - start
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            latencies = []
+            with SQLiteDB(db_path) as db:
+                for data in fake_rows(writes, start=rows + 1 + round_ * writes):
+                    start = time.perf_counter()
+                    db.insert('user', {**data, 'pwd': cipher.encrypt_bytes('x')})
+                    latencies.append(time.perf_counter() - start)
+                    time.sleep(0.005)
+            thread.join()
+            state = result['state']
+            print(f"  duty_cycle={duty_cycle}: {state['verified']} 个密文, {state['failed']} 个问题, 墙钟 {result['wall']:.2f} s "
+                  f"({state['verified'] / result['wall']:.0f} 个/秒), 工作 {state['elapsed']:.2f} s")
+            print(f"  {'':<28} 同时写入 x{writes}: 平均 {sum(latencies) / writes * 1000:.2f} ms, "
+                  f"最大 {max(latencies) * 1000:.2f} ms")
+
+
+BENCHMARKS = {
+    'profiles': bench_profiles,
+    'streaming': bench_streaming,
+    'indexes': bench_indexes,
+    'search': bench_search,
+    'blob': bench_blob,
+    'blind_index': bench_blind_index,
+    'key_check': bench_key_check,
+    'scrub': bench_scrub,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for bench_name in names:
+        print(f"== {bench_name} ==")
+        BENCHMARKS[bench_name]()
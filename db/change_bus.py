@@ -0,0 +1,70 @@
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+class RowChange(NamedTuple):
+    """一组行级变更：表名、操作（INSERT/UPDATE/DELETE）和行 id"""
+    table: str
+    op: str
+    ids: Tuple[int, ...]
+
+
+class ChangeBus:
+    """进程内的变更通知
+
+    SQLiteDB 每次提交后调用 committed，由为该数据库注册的提交监听器（ChangeFeed）读出新的行级变更，
+    再通过 publish 发给订阅者。回调都在调用方线程中执行，界面需要自行转回 GUI 线程。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[List[RowChange]], None]] = []
+        self._commit_listeners: Dict[str, List[Callable[[], None]]] = {}
+
+    @staticmethod
+    def _key(db_path) -> str:
+        return os.path.abspath(str(db_path))
+
+    def subscribe(self, callback: Callable[[List[RowChange]], None]):
+        """订阅行级变更，callback 的参数为 RowChange 列表"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[List[RowChange]], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, changes: List[RowChange]):
+        if not changes:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(changes)
+
+    def add_commit_listener(self, db_path, callback: Callable[[], None]):
+        with self._lock:
+            self._commit_listeners.setdefault(self._key(db_path), []).append(callback)
+
+    def remove_commit_listener(self, db_path, callback: Callable[[], None]):
+        with self._lock:
+            listeners = self._commit_listeners.get(self._key(db_path), [])
+            if callback in listeners:
+                listeners.remove(callback)
+
+    def committed(self, db_path):
+        """本进程对 db_path 的一次提交已完成"""
+        if not self._commit_listeners:
+            return
+        with self._lock:
+            listeners = list(self._commit_listeners.get(self._key(db_path), ()))
+        for callback in listeners:
+            callback()
+
+
+change_bus = ChangeBus()
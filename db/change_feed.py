@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+from typing import List, Optional
+
+from db.change_bus import DELETE, INSERT, UPDATE, ChangeBus, RowChange, change_bus
+from db.db_tools import open_connection
+from db.migrations import SYNC_CHANGE_TABLE, USER_TABLE
+
+
+class ChangeFeed:
+    """把变更日志（sync_change）中的新条目转换为行级变更，发布到 ChangeBus
+
+    变更日志由触发器维护，任何连接、任何进程对 user 表的修改都会记入其中，按 seq 游标读取即可得到
+    发生变化的行 id。本进程的提交由 SQLiteDB 通知后立即读取；其他进程的提交由定时调用 poll 发现：
+    PRAGMA data_version 只在其他连接提交后变化，没有变化时不查询变更日志。
+    删除的行报告为 DELETE，id 大于已知最大 id 的行报告为 INSERT，其余为 UPDATE。
+    """
+    def __init__(self, db_path, bus: ChangeBus = change_bus):
+        self.db_path = db_path
+        self.bus = bus
+        # 独立连接只用于读取，可能在提交者所在的任意线程中使用，由锁串行化
+        self.connection = open_connection(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.data_version = None
+        self.cursor: Optional[int] = None
+        self.max_id = 0
+        with self.lock:
+            self._start()
+        bus.add_commit_listener(db_path, self.poll)
+
+    def _start(self):
+        """确定读取起点，之前的修改已包含在界面读到的数据中"""
+        self.data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        try:
+            self.cursor, self.max_id = self.connection.execute(
+                f"SELECT (SELECT coalesce(max(seq), 0) FROM {SYNC_CHANGE_TABLE}), "
+                f"(SELECT coalesce(max(id), 0) FROM {USER_TABLE})").fetchone()
+        except sqlite3.OperationalError:
+            # 数据库尚未迁移到有变更日志的版本，下次 poll 再试
+            self.cursor = None
+
+    def poll(self) -> List[RowChange]:
+        """读取上次调用后的新变更并发布，返回发布的变更"""
+        with self.lock:
+            if self.connection is None:
+                return []
+            if self.cursor is None:
+                self._start()
+                return []
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return []
+            self.data_version = version
+            rows = self.connection.execute(
+                f"SELECT seq, record_id, deleted FROM {SYNC_CHANGE_TABLE} WHERE seq > ? ORDER BY seq",
+                (self.cursor,)).fetchall()
+            if not rows:
+                return []
+            self.cursor = rows[-1]['seq']
+            ids = {INSERT: [], UPDATE: [], DELETE: []}
+            for row in rows:
+                record_id = row['record_id']
+                if record_id is None:
+                    continue
+                if row['deleted']:
+                    ids[DELETE].append(record_id)
+                elif record_id > self.max_id:
+                    ids[INSERT].append(record_id)
+                else:
+                    ids[UPDATE].append(record_id)
+            self.max_id = max([self.max_id] + ids[INSERT])
+        changes = [RowChange(USER_TABLE, op, tuple(op_ids)) for op, op_ids in ids.items() if op_ids]
+        self.bus.publish(changes)
+        return changes
+
+    def close(self):
+        self.bus.remove_commit_listener(self.db_path, self.poll)
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
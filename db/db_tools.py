@@ -1,14 +1,239 @@
+import atexit
 import sqlite3
-from typing import Optional, List, Dict, Any
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Tuple, Union, Iterator
 import os
 
+from db.change_bus import change_bus
+
+
+# 连接时应用的 PRAGMA 配置，按持久性从高到低排列
+# journal_mode=WAL 会写入数据库文件并一直保留，之后所有打开它的进程都使用 WAL。WAL 依赖共享内存（-shm 文件），
+# 库文件所在的目录须在本机：网络驱动器、网盘或多台机器共享的同步文件夹上使用 WAL 可能导致数据库损坏。
+# 因此默认沿用 SQLite 默认的回滚日志，'balanced' 和 'fast' 只在确定库文件在本地磁盘时显式选用。
+PRAGMA_PROFILES = {
+    # 回滚日志 + 每次提交完整 fsync，断电也不丢已提交的数据，库文件可以放在任何位置
+    'durable': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'temp_store': 'DEFAULT',
+        'mmap_size': 0,
+        'busy_timeout': 5000,
+    },
+    # WAL + NORMAL：断电可能丢失最后几次提交，但数据库不会损坏；仅限本地磁盘
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -8000,
+        'temp_store': 'MEMORY',
+        'mmap_size': 64 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+    # WAL，不做 fsync，仅适合本地磁盘上脚本批量导入等可重跑的场景
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -32000,
+        'temp_store': 'MEMORY',
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+}
+DEFAULT_PROFILE = 'durable'
+# sqlite3 模块内部的预编译语句缓存大小
+STATEMENT_CACHE_SIZE = 256
+
+Profile = Union[str, Dict[str, Any], None]
+
+
+class VaultConnection(sqlite3.Connection):
+    """记录显式事务嵌套层数的连接，同一连接上的所有 SQLiteDB 共享事务状态"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transaction_depth = 0
+
+
+def apply_pragmas(connection: sqlite3.Connection, profile: Profile = DEFAULT_PROFILE):
+    """对连接应用 PRAGMA 配置
+    :param connection: sqlite3 连接
+    :param profile: PRAGMA_PROFILES 中的名称，或自定义的 {pragma: value} 字典，None 表示不设置
+    """
+    if profile is None:
+        return
+    pragmas = PRAGMA_PROFILES[profile] if isinstance(profile, str) else profile
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+
+
+def open_connection(db_path, profile: Profile = DEFAULT_PROFILE, **kwargs) -> sqlite3.Connection:
+    """打开连接并完成 row_factory 和 PRAGMA 设置
+    :param db_path: 数据库文件路径
+    :param profile: PRAGMA 配置
+    :return: sqlite3 连接
+    """
+    connection = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE,
+                                 factory=VaultConnection, **kwargs)
+    # 设置返回字典格式的结果
+    connection.row_factory = sqlite3.Row
+    apply_pragmas(connection, profile)
+    return connection
+
+
+# 以下函数按语句形状缓存生成的 SQL，值一律通过 ? 绑定，
+# 相同形状得到同一个字符串，从而命中 sqlite3 的预编译语句缓存
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _select_sql(table_name: str, columns: Optional[Tuple[str, ...]], where: Optional[str]) -> str:
+    cols = '*' if columns is None else ', '.join(columns)
+    sql = f"SELECT {cols} FROM {table_name}"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _page_sql(table_name: str, columns: Optional[Tuple[str, ...]], where: Optional[str],
+              order_by: str, descending: bool, has_after: bool) -> str:
+    cols = '*' if columns is None else ', '.join(columns)
+    conditions = [f"({where})"] if where else []
+    op = '<' if descending else '>'
+    if has_after:
+        if order_by == 'id':
+            conditions.append(f"id {op} ?")
+        else:
+            # 非唯一排序列以 id 作为第二关键字，保证翻页不重不漏
+            conditions.append(f"({order_by}, id) {op} ((SELECT {order_by} FROM {table_name} WHERE id = ?), ?)")
+    sql = f"SELECT {cols} FROM {table_name}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    direction = 'DESC' if descending else 'ASC'
+    if order_by == 'id':
+        sql += f" ORDER BY id {direction} LIMIT ?"
+    else:
+        sql += f" ORDER BY {order_by} {direction}, id {direction} LIMIT ?"
+    return sql
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _search_sql(table_name: str, columns: Tuple[str, ...], use_fts: bool, terms: int = 1) -> str:
+    cols = ', '.join(f"t.{c}" for c in columns)
+    if use_fts:
+        return (f"SELECT {cols} FROM {table_name}_fts f JOIN {table_name} t ON t.id = f.rowid "
+                f"WHERE {table_name}_fts MATCH ? ORDER BY f.rank LIMIT ?")
+    # 每个词一组条件，组之间为 AND
+    where = ' AND '.join(["(t.site LIKE ? ESCAPE '\\' OR t.user_name LIKE ? ESCAPE '\\')"] * terms)
+    return f"SELECT {cols} FROM {table_name} t WHERE {where} ORDER BY t.id DESC LIMIT ?"
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _insert_sql(table_name: str, columns: Tuple[str, ...]) -> str:
+    placeholders = ', '.join(['?'] * len(columns))
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _update_sql(table_name: str, columns: Tuple[str, ...], where: str) -> str:
+    set_clause = ', '.join([f"{k} = ?" for k in columns])
+    return f"UPDATE {table_name} SET {set_clause} WHERE {where}"
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _delete_sql(table_name: str, where: str) -> str:
+    return f"DELETE FROM {table_name} WHERE {where}"
+
+
+class ConnectionManager:
+    """按线程维护长连接，进程存活期间复用同一个 sqlite3 连接
+
+    每个 (线程, 数据库路径, PRAGMA 配置) 只打开一次连接，不同配置使用各自的连接，
+    以免例如 'fast'（synchronous=OFF）的连接被之后的普通写入复用。出错时可重置，进程退出时统一关闭。
+    同一线程中一个配置的连接持有写事务时，不要再用另一个配置的连接写入同一个库，后者会等待前者的锁。
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 记录所有线程打开的连接，便于退出时统一关闭
+        self._connections = {}
+
+    def _thread_connections(self) -> Dict[Tuple[str, Any], sqlite3.Connection]:
+        """当前线程持有的连接字典"""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    @staticmethod
+    def _key(db_path, profile: Profile) -> Tuple[str, Any]:
+        if isinstance(profile, dict):
+            profile = tuple(sorted(profile.items()))
+        return str(db_path), profile
+
+    def get(self, db_path, profile: Profile = DEFAULT_PROFILE) -> sqlite3.Connection:
+        """获取当前线程对应数据库和 PRAGMA 配置的连接，不存在时创建
+        :param db_path: 数据库文件路径
+        :param profile: 连接使用的 PRAGMA 配置
+        :return: sqlite3 连接
+        """
+        key = self._key(db_path, profile)
+        connections = self._thread_connections()
+        connection = connections.get(key)
+        if connection is None:
+            # check_same_thread=False 仅用于退出时跨线程关闭，连接本身只在所属线程使用
+            connection = open_connection(str(db_path), profile, check_same_thread=False)
+            connections[key] = connection
+            with self._lock:
+                self._connections[(threading.get_ident(),) + key] = connection
+            print(f"已连接到数据库: {db_path}")
+        return connection
+
+    def reset(self, db_path, profile: Profile = DEFAULT_PROFILE):
+        """丢弃当前线程的连接（回滚未提交的事务），下次 get 时重新连接
+        :param db_path: 数据库文件路径
+        :param profile: 连接使用的 PRAGMA 配置
+        """
+        key = self._key(db_path, profile)
+        connection = self._thread_connections().pop(key, None)
+        with self._lock:
+            self._connections.pop((threading.get_ident(),) + key, None)
+        if connection is not None:
+            try:
+                connection.rollback()
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+    def close_all(self):
+        """关闭所有线程打开的连接，在程序退出时调用；之后各线程再 get 时重新连接"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            # 换一个新的线程局部存储，各线程缓存的已关闭连接随旧的一起丢弃
+            self._local = threading.local()
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+        if connections:
+            print(f"已关闭 {len(connections)} 个数据库连接")
+
+
+connection_manager = ConnectionManager()
+atexit.register(connection_manager.close_all)
+
 
 class SQLiteDB:
-    def __init__(self, db_path: str = "database.db"):
+    def __init__(self, db_path: str = "database.db", pooled: bool = False, profile: Profile = DEFAULT_PROFILE):
         """初始化数据库连接
         :param db_path: 数据库文件路径，例如 'D:/data.db'
+        :param pooled: True 时从 connection_manager 获取当前线程的长连接，close 不会真正关闭连接
+        :param profile: 连接时应用的 PRAGMA 配置，见 PRAGMA_PROFILES
         """
         self.db_path = db_path
+        self.pooled = pooled
+        self.profile = profile
         self.connection = None
         self.cursor = None
 
@@ -18,53 +243,134 @@ class SQLiteDB:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """退出with语句时自动关闭连接"""
+        """退出with语句时自动关闭连接，长连接出现数据库错误时重置
+
+        其他异常（例如取消任务抛出的 InterruptedError）不影响连接，只回滚 transaction() 之外未提交的修改，
+        保留该线程的连接和预编译语句缓存。
+        """
+        connection = self.connection
         self.close()
+        if exc_type is None or not self.pooled:
+            return
+        if issubclass(exc_type, sqlite3.Error):
+            connection_manager.reset(self.db_path, self.profile)
+        elif connection is not None and connection.in_transaction and connection.transaction_depth == 0:
+            connection.rollback()
 
     def connect(self):
         """连接数据库"""
-        self.connection = sqlite3.connect(self.db_path)
-        # 设置返回字典格式的结果
-        self.connection.row_factory = sqlite3.Row
+        if self.pooled:
+            self.connection = connection_manager.get(self.db_path, self.profile)
+            self.cursor = self.connection.cursor()
+            return
+        self.connection = open_connection(self.db_path, self.profile)
         self.cursor = self.connection.cursor()
         print(f"已连接到数据库: {self.db_path}")
 
     def close(self):
         """关闭数据库连接"""
+        if self.pooled:
+            # 长连接归还给 connection_manager，只释放游标
+            if self.cursor is not None:
+                self.cursor.close()
+            self.cursor = None
+            self.connection = None
+            return
         if self.connection:
             self.connection.close()
             print("数据库连接已关闭")
 
-    def create_table(self, table_name: str, columns: Dict[str, str], primary_key: Optional[str] = None):
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """显式事务（工作单元），块内的 insert/update/delete 不再逐条提交
+
+        正常退出时提交一次，抛出异常时回滚。嵌套调用使用 SAVEPOINT，
+        只有最外层退出时才真正提交；提交返回后数据已按当前 PRAGMA 配置落盘。
+        :param immediate: True 时使用 BEGIN IMMEDIATE，进入事务即取得写锁
+        """
+        connection = self.connection
+        depth = connection.transaction_depth
+        if depth == 0:
+            if connection.in_transaction:
+                # 提交 sqlite3 隐式开启的事务，避免与显式 BEGIN 冲突
+                connection.commit()
+            connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        else:
+            connection.execute(f"SAVEPOINT sp_{depth}")
+        connection.transaction_depth = depth + 1
+        try:
+            yield self
+        except BaseException:
+            connection.transaction_depth = depth
+            if depth == 0:
+                connection.rollback()
+            else:
+                connection.execute(f"ROLLBACK TO sp_{depth}")
+                connection.execute(f"RELEASE sp_{depth}")
+            raise
+        connection.transaction_depth = depth
+        if depth == 0:
+            connection.commit()
+            change_bus.committed(self.db_path)
+        else:
+            connection.execute(f"RELEASE sp_{depth}")
+
+    @property
+    def in_transaction(self) -> bool:
+        """是否处于 transaction() 块内"""
+        return self.connection is not None and self.connection.transaction_depth > 0
+
+    def commit(self):
+        """提交当前修改，处于 transaction() 块内时推迟到块结束统一提交"""
+        if not self.in_transaction:
+            self.connection.commit()
+            change_bus.committed(self.db_path)
+
+    def create_table(self, table_name: str, columns: Dict[str, str], primary_key: Optional[str] = None,
+                     autoincrement: bool = False):
         """创建表
         :param table_name: 表名
         :param columns: 列名和类型的字典，如 {'id': 'INTEGER', 'name': 'TEXT'}
         :param primary_key: 主键列名
+        :param autoincrement: 主键为 INTEGER 时由数据库分配单调递增、不复用的 id
         """
         columns_def = []
         for name, type_ in columns.items():
             col_def = f"{name} {type_}"
             if primary_key and name == primary_key:
                 col_def += " PRIMARY KEY"
+                if autoincrement:
+                    col_def += " AUTOINCREMENT"
             columns_def.append(col_def)
 
         sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns_def)})"
         self.cursor.execute(sql)
-        self.connection.commit()
+        self.commit()
         print(f"表 {table_name} 已创建或已存在")
 
+    def create_index(self, index_name: str, table_name: str, columns: List[str], unique: bool = False):
+        """创建索引
+        :param index_name: 索引名
+        :param table_name: 表名
+        :param columns: 索引列，可以带 COLLATE 或 DESC
+        :param unique: 是否唯一索引
+        """
+        sql = (f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} "
+               f"ON {table_name} ({', '.join(columns)})")
+        self.cursor.execute(sql)
+        self.commit()
+        print(f"索引 {index_name} 已创建或已存在")
+
     def insert(self, table_name: str, data: Dict[str, Any]):
         """插入单条数据
         :param table_name: 表名
         :param data: 要插入的数据字典
         :return: 插入行的ID
         """
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['?'] * len(data))
-        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-
+        sql = _insert_sql(table_name, tuple(data.keys()))
         self.cursor.execute(sql, tuple(data.values()))
-        self.connection.commit()
+        self.commit()
+        return self.cursor.lastrowid
 
     def insert_many(self, table_name: str, data_list: List[Dict[str, Any]]):
         """批量插入数据
@@ -74,13 +380,11 @@ class SQLiteDB:
         if not data_list:
             return
 
-        columns = ', '.join(data_list[0].keys())
-        placeholders = ', '.join(['?'] * len(data_list[0]))
-        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        sql = _insert_sql(table_name, tuple(data_list[0].keys()))
 
         values = [tuple(data.values()) for data in data_list]
         self.cursor.executemany(sql, values)
-        self.connection.commit()
+        self.commit()
         print(f"已批量插入 {len(data_list)} 条数据到 {table_name}")
 
     def select(self, table_name: str, columns: List[str] = None,
@@ -94,12 +398,7 @@ class SQLiteDB:
         :param fetch_all: True返回所有结果，False返回第一条
         :return: 结果字典列表
         """
-        cols = '*' if columns is None else ', '.join(columns)
-        sql = f"SELECT {cols} FROM {table_name}"
-
-        if where:
-            sql += f" WHERE {where}"
-
+        sql = _select_sql(table_name, None if columns is None else tuple(columns), where)
         self.cursor.execute(sql, params or ())
 
         if fetch_all:
@@ -112,6 +411,94 @@ class SQLiteDB:
             result = self.cursor.fetchone()
             return [dict(result)] if result else []
 
+    def iter_select(self, table_name: str, columns: List[str] = None,
+                    where: Optional[str] = None, params: tuple = None,
+                    chunk_size: int = 500) -> Iterator[Dict]:
+        """流式查询，按 chunk_size 分批从游标读取，内存占用与结果总量无关
+        :param table_name: 表名
+        :param columns: 要查询的列名列表，None表示所有列
+        :param where: WHERE条件语句（不含WHERE关键字）
+        :param params: WHERE条件的参数
+        :param chunk_size: 每次 fetchmany 读取的行数
+        :return: 逐行产出结果字典的生成器
+        """
+        sql = _select_sql(table_name, None if columns is None else tuple(columns), where)
+        # 使用独立游标，迭代期间仍可在 self.cursor 上执行其他语句
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+    def select_page(self, table_name: str, after_id: Optional[int] = None, limit: int = 100,
+                    order_by: str = 'id', columns: List[str] = None,
+                    where: Optional[str] = None, params: tuple = None,
+                    descending: bool = False) -> List[Dict]:
+        """键集分页查询，以上一页最后一行的 id 作为游标，翻页代价与页码无关
+        :param table_name: 表名
+        :param after_id: 上一页最后一行的 id，None 表示第一页
+        :param limit: 每页行数
+        :param order_by: 排序列，非 id 列时以 id 作为第二排序关键字
+        :param columns: 要查询的列名列表，None表示所有列，否则会自动补上 id 列
+        :param where: 额外的WHERE条件语句（不含WHERE关键字）
+        :param params: WHERE条件的参数
+        :param descending: True 时按降序翻页
+        :return: 结果字典列表，少于 limit 行表示已到最后一页
+        """
+        if columns is not None and 'id' not in columns:
+            columns = ['id'] + list(columns)
+        has_after = after_id is not None
+        sql = _page_sql(table_name, None if columns is None else tuple(columns), where,
+                        order_by, descending, has_after)
+        values = tuple(params or ())
+        if has_after:
+            values += (after_id,) if order_by == 'id' else (after_id, after_id)
+        self.cursor.execute(sql, values + (limit,))
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def search(self, query: str, limit: int = 50, table_name: str = 'user',
+               columns: List[str] = None) -> List[Dict]:
+        """按网站和明文存储的用户名搜索
+
+        加密存储的用户名（user_name 为 NULL）不在索引中，无法按子串搜索，
+        需用 blind_index.find_by_user_name 按完整用户名精确查找。
+        每个词都不少于三个字符时使用 FTS5 三元组索引做子串匹配（包含前缀匹配），按相关度排序；
+        有更短的词时三元组无法匹配，改为对每个词做 LIKE 前缀匹配。多个词之间为“且”的关系。
+        :param query: 搜索内容，不区分大小写
+        :param limit: 最多返回的行数
+        :param table_name: 表名，需存在迁移创建的 {table_name}_fts 索引
+        :param columns: 要返回的列名列表，默认 id、user_name、pwd、site
+        :return: 结果字典列表
+        """
+        columns = tuple(columns or ('id', 'user_name', 'pwd', 'site'))
+        terms = query.split()
+        if not terms:
+            return []
+        use_fts = min(len(t) for t in terms) >= 3 and self._has_fts(table_name)
+        if use_fts:
+            # 每个词作为短语加引号，避免用户输入被当作 FTS5 语法解析
+            match = ' '.join('"' + t.replace('"', '""') + '"' for t in terms)
+            params = (match, limit)
+        else:
+            params = ()
+            for term in terms:
+                prefix = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                params += (prefix, prefix)
+            params += (limit,)
+        self.cursor.execute(_search_sql(table_name, columns, use_fts, 1 if use_fts else len(terms)), params)
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def _has_fts(self, table_name: str) -> bool:
+        row = self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (f'{table_name}_fts',)).fetchone()
+        return row is not None
+
     def update(self, table_name: str, data: Dict[str, Any], where: str, params: tuple = None):
         """更新数据
         :param table_name: 表名
@@ -119,13 +506,12 @@ class SQLiteDB:
         :param where: WHERE条件语句（不含WHERE关键字）
         :param params: WHERE条件的额外参数
         """
-        set_clause = ', '.join([f"{k} = ?" for k in data.keys()])
-        sql = f"UPDATE {table_name} SET {set_clause} WHERE {where}"
+        sql = _update_sql(table_name, tuple(data.keys()), where)
 
         # 合并数据值和条件参数
         values = tuple(data.values()) + (params or ())
         self.cursor.execute(sql, values)
-        self.connection.commit()
+        self.commit()
         print(f"已更新 {self.cursor.rowcount} 条数据")
 
     def delete(self, table_name: str, where: str, params: tuple = None):
@@ -134,18 +520,19 @@ class SQLiteDB:
         :param where: WHERE条件语句（不含WHERE关键字）
         :param params: 条件参数
         """
-        sql = f"DELETE FROM {table_name} WHERE {where}"
+        sql = _delete_sql(table_name, where)
         self.cursor.execute(sql, params or ())
-        self.connection.commit()
+        self.commit()
         print(f"已删除 {self.cursor.rowcount} 条数据")
 
-    def execute_sql(self, sql: str):
+    def execute_sql(self, sql: str, params: tuple = None):
         """执行自定义SQL语句
         :param sql: SQL语句
+        :param params: 绑定参数
         :return: None
         """
-        self.cursor.execute(sql)
-        self.connection.commit()
+        self.cursor.execute(sql, params or ())
+        self.commit()
         print(f"执行成功，影响行数: {self.cursor.rowcount}")
         return None
 
@@ -0,0 +1,26 @@
+from typing import Optional
+
+from db.db_tools import SQLiteDB
+
+META_TABLE = 'meta'
+
+
+def get_meta(db: SQLiteDB, key: str, default: Optional[str] = None) -> Optional[str]:
+    """读取 meta 表中的配置项
+    :param db: 已连接的 SQLiteDB
+    :param key: 配置名
+    :param default: 不存在时的返回值
+    """
+    row = db.select(META_TABLE, ['value'], 'key = ?', (key,), fetch_all=False)
+    return row[0]['value'] if row else default
+
+
+def set_meta(db: SQLiteDB, key: str, value: str):
+    """写入或覆盖 meta 表中的配置项"""
+    db.execute_sql(f"INSERT INTO {META_TABLE} (key, value) VALUES (?, ?) "
+                   f"ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+
+def delete_meta(db: SQLiteDB, key: str):
+    """删除 meta 表中的配置项"""
+    db.delete(META_TABLE, 'key = ?', (key,))
@@ -0,0 +1,292 @@
+import os
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+from db.db_tools import SQLiteDB
+from db.meta import META_TABLE, delete_meta, set_meta
+
+USER_TABLE = 'user'
+SCRUB_FAILURE_TABLE = 'scrub_failure'
+ATTACHMENT_TABLE = 'attachment'
+SYNC_CHANGE_TABLE = 'sync_change'
+# meta 中本库作为同步副本的 id，也是本地修改写入 origin 列的值
+REPLICA_ID_META_KEY = 'replica_id'
+# meta 中存在此项时 user 表的修改不进入变更日志，见 internal_rewrite
+INTERNAL_REWRITE_META_KEY = 'internal_rewrite'
+USER_COLUMNS = {'id': 'INTEGER', 'user_name': 'TEXT', 'pwd': 'TEXT', 'site': 'TEXT'}
+# 触发器中使用的当前时间（Unix 秒）和本库副本 id
+_NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+_REPLICA_ID_SQL = f"(SELECT value FROM {META_TABLE} WHERE key = '{REPLICA_ID_META_KEY}')"
+
+
+def _create_user_table(db: SQLiteDB):
+    """v1: user 表的 id 由数据库分配
+
+    旧版本的 user 表只有 ``id INTEGER PRIMARY KEY``，id 由界面在内存中分配，
+    这里把它重建为 AUTOINCREMENT 表并保留全部数据。
+    """
+    row = db.select('sqlite_master', ['sql'], "type = 'table' AND name = ?", (USER_TABLE,), fetch_all=False)
+    if not row:
+        db.create_table(USER_TABLE, USER_COLUMNS, 'id', autoincrement=True)
+        return
+    if 'AUTOINCREMENT' in row[0]['sql'].upper():
+        return
+    columns = ', '.join(USER_COLUMNS)
+    db.create_table(f'{USER_TABLE}_new', USER_COLUMNS, 'id', autoincrement=True)
+    db.execute_sql(f"INSERT INTO {USER_TABLE}_new ({columns}) SELECT {columns} FROM {USER_TABLE}")
+    db.execute_sql(f"DROP TABLE {USER_TABLE}")
+    db.execute_sql(f"ALTER TABLE {USER_TABLE}_new RENAME TO {USER_TABLE}")
+
+
+def _add_user_indexes(db: SQLiteDB):
+    """v2: 按网站、用户名查找的索引，(site, user_name) 同时覆盖按网站查找和去重"""
+    db.create_index('idx_user_site_user_name', USER_TABLE, ['site', 'user_name'])
+    db.create_index('idx_user_user_name', USER_TABLE, ['user_name'])
+
+
+def _create_user_fts(db: SQLiteDB):
+    """v3: site、user_name 的 FTS5 三元组全文索引，由触发器与 user 表保持同步
+
+    SQLite 未编译 FTS5 时跳过，SQLiteDB.search 会退回 LIKE 查询。
+    """
+    if not db.connection.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0]:
+        print("SQLite 未启用 FTS5，跳过全文索引")
+        return
+    fts = f'{USER_TABLE}_fts'
+    db.execute_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                   f"site, user_name, content='{USER_TABLE}', content_rowid='id', "
+                   f"tokenize='trigram case_sensitive 0')")
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {USER_TABLE} BEGIN
+            INSERT INTO {fts} (rowid, site, user_name) VALUES (new.id, new.site, new.user_name);
+        END""")
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {USER_TABLE} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, site, user_name) VALUES ('delete', old.id, old.site, old.user_name);
+        END""")
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF site, user_name ON {USER_TABLE} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, site, user_name) VALUES ('delete', old.id, old.site, old.user_name);
+            INSERT INTO {fts} (rowid, site, user_name) VALUES (new.id, new.site, new.user_name);
+        END""")
+    # 为已有数据建立索引
+    db.execute_sql(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def _create_meta_table(db: SQLiteDB):
+    """v4: 保存库级配置（主密码 KDF 参数、包装后的密钥等）的键值表"""
+    db.create_table(META_TABLE, {'key': 'TEXT', 'value': 'TEXT'}, 'key')
+
+
+def _add_user_name_blind_index(db: SQLiteDB):
+    """v5: 加密用户名及其盲索引列
+
+    user_name_enc 保存用户名密文，user_name_bidx 保存 HMAC 盲索引，精确查找和去重走索引而无需解密。
+    加密已有用户名需要库密钥，由用户选择后 blind_index.encrypt_user_names 在线完成，这里只改表结构。
+    """
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN user_name_enc BLOB")
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN user_name_bidx BLOB")
+    db.create_index('idx_user_site_user_name_bidx', USER_TABLE, ['site', 'user_name_bidx'])
+    db.create_index('idx_user_user_name_bidx', USER_TABLE, ['user_name_bidx'])
+
+
+def _create_scrub_failure_table(db: SQLiteDB):
+    """v6: 后台完整性检查发现的问题，record_id 为 NULL 的行是数据库级别的 quick_check 结果"""
+    db.create_table(SCRUB_FAILURE_TABLE, {'id': 'INTEGER', 'record_id': 'INTEGER', 'column_name': 'TEXT',
+                                          'error': 'TEXT', 'found_at': 'REAL'}, 'id')
+    db.create_index('idx_scrub_failure_record_id', SCRUB_FAILURE_TABLE, ['record_id'])
+
+
+def _create_attachment_table(db: SQLiteDB):
+    """v7: 记录的附件
+
+    name 和 data_key 由库密钥加密，data 是用 data_key 按 encrypt_stream 格式分块加密的文件内容，
+    通过 blobopen 增量读写；data 放在最后一列，只查询其他列时不会读取它的溢出页。
+    """
+    db.create_table(ATTACHMENT_TABLE, {'id': 'INTEGER', 'record_id': 'INTEGER', 'name': 'BLOB', 'size': 'INTEGER',
+                                       'data_key': 'BLOB', 'created_at': 'REAL', 'data': 'BLOB'}, 'id')
+    db.create_index('idx_attachment_record_id', ATTACHMENT_TABLE, ['record_id'])
+
+
+def _add_sync_change_log(db: SQLiteDB):
+    """v8: 同步用的全局 id、版本戳和由触发器维护的变更日志
+
+    uid 在各副本间标识同一条记录；version 每次本地修改加 1，与 modified_at、origin（最后修改的副本 id）
+    一起构成版本戳，冲突时版本戳大的一方获胜。sync_change 每个 uid 只保留最新的一次变更，
+    seq 随每次变更递增，删除的记录在其中保留墓碑。同步写入远端变更时带上远端的版本戳，触发器据此不再改写。
+    """
+    now = _NOW_SQL
+    replica_id = _REPLICA_ID_SQL
+    set_meta(db, REPLICA_ID_META_KEY, os.urandom(8).hex())
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN uid TEXT")
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN modified_at REAL")
+    db.execute_sql(f"ALTER TABLE {USER_TABLE} ADD COLUMN origin TEXT")
+    db.execute_sql(f"UPDATE {USER_TABLE} SET uid = lower(hex(randomblob(16))), version = 1, "
+                   f"modified_at = {now}, origin = {replica_id}")
+    db.create_index('idx_user_uid', USER_TABLE, ['uid'], unique=True)
+    db.create_table(SYNC_CHANGE_TABLE, {'seq': 'INTEGER', 'uid': 'TEXT NOT NULL', 'version': 'INTEGER',
+                                        'modified_at': 'REAL', 'origin': 'TEXT', 'deleted': 'INTEGER',
+                                        'local': 'INTEGER'}, 'seq', autoincrement=True)
+    db.create_index('idx_sync_change_uid', SYNC_CHANGE_TABLE, ['uid'], unique=True)
+    # 已有记录都作为本地变更，第一次同步时全部发送
+    db.execute_sql(f"INSERT INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local) "
+                   f"SELECT uid, version, modified_at, origin, 0, 1 FROM {USER_TABLE} ORDER BY id")
+    log = (f"INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local) "
+           f"SELECT uid, version, modified_at, origin, 0, 1 FROM {USER_TABLE} WHERE id = new.id;")
+    # 本地新增的记录没有 uid，同步写入的远端记录自带 uid
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_TABLE}_sync_ai AFTER INSERT ON {USER_TABLE} WHEN new.uid IS NULL BEGIN
+            UPDATE {USER_TABLE} SET uid = lower(hex(randomblob(16))), version = 1, modified_at = {now},
+                origin = {replica_id} WHERE id = new.id;
+            {log}
+        END""")
+    # 只有内容变化、且版本戳未被同时改写（即不是同步写入）时才算本地修改
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_TABLE}_sync_au AFTER UPDATE OF site, user_name, user_name_enc, pwd
+        ON {USER_TABLE} WHEN new.version IS old.version AND new.modified_at IS old.modified_at
+            AND new.origin IS old.origin AND (new.site IS NOT old.site OR new.user_name IS NOT old.user_name
+            OR new.user_name_enc IS NOT old.user_name_enc OR new.pwd IS NOT old.pwd) BEGIN
+            UPDATE {USER_TABLE} SET version = old.version + 1, modified_at = {now}, origin = {replica_id}
+                WHERE id = new.id;
+            {log}
+        END""")
+    db.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_TABLE}_sync_ad AFTER DELETE ON {USER_TABLE} WHEN old.uid IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local)
+                VALUES (old.uid, old.version + 1, {now}, {replica_id}, 1, 1);
+        END""")
+
+
+
+def _add_sync_change_record_id(db: SQLiteDB):
+    """v9: 变更日志记录本地行 id，供界面按行刷新
+
+    重建 v8 的三个触发器，写入 sync_change 时同时写入 record_id；删除的记录保留删除前的 id。
+    """
+    db.execute_sql(f"ALTER TABLE {SYNC_CHANGE_TABLE} ADD COLUMN record_id INTEGER")
+    db.execute_sql(f"UPDATE {SYNC_CHANGE_TABLE} SET record_id = "
+                   f"(SELECT id FROM {USER_TABLE} WHERE {USER_TABLE}.uid = {SYNC_CHANGE_TABLE}.uid)")
+    for trigger in ('ai', 'au', 'ad'):
+        db.execute_sql(f"DROP TRIGGER IF EXISTS {USER_TABLE}_sync_{trigger}")
+    log = (f"INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local, record_id) "
+           f"SELECT uid, version, modified_at, origin, 0, 1, id FROM {USER_TABLE} WHERE id = new.id;")
+    db.execute_sql(f"""
+        CREATE TRIGGER {USER_TABLE}_sync_ai AFTER INSERT ON {USER_TABLE} WHEN new.uid IS NULL BEGIN
+            UPDATE {USER_TABLE} SET uid = lower(hex(randomblob(16))), version = 1, modified_at = {_NOW_SQL},
+                origin = {_REPLICA_ID_SQL} WHERE id = new.id;
+            {log}
+        END""")
+    db.execute_sql(f"""
+        CREATE TRIGGER {USER_TABLE}_sync_au AFTER UPDATE OF site, user_name, user_name_enc, pwd
+        ON {USER_TABLE} WHEN new.version IS old.version AND new.modified_at IS old.modified_at
+            AND new.origin IS old.origin AND (new.site IS NOT old.site OR new.user_name IS NOT old.user_name
+            OR new.user_name_enc IS NOT old.user_name_enc OR new.pwd IS NOT old.pwd) BEGIN
+            UPDATE {USER_TABLE} SET version = old.version + 1, modified_at = {_NOW_SQL}, origin = {_REPLICA_ID_SQL}
+                WHERE id = new.id;
+            {log}
+        END""")
+    db.execute_sql(f"""
+        CREATE TRIGGER {USER_TABLE}_sync_ad AFTER DELETE ON {USER_TABLE} WHEN old.uid IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local, record_id)
+                VALUES (old.uid, old.version + 1, {_NOW_SQL}, {_REPLICA_ID_SQL}, 1, 1, old.id);
+        END""")
+
+
+def _skip_internal_rewrites(db: SQLiteDB):
+    """v10: 内部改写不再记为本地修改
+
+    重建 user_sync_au，meta 中有 INTERNAL_REWRITE_META_KEY 时不增加版本号、不写入变更日志。
+    """
+    db.execute_sql(f"DROP TRIGGER IF EXISTS {USER_TABLE}_sync_au")
+    db.execute_sql(f"""
+        CREATE TRIGGER {USER_TABLE}_sync_au AFTER UPDATE OF site, user_name, user_name_enc, pwd
+        ON {USER_TABLE} WHEN new.version IS old.version AND new.modified_at IS old.modified_at
+            AND new.origin IS old.origin AND (new.site IS NOT old.site OR new.user_name IS NOT old.user_name
+            OR new.user_name_enc IS NOT old.user_name_enc OR new.pwd IS NOT old.pwd)
+            AND NOT EXISTS (SELECT 1 FROM {META_TABLE} WHERE key = '{INTERNAL_REWRITE_META_KEY}') BEGIN
+            UPDATE {USER_TABLE} SET version = old.version + 1, modified_at = {_NOW_SQL}, origin = {_REPLICA_ID_SQL}
+                WHERE id = new.id;
+            INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} (uid, version, modified_at, origin, deleted, local, record_id)
+                SELECT uid, version, modified_at, origin, 0, 1, id FROM {USER_TABLE} WHERE id = new.id;
+        END""")
+
+
+def _restore_user_fts_columns(db: SQLiteDB):
+    """v11: 全文索引恢复为 v3 的 site、user_name 两列
+
+    之前的版本在加密全部用户名后，于迁移之外把索引重建为只含 site，这里改回迁移定义的结构。
+    已加密的用户名 user_name 为 NULL，不会进入索引；仍为明文的用户名重新可以按子串搜索。
+    """
+    fts = f'{USER_TABLE}_fts'
+    if not db.select('sqlite_master', ['name'], "type = 'table' AND name = ?", (fts,), fetch_all=False):
+        return
+    columns = [column[0] for column in db.connection.execute(f"SELECT * FROM {fts} LIMIT 0").description]
+    if 'user_name' in columns:
+        return
+    for trigger in ('ai', 'ad', 'au'):
+        db.execute_sql(f"DROP TRIGGER IF EXISTS {fts}_{trigger}")
+    db.execute_sql(f"DROP TABLE {fts}")
+    _create_user_fts(db)
+
+
+# 按版本号升序排列，只能在末尾追加，已发布的迁移不能修改
+MIGRATIONS: List[Tuple[int, Callable[[SQLiteDB], None]]] = [
+    (1, _create_user_table),
+    (2, _add_user_indexes),
+    (3, _create_user_fts),
+    (4, _create_meta_table),
+    (5, _add_user_name_blind_index),
+    (6, _create_scrub_failure_table),
+    (7, _create_attachment_table),
+    (8, _add_sync_change_log),
+    (9, _add_sync_change_record_id),
+    (10, _skip_internal_rewrites),
+    (11, _restore_user_fts_columns),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+@contextmanager
+def internal_rewrite(db: SQLiteDB):
+    """在调用方的 transaction() 块内标记内部改写，块内对 user 表的修改不算本地修改
+
+    密钥轮换、存储格式转换、用户名加密只改变密文的形式，内容不变，不应增加版本号、发送给其他副本，
+    也不应让 ChangeFeed 把每一行都报告为 UPDATE。标记在同一个写事务中设置并在块结束时删除，
+    其他连接看不到它，期间也无法写入，因此不会漏记其他连接的修改。
+    """
+    if not db.in_transaction:
+        raise RuntimeError("internal_rewrite 需要在 transaction() 块内使用")
+    set_meta(db, INTERNAL_REWRITE_META_KEY, '1')
+    try:
+        yield db
+    finally:
+        delete_meta(db, INTERNAL_REWRITE_META_KEY)
+
+
+def get_schema_version(db: SQLiteDB) -> int:
+    """读取 PRAGMA user_version"""
+    return db.connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db: SQLiteDB, target: int = SCHEMA_VERSION) -> int:
+    """打开数据库时调用，按顺序执行尚未应用的迁移
+
+    所有待执行的迁移与 user_version 的更新在同一个写事务中完成，
+    任何一步失败都会整体回滚；多个进程同时打开时只有一个会真正执行迁移。
+    :param db: 已连接的 SQLiteDB
+    :param target: 迁移到的版本
+    :return: 迁移后的版本
+    """
+    if get_schema_version(db) >= target:
+        return get_schema_version(db)
+    with db.transaction():
+        # 取得写锁后重新读取，其他进程可能已经完成迁移
+        current = get_schema_version(db)
+        for version, migration in MIGRATIONS:
+            if current < version <= target:
+                migration(db)
+                db.execute_sql(f"PRAGMA user_version = {version}")
+                current = version
+                print(f"数据库已迁移到版本 {version}")
+    return current
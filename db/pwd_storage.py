@@ -0,0 +1,77 @@
+import base64
+import threading
+from typing import Callable, Optional
+
+from db.db_tools import SQLiteDB, DEFAULT_PROFILE, Profile
+from db.meta import get_meta, set_meta
+from db.migrations import internal_rewrite
+
+# 密文的存储方式：'text' 为 urlsafe base64 字符串（旧格式），'blob' 为原始字节。
+# pwd 列声明为 TEXT，但 TEXT 亲和性不会转换 BLOB 值，因此无需重建表
+PWD_STORAGE_META_KEY = 'pwd_storage'
+PWD_STORAGE_TEXT = 'text'
+PWD_STORAGE_BLOB = 'blob'
+
+
+def get_pwd_storage(db: SQLiteDB) -> str:
+    """当前新写入的密文使用的存储方式，未设置时为旧的 text"""
+    return get_meta(db, PWD_STORAGE_META_KEY, PWD_STORAGE_TEXT)
+
+
+def to_storage(token: bytes, storage: str):
+    """把原始密文转换为 storage 对应的列值"""
+    if storage == PWD_STORAGE_BLOB:
+        return token
+    return base64.urlsafe_b64encode(token).decode('utf-8')
+
+
+def _convert_value(value, storage: str):
+    if storage == PWD_STORAGE_BLOB:
+        return base64.urlsafe_b64decode(value)
+    return base64.urlsafe_b64encode(value).decode('utf-8')
+
+
+def convert_pwd_storage(db_path, storage: str = PWD_STORAGE_BLOB, table_name: str = 'user',
+                        batch_size: int = 1000, cancel_event: Optional[threading.Event] = None,
+                        progress: Optional[Callable[[int], None]] = None,
+                        profile: Profile = DEFAULT_PROFILE) -> int:
+    """在线转换已有密文的存储方式，转换期间程序可以照常读写
+
+    先把存储方式写入 meta，之后新写入的记录直接使用新格式；已有记录按 id 分批转换，
+    每批一个短事务，不会长时间占用写锁。只选取仍是另一种格式的行，中途取消或退出后再次调用即可继续。
+    解密时按列值类型自动识别格式，因此转换过程中两种格式可以共存。
+    :param db_path: 数据库文件路径
+    :param storage: 目标存储方式，PWD_STORAGE_BLOB 或 PWD_STORAGE_TEXT
+    :param table_name: 表名
+    :param batch_size: 每个事务转换的行数
+    :param cancel_event: 置位后在当前批次结束时停止
+    :param progress: 每批提交后调用，参数为累计转换的行数
+    :param profile: 连接使用的 PRAGMA 配置
+    :return: 转换的行数
+    """
+    if storage not in (PWD_STORAGE_BLOB, PWD_STORAGE_TEXT):
+        raise ValueError(f"未知的存储方式: {storage}")
+    source_type = 'text' if storage == PWD_STORAGE_BLOB else 'blob'
+    converted = 0
+    with SQLiteDB(db_path, pooled=True, profile=profile) as db:
+        if get_pwd_storage(db) != storage:
+            with db.transaction():
+                set_meta(db, PWD_STORAGE_META_KEY, storage)
+        after_id = None
+        while cancel_event is None or not cancel_event.is_set():
+            rows = db.select_page(table_name, after_id, batch_size, columns=['id', 'pwd'],
+                                  where=f"typeof(pwd) = '{source_type}'")
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            # 只改变密文的存储形式，不作为本地修改同步
+            with db.transaction(), internal_rewrite(db):
+                for row in rows:
+                    # 带上原值作为条件，转换期间被修改过的行保持修改后的值
+                    db.cursor.execute(f"UPDATE {table_name} SET pwd = ? WHERE id = ? AND pwd = ?",
+                                      (_convert_value(row['pwd'], storage), row['id'], row['pwd']))
+                    converted += db.cursor.rowcount
+            if progress is not None:
+                progress(converted)
+    print(f"已转换 {converted} 条密文为 {storage} 存储")
+    return converted
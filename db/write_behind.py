@@ -0,0 +1,117 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from db.db_tools import SQLiteDB, Profile, connection_manager
+
+
+class WriteBehindQueue:
+    """写后台队列：把短时间窗口内提交的修改合并成一次事务提交
+
+    submit 立即返回 Future，只有在所在批次提交成功后 Future 才会完成，
+    因此 ``future.result()`` 返回即表示该修改已提交；flush 会等待此前提交的全部修改提交。
+    默认的 'durable' 配置每次提交都完整 fsync，此时提交即已落盘；改用 synchronous=NORMAL 或 OFF 的配置时
+    （'balanced'、'fast'），断电可能丢失最后几次已提交的批次，Future 完成不再代表已落盘。
+    每个修改在独立的 SAVEPOINT 中执行，单条失败只回滚它自己并通过 Future 抛出异常。
+    """
+    def __init__(self, db_path, window: float = 0.05, max_batch: int = 500,
+                 profile: Profile = 'durable'):
+        """
+        :param db_path: 数据库文件路径
+        :param window: 收到第一个修改后继续等待合并的秒数
+        :param max_batch: 单个事务最多包含的修改数
+        :param profile: 后台线程连接使用的 PRAGMA 配置，决定提交后是否已落盘
+        """
+        self.db_path = db_path
+        self.window = window
+        self.max_batch = max_batch
+        self.profile = profile
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='WriteBehindQueue', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, operation: Callable[[SQLiteDB], Any]) -> Future:
+        """提交一个修改
+        :param operation: 接收 SQLiteDB 的函数，例如 ``lambda db: db.insert('user', data)``
+        :return: 批次提交后完成的 Future，结果为 operation 的返回值
+        """
+        if self._closed:
+            raise RuntimeError("WriteBehindQueue 已关闭")
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    def insert(self, table_name: str, data: dict) -> Future:
+        return self.submit(lambda db: db.insert(table_name, data))
+
+    def update(self, table_name: str, data: dict, where: str, params: tuple = None) -> Future:
+        return self.submit(lambda db: db.update(table_name, data, where, params))
+
+    def delete(self, table_name: str, where: str, params: tuple = None) -> Future:
+        return self.submit(lambda db: db.delete(table_name, where, params))
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待此前提交的所有修改提交"""
+        if self._thread.is_alive():
+            self.submit(lambda db: None).result(timeout)
+
+    def close(self):
+        """提交剩余修改并停止后台线程，可重复调用"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first) -> list:
+        """从第一个修改开始，在 window 时间内收集一批修改"""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭标记放回队列，当前批次处理完后再退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            results = []
+            try:
+                with SQLiteDB(self.db_path, pooled=True, profile=self.profile) as db:
+                    with db.transaction():
+                        for operation, future in batch:
+                            try:
+                                with db.transaction():
+                                    results.append((future, operation(db), None))
+                            except Exception as e:
+                                results.append((future, None, e))
+            except Exception as e:
+                # 整个批次提交失败，没有任何修改生效
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        connection_manager.reset(self.db_path, self.profile)
@@ -1,18 +1,500 @@
-from cryptography.fernet import Fernet
+import abc
+import base64
+import hashlib
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain, islice
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
 
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# 主密码派生密钥的默认目标耗时（秒）
+DEFAULT_KDF_TARGET = 0.3
+# encrypt_many / decrypt_many 每个任务处理的条数
+DEFAULT_CHUNK_SIZE = 256
+
+# 密文格式：Fernet 令牌解码后首字节固定为 0x80，保持原样以兼容旧数据；
+# 其他算法的密文为 FORMAT_VERSION(1 字节) + 算法 id(1 字节) + nonce + 密文和认证标签，
+# 头部同时作为 AEAD 的附加数据参与认证，整体 urlsafe base64 编码后存储
+FERNET_VERSION = 0x80
+FORMAT_VERSION = 0x01
+# 原始密文（BLOB 存储）可能的首字节，与 base64 文本的首字符不会重叠
+_RAW_HEADERS = (bytes([FERNET_VERSION]), bytes([FORMAT_VERSION]))
+
+# 加密文件格式：FILE_MAGIC + 版本(1 字节) + 算法 id(1 字节) + 分块大小(4 字节) + salt(16 字节)，之后是各分块的密文。
+# 每个文件由库密钥和 salt 经 HKDF 派生独立的子密钥，分块序号和是否最后一块编入 nonce，
+# 头部作为附加数据，分块被删除、截断、调换顺序或头部被改动都无法通过认证
+FILE_MAGIC = b'LBXF'
+FILE_FORMAT_VERSION = 0x01
+DEFAULT_FILE_CHUNK_SIZE = 1 << 20
+# 解密时接受的最大分块，避免被篡改的头部导致一次读入过多数据
+MAX_FILE_CHUNK_SIZE = 64 << 20
+_FILE_SALT_SIZE = 16
+_FILE_HEADER_SIZE = len(FILE_MAGIC) + 6 + _FILE_SALT_SIZE
+_FILE_TAG_SIZE = 16
+
+
+class CipherBackend(abc.ABC):
+    """加密算法后端，子类实现 seal/open，缺少任何一个方法的子类无法实例化"""
+    name = ''
+    algorithm_id = 0
+
+    def __init__(self, secret_key: bytes):
+        """
+        :param secret_key: Fernet 格式的库密钥（urlsafe base64）
+        """
+
+    @abc.abstractmethod
+    def seal(self, data: bytes) -> bytes:
+        """加密，返回未经 base64 编码的完整密文"""
+
+    @abc.abstractmethod
+    def open(self, token: bytes) -> bytes:
+        """解密未经 base64 编码的完整密文，认证失败抛出 InvalidToken"""
+
+
+class FernetBackend(CipherBackend):
+    """AES-128-CBC + HMAC-SHA256，与旧版本数据兼容"""
+    name = 'fernet'
+    algorithm_id = FERNET_VERSION
 
-class EncryptedMessage:
     def __init__(self, secret_key):
+        self.fernet = Fernet(secret_key)
+
+    def seal(self, data):
+        return base64.urlsafe_b64decode(self.fernet.encrypt(data))
+
+    def open(self, token):
+        return self.fernet.decrypt(base64.urlsafe_b64encode(token))
+
+
+class AEADBackend(CipherBackend):
+    """AEAD 算法的公共实现，密钥由库密钥经 HKDF 按算法名派生"""
+    aead_class = None
+    nonce_size = 12
+
+    def __init__(self, secret_key):
+        master = base64.urlsafe_b64decode(secret_key)
+        subkey = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                      info=b'lockbox:' + self.name.encode('ascii')).derive(master)
+        self.aead = self.aead_class(subkey)
+        self.header = bytes([FORMAT_VERSION, self.algorithm_id])
+
+    def seal(self, data):
+        nonce = os.urandom(self.nonce_size)
+        return self.header + nonce + self.aead.encrypt(nonce, data, self.header)
+
+    def open(self, token):
+        header, nonce = token[:2], token[2:2 + self.nonce_size]
+        try:
+            return self.aead.decrypt(nonce, token[2 + self.nonce_size:], header)
+        except InvalidTag:
+            raise InvalidToken from None
+
+
+class AESGCMBackend(AEADBackend):
+    name = 'aes-gcm'
+    algorithm_id = 0x01
+    aead_class = AESGCM
+
+
+class ChaCha20Poly1305Backend(AEADBackend):
+    name = 'chacha20-poly1305'
+    algorithm_id = 0x02
+    aead_class = ChaCha20Poly1305
+
+
+BACKENDS = {backend.name: backend for backend in (FernetBackend, AESGCMBackend, ChaCha20Poly1305Backend)}
+_BACKENDS_BY_ID = {backend.algorithm_id: backend for backend in (AESGCMBackend, ChaCha20Poly1305Backend)}
+
+
+def derive_key(password: str, params: dict) -> str:
+    """由主密码派生 Fernet 格式的密钥
+    :param password: 主密码
+    :param params: calibrate_kdf 返回的参数，salt 为 base64 字符串
+    :return: urlsafe base64 编码的 32 字节密钥
+    """
+    salt = base64.b64decode(params['salt'])
+    if params['name'] == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        raw = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                             maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
+    elif params['name'] == 'pbkdf2_sha256':
+        raw = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params['iterations'], dklen=32)
+    else:
+        raise ValueError(f"不支持的 KDF: {params['name']}")
+    return base64.urlsafe_b64encode(raw).decode('utf-8')
+
+
+def calibrate_kdf(target: float = DEFAULT_KDF_TARGET, name: str = 'scrypt') -> dict:
+    """在当前机器上测量并选择 KDF 参数，使一次派生的耗时接近 target 秒
+    :param target: 目标耗时（秒）
+    :param name: 'scrypt' 或 'pbkdf2_sha256'
+    :return: 可直接传给 derive_key 的参数，含随机 salt
+    """
+    params = {'name': name, 'salt': base64.b64encode(os.urandom(16)).decode('utf-8')}
+    if name == 'scrypt':
+        # 固定 r=8、p=1，按 2 的幂增大 n（内存与耗时同时翻倍）
+        params.update(n=2 ** 14, r=8, p=1)
+        key = 'n'
+    else:
+        params.update(iterations=100000)
+        key = 'iterations'
+    # 翻倍直到耗时不低于 target / sqrt(2)，此时耗时落在 target 的 0.7~1.4 倍之间
+    while True:
+        start = time.perf_counter()
+        derive_key('calibrate', params)
+        elapsed = time.perf_counter() - start
+        if elapsed >= target * 0.7 or params[key] >= 2 ** 30:
+            break
+        params[key] *= 2
+    if name == 'pbkdf2_sha256':
+        # 迭代次数与耗时线性相关，可以直接按比例修正
+        params[key] = max(100000, int(params[key] * target / elapsed))
+    return params
+
+
+# 工作进程/线程中按 (密钥, 算法) 缓存的密码器，避免每个分块重新构造
+_worker_ciphers = {}
+
+
+def _run_chunk(secret_key, backend: str, old_keys: tuple, method: str, chunk: list) -> list:
+    """在工作进程或线程中处理一个分块，逐条捕获异常"""
+    cache_key = (secret_key, backend, old_keys)
+    cipher = _worker_ciphers.get(cache_key)
+    if cipher is None:
+        cipher = _worker_ciphers[cache_key] = EncryptedMessage(secret_key, backend, old_keys)
+    func = getattr(cipher, method)
+    results = []
+    for item in chunk:
+        try:
+            results.append((func(item), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def _file_aead(secret_key, algorithm_id: int, salt: bytes):
+    backend = _BACKENDS_BY_ID[algorithm_id]
+    subkey = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt,
+                  info=b'lockbox:file:' + backend.name.encode('ascii')).derive(base64.urlsafe_b64decode(secret_key))
+    return backend.aead_class(subkey)
+
+
+def _file_nonce(index: int, last: bool) -> bytes:
+    return index.to_bytes(11, 'big') + (b'\x01' if last else b'\x00')
+
+
+def _read_chunks(file: BinaryIO, size: int) -> Iterator[Tuple[bytes, bytes]]:
+    """逐块读取并产出 (nonce, 数据)，预读一块以判断是否最后一块；空文件产出一个空的最后一块"""
+    index = 0
+    chunk = file.read(size)
+    while True:
+        next_chunk = file.read(size) if len(chunk) == size else b''
+        yield _file_nonce(index, not next_chunk), chunk
+        if not next_chunk:
+            return
+        chunk = next_chunk
+        index += 1
+
+
+def _write_chunks(chunks: Iterable[Tuple[bytes, bytes]], func: Callable[[bytes, bytes], bytes], output: BinaryIO,
+                  max_workers: Optional[int]) -> Tuple[int, int]:
+    """把分块交给线程池处理并按顺序写出，最多 2 * max_workers 个分块同时在内存中
+    :return: (分块数, 写出的字节数)
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    pending = deque()
+    count = written = 0
+
+    def drain(keep):
+        nonlocal count, written
+        while len(pending) > keep:
+            data = pending.popleft().result()
+            output.write(data)
+            count += 1
+            written += len(data)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        for nonce, chunk in chunks:
+            pending.append(executor.submit(func, nonce, chunk))
+            drain(max_workers * 2 - 1)
+        drain(0)
+    return count, written
+
+
+def encrypted_file_size(size: int, chunk_size: int = DEFAULT_FILE_CHUNK_SIZE) -> int:
+    """encrypt_stream 加密 size 字节明文后写出的字节数，用于预先分配 BLOB"""
+    return _FILE_HEADER_SIZE + size + _FILE_TAG_SIZE * max(1, -(-size // chunk_size))
+
+
+@contextmanager
+def atomic_write(path):
+    """写入同目录下的临时文件，成功后 fsync 并替换 path，失败时删除临时文件，path 保持原样"""
+    path = os.path.abspath(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            yield output
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class EncryptedMessage:
+    def __init__(self, secret_key, backend='fernet', old_keys=()):
+        """
+        :param secret_key: Fernet 格式的库密钥
+        :param backend: 加密新数据使用的算法，见 BACKENDS；解密时按密文头部自动选择算法。
+            目前只能通过此参数选择，界面和配置文件中没有对应的设置，程序本身始终使用 'fernet'
+        :param old_keys: 密钥轮换前的旧密钥，由它们加密的数据仍可解密，新数据只用 secret_key 加密
+        """
+        self.secret_key = secret_key
+        self.old_keys = tuple(old_keys)
         self.cipher = Fernet(secret_key)
+        self.multi_fernet = MultiFernet([self.cipher] + [Fernet(key) for key in self.old_keys])
+        self._old_ciphers = [EncryptedMessage(key) for key in self.old_keys]
+        self._backends = {FERNET_VERSION: FernetBackend(secret_key)}
+        self.backend = self._get_backend(BACKENDS[backend].algorithm_id)
+
+    def _get_backend(self, algorithm_id):
+        backend = self._backends.get(algorithm_id)
+        if backend is None:
+            if algorithm_id not in _BACKENDS_BY_ID:
+                raise InvalidToken
+            backend = self._backends[algorithm_id] = _BACKENDS_BY_ID[algorithm_id](self.secret_key)
+        return backend
 
     def encrypt(self, text):
-        encrypted_data = self.cipher.encrypt(bytes(text, encoding='utf-8'))
-        return encrypted_data.decode('utf-8')
+        if self.backend.algorithm_id == FERNET_VERSION:
+            encrypted_data = self.cipher.encrypt(bytes(text, encoding='utf-8'))
+            return encrypted_data.decode('utf-8')
+        token = self.backend.seal(bytes(text, encoding='utf-8'))
+        return base64.urlsafe_b64encode(token).decode('utf-8')
+
+    def encrypt_bytes(self, text) -> bytes:
+        """加密并返回未经 base64 编码的原始密文，用于 BLOB 存储"""
+        return self.backend.seal(bytes(text, encoding='utf-8'))
 
 
     def decrypt(self, encrypted_text):
-        decrypted_data = self.cipher.decrypt(encrypted_text)
-        return decrypted_data.decode('utf-8')
+        """解密 encrypt 返回的 base64 字符串（TEXT 存储）或 encrypt_bytes 返回的原始密文（BLOB 存储）"""
+        return self._decrypt(encrypted_text)[0].decode('utf-8')
+
+    def decrypt_rotated(self, encrypted_text):
+        """解密，密文由旧密钥或其他算法加密时同时用当前密钥和算法重新加密
+        :return: (明文, 新密文)，新密文与输入形式相同（base64 字符串或原始字节），无需重新加密时为 None
+        """
+        data, algorithm_id, stale = self._decrypt(encrypted_text)
+        if not stale and algorithm_id == self.backend.algorithm_id:
+            return data.decode('utf-8'), None
+        raw = isinstance(encrypted_text, bytes) and encrypted_text[:1] in _RAW_HEADERS
+        if algorithm_id == FERNET_VERSION == self.backend.algorithm_id:
+            # 同为 Fernet 时由 MultiFernet.rotate 换成当前密钥，保留原令牌的时间戳
+            rotated = self.multi_fernet.rotate(base64.urlsafe_b64encode(encrypted_text) if raw else encrypted_text)
+            new_text = base64.urlsafe_b64decode(rotated) if raw else rotated.decode('utf-8')
+        else:
+            token = self.backend.seal(data)
+            new_text = token if raw else base64.urlsafe_b64encode(token).decode('utf-8')
+        return data.decode('utf-8'), new_text
+
+    def rotate(self, encrypted_text):
+        """返回用当前密钥和算法重新加密的密文，已是当前密钥和算法时返回 None"""
+        if self.backend.algorithm_id != FERNET_VERSION:
+            return self.decrypt_rotated(encrypted_text)[1]
+        raw = isinstance(encrypted_text, bytes) and encrypted_text[:1] in _RAW_HEADERS
+        token = base64.urlsafe_b64encode(encrypted_text) if raw else encrypted_text
+        if token[:1] not in ('g', b'g'):
+            return self.decrypt_rotated(encrypted_text)[1]
+        # Fernet 之间换钥不需要明文：新密钥能验证就无需处理，否则交给 MultiFernet.rotate
+        try:
+            self.cipher.decrypt(token)
+            return None
+        except InvalidToken:
+            if not self.old_keys:
+                raise
+        rotated = self.multi_fernet.rotate(token)
+        return base64.urlsafe_b64decode(rotated) if raw else rotated.decode('utf-8')
+
+    def _decrypt(self, encrypted_text) -> Tuple[bytes, int, bool]:
+        """解密并返回 (明文, 密文的算法 id, 是否由旧密钥加密)"""
+        if isinstance(encrypted_text, str):
+            encrypted_text = encrypted_text.encode('utf-8')
+        # Fernet 令牌以 0x80 开头，base64 后首字符固定为 'g'
+        if encrypted_text[:1] == b'g':
+            try:
+                return self.cipher.decrypt(encrypted_text), FERNET_VERSION, False
+            except InvalidToken:
+                if not self.old_keys:
+                    raise
+            return self.multi_fernet.decrypt(encrypted_text), FERNET_VERSION, True
+        if encrypted_text[:1] in _RAW_HEADERS:
+            token = encrypted_text
+        else:
+            try:
+                token = base64.urlsafe_b64decode(encrypted_text)
+            except ValueError:
+                raise InvalidToken from None
+        try:
+            data, stale = self._open(token), False
+        except InvalidToken:
+            for old_cipher in self._old_ciphers:
+                try:
+                    data, stale = old_cipher._open(token), True
+                    break
+                except InvalidToken:
+                    continue
+            else:
+                raise
+        return data, token[0] if token[0] == FERNET_VERSION else token[1], stale
+
+    def encrypt_many(self, texts: Iterable[str], raw: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     max_workers: Optional[int] = None, processes: bool = False) -> Iterator[Tuple]:
+        """批量加密，见 _map_chunks
+        :param raw: True 时返回 encrypt_bytes 的原始密文，用于 BLOB 存储
+        """
+        return self._map_chunks('encrypt_bytes' if raw else 'encrypt', texts, chunk_size, max_workers, processes)
+
+    def decrypt_many(self, encrypted_texts: Iterable, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     max_workers: Optional[int] = None, processes: bool = False) -> Iterator[Tuple]:
+        """批量解密，base64 字符串和原始密文可以混合，见 _map_chunks"""
+        return self._map_chunks('decrypt', encrypted_texts, chunk_size, max_workers, processes)
+
+    def rotate_many(self, encrypted_texts: Iterable, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    max_workers: Optional[int] = None, processes: bool = False) -> Iterator[Tuple]:
+        """批量 rotate，见 _map_chunks"""
+        return self._map_chunks('rotate', encrypted_texts, chunk_size, max_workers, processes)
+
+    def _map_chunks(self, method: str, items: Iterable, chunk_size: int, max_workers: Optional[int],
+                    processes: bool) -> Iterator[Tuple]:
+        """把 items 按 chunk_size 分块交给线程池或进程池处理，按输入顺序逐条产出结果
+
+        items 可以是生成器或数据库游标，只会提前读取 2 * max_workers 个分块，内存占用与总数无关。
+        cryptography 在加解密时释放 GIL，线程池即可利用多核；条目很短、Python 开销占主导时进程池更快。
+        :param method: 对每条数据调用的 EncryptedMessage 方法名
+        :param items: 待处理的数据
+        :param chunk_size: 每个任务处理的条数
+        :param max_workers: 并发数，默认 CPU 核数
+        :param processes: True 使用进程池，否则使用线程池
+        :return: (结果, None) 或 (None, 异常) 的迭代器，单条失败不影响其他条目
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        iterator = iter(items)
+        with executor_class(max_workers) as executor:
+            pending = deque()
+            while True:
+                while len(pending) < max_workers * 2:
+                    chunk = list(islice(iterator, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_run_chunk, self.secret_key, self.backend.name,
+                                                   self.old_keys, method, chunk))
+                if not pending:
+                    break
+                yield from pending.popleft().result()
+
+    def encrypt_stream(self, src: BinaryIO, dst: BinaryIO, chunk_size: int = DEFAULT_FILE_CHUNK_SIZE,
+                       max_workers: Optional[int] = None) -> int:
+        """从 src 读到末尾，按 chunk_size 分块并行加密后顺序写入 dst，内存占用与数据大小无关
+
+        dst 只需支持 write，可以是文件或 sqlite3.Blob，写出的总字节数见 encrypted_file_size。
+        当前算法为 Fernet 时使用 AES-GCM：Fernet 需要 base64 编码，不适合大文件。
+        :param src: 以二进制方式打开的明文
+        :param dst: 写入密文的位置
+        :param chunk_size: 每块明文的字节数
+        :param max_workers: 并发数，默认 CPU 核数
+        :return: 明文的字节数
+        """
+        if not 0 < chunk_size <= MAX_FILE_CHUNK_SIZE:
+            raise ValueError(f"chunk_size 须在 1 到 {MAX_FILE_CHUNK_SIZE} 之间")
+        algorithm_id = self.backend.algorithm_id
+        if algorithm_id not in _BACKENDS_BY_ID:
+            algorithm_id = AESGCMBackend.algorithm_id
+        salt = os.urandom(_FILE_SALT_SIZE)
+        header = FILE_MAGIC + bytes([FILE_FORMAT_VERSION, algorithm_id]) + chunk_size.to_bytes(4, 'big') + salt
+        aead = _file_aead(self.secret_key, algorithm_id, salt)
+        dst.write(header)
+        count, written = _write_chunks(_read_chunks(src, chunk_size),
+                                       lambda nonce, chunk: aead.encrypt(nonce, chunk, header), dst, max_workers)
+        return written - count * _FILE_TAG_SIZE
+
+    def decrypt_stream(self, src: BinaryIO, dst: BinaryIO, max_workers: Optional[int] = None) -> int:
+        """解密 encrypt_stream 写出的数据，密钥轮换中时也可用旧密钥解密
+
+        认证失败时 dst 中可能已有部分明文，写入文件时应使用 decrypt_file。
+        :param src: 密文，只需支持 read，可以是文件或 sqlite3.Blob
+        :param dst: 写入明文的位置
+        :param max_workers: 并发数，默认 CPU 核数
+        :return: 明文的字节数
+        :raises InvalidToken: 不是加密数据、密钥不匹配或数据被改动
+        """
+        header = src.read(_FILE_HEADER_SIZE)
+        chunk_size = int.from_bytes(header[6:10], 'big')
+        if (len(header) < _FILE_HEADER_SIZE or header[:4] != FILE_MAGIC or header[4] != FILE_FORMAT_VERSION
+                or header[5] not in _BACKENDS_BY_ID or not 0 < chunk_size <= MAX_FILE_CHUNK_SIZE):
+            raise InvalidToken
+        chunks = _read_chunks(src, chunk_size + _FILE_TAG_SIZE)
+        first = next(chunks)
+        # 用第一块确定是当前密钥还是轮换前的旧密钥
+        for key in (self.secret_key,) + self.old_keys:
+            aead = _file_aead(key, header[5], header[10:])
+            try:
+                aead.decrypt(first[0], first[1], header)
+                break
+            except InvalidTag:
+                continue
+        else:
+            raise InvalidToken
+
+        def open_chunk(nonce, chunk):
+            try:
+                return aead.decrypt(nonce, chunk, header)
+            except InvalidTag:
+                raise InvalidToken from None
+
+        return _write_chunks(chain([first], chunks), open_chunk, dst, max_workers)[1]
+
+    def encrypt_file(self, src_path, dst_path, chunk_size: int = DEFAULT_FILE_CHUNK_SIZE,
+                     max_workers: Optional[int] = None) -> int:
+        """流式加密文件，见 encrypt_stream
+        :param src_path: 明文文件
+        :param dst_path: 加密后的文件，全部写完后原子地替换，src_path 与 dst_path 不能相同
+        :return: 明文的字节数
+        """
+        with open(src_path, 'rb') as src, atomic_write(dst_path) as dst:
+            return self.encrypt_stream(src, dst, chunk_size, max_workers)
+
+    def decrypt_file(self, src_path, dst_path, max_workers: Optional[int] = None) -> int:
+        """流式解密 encrypt_file 生成的文件，见 decrypt_stream
+
+        任何一块认证失败都不会留下部分明文，dst_path 保持原样。
+        :param src_path: 加密的文件
+        :param dst_path: 解密后的文件，全部写完后原子地替换
+        :return: 明文的字节数
+        :raises InvalidToken: 不是加密文件、密钥不匹配或文件被改动
+        """
+        with open(src_path, 'rb') as src, atomic_write(dst_path) as dst:
+            return self.decrypt_stream(src, dst, max_workers)
+
+    def _open(self, token: bytes) -> bytes:
+        """按首字节选择算法解密原始密文"""
+        if token[:1] == _RAW_HEADERS[0]:
+            return self._backends[FERNET_VERSION].open(token)
+        if len(token) < 2 or token[0] != FORMAT_VERSION:
+            raise InvalidToken
+        return self._get_backend(token[1]).open(token)
 
 
     @staticmethod
@@ -20,11 +502,105 @@ class EncryptedMessage:
         return Fernet.generate_key().decode(encoding='utf-8')
 
 
-if __name__ == '__main__':
+def benchmark_backends(sizes=(16, 64, 256), count=20000):
+    """比较各算法在典型记录长度下的加解密吞吐量和密文长度"""
+    key = EncryptedMessage.generate_secret_key()
+    for name in BACKENDS:
+        e = EncryptedMessage(key, backend=name)
+        for size in sizes:
+            text = 'x' * size
+            start = time.perf_counter()
+            tokens = [e.encrypt(text) for _ in range(count)]
+            encrypt_us = (time.perf_counter() - start) / count * 1e6
+            start = time.perf_counter()
+            for token in tokens:
+                e.decrypt(token)
+            decrypt_us = (time.perf_counter() - start) / count * 1e6
+            print(f"{name:<18} {size:>4} 字节  加密 {encrypt_us:6.2f} us  解密 {decrypt_us:6.2f} us  "
+                  f"密文 {len(tokens[0]):>4} 字符")
+
+
+def benchmark_many(count=100000, backends=('fernet', 'aes-gcm')):
+    """比较逐条循环与 decrypt_many 线程池、进程池的解密吞吐量"""
     key = EncryptedMessage.generate_secret_key()
-    e = EncryptedMessage(key)
-    file_path = 'd:/test.txt'
-    s = e.encrypt('asd1234')
-    print('s: '+s)
-    a = e.decrypt(s)
-    print(a)
+    for name in backends:
+        e = EncryptedMessage(key, backend=name)
+        tokens = [value for value, _ in e.encrypt_many((f'P@ssw0rd-{i:08d}' for i in range(count)), raw=True)]
+        runs = (
+            ('逐条循环', lambda: [e.decrypt(token) for token in tokens]),
+            ('线程池', lambda: list(e.decrypt_many(tokens))),
+            ('进程池', lambda: list(e.decrypt_many(tokens, processes=True))),
+        )
+        for label, func in runs:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8} {label:<6} {count} 条  {elapsed * 1000:8.1f} ms  {count / elapsed:10.0f} 条/秒")
+
+
+def benchmark_files(size_mb: int = 256, chunk_sizes=(64 << 10, 1 << 20, 4 << 20)):
+    """测量 size_mb MB 文件的加解密吞吐量和 Python 内存峰值"""
+    import tracemalloc
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path = os.path.join(tmp, 'plain')
+        with open(plain_path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1 << 20))
+        for chunk_size in chunk_sizes:
+            for label, func, args in (('加密', cipher.encrypt_file, (plain_path, plain_path + '.lbx', chunk_size)),
+                                      ('解密', cipher.decrypt_file, (plain_path + '.lbx', plain_path + '.out'))):
+                tracemalloc.start()
+                start = time.perf_counter()
+                size = func(*args)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{chunk_size >> 10:>5} KB 分块 {label} {size >> 20} MB: {size / elapsed / (1 << 20):7.1f} MB/s  "
+                      f"内存峰值 {peak / (1 << 20):.1f} MB")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LockBox 文件加解密")
+    parser.add_argument('--key-file', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'config', 'secret_key.skf'),
+                        help="库密钥文件，默认 config/secret_key.skf")
+    parser.add_argument('--workers', type=int, default=None, help="并发数，默认 CPU 核数")
+    commands = parser.add_subparsers(dest='command', required=True)
+    encrypt_parser = commands.add_parser('encrypt', help="加密文件")
+    encrypt_parser.add_argument('src')
+    encrypt_parser.add_argument('dst')
+    encrypt_parser.add_argument('--chunk-size', type=int, default=DEFAULT_FILE_CHUNK_SIZE, help="分块字节数")
+    encrypt_parser.add_argument('--backend', choices=[name for name in BACKENDS if name != 'fernet'],
+                                default='aes-gcm')
+    decrypt_parser = commands.add_parser('decrypt', help="解密文件")
+    decrypt_parser.add_argument('src')
+    decrypt_parser.add_argument('dst')
+    commands.add_parser('bench', help="测量各算法和文件加解密的性能")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        benchmark_backends()
+        benchmark_many()
+        benchmark_files()
+        return
+    with open(args.key_file, 'r', encoding='utf-8') as f:
+        secret_key = f.read().strip()
+    start = time.perf_counter()
+    if args.command == 'encrypt':
+        size = EncryptedMessage(secret_key, args.backend).encrypt_file(args.src, args.dst, args.chunk_size,
+                                                                       args.workers)
+    else:
+        try:
+            size = EncryptedMessage(secret_key).decrypt_file(args.src, args.dst, args.workers)
+        except InvalidToken:
+            parser.exit(1, "解密失败：不是加密文件、密钥不匹配或文件已被改动\n")
+    elapsed = time.perf_counter() - start
+    print(f"{args.src} -> {args.dst}: {size} 字节, {elapsed:.2f} 秒, {size / elapsed / (1 << 20):.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import csv
+import json
+import os
+import threading
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.pwd_storage import PWD_STORAGE_BLOB, get_pwd_storage
+from blind_index import compute, find_by_user_name, get_index_key, is_user_name_encrypted, normalize
+from key_check import verify_secret_key
+
+# 每个事务导入的行数
+IMPORT_BATCH_SIZE = 1000
+# CSV 导出格式 -> (名称, 网址, 用户名, 密码) 的列名，按顺序匹配表头，名称列可以没有
+CSV_FORMATS = {
+    'bitwarden': ('name', 'login_uri', 'login_username', 'login_password'),
+    'chrome': ('name', 'url', 'username', 'password'),
+    'firefox': (None, 'url', 'username', 'password'),
+}
+# Bitwarden JSON 中登录项的 type
+BITWARDEN_LOGIN_TYPE = 1
+
+
+class _JsonReader:
+    """在分块读入的缓冲区上逐个解析 JSON 值，用于流式读取大数组"""
+    def __init__(self, file, read_size: int = 1 << 16):
+        self.file = file
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        data = self.file.read(self.read_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，文件结束时返回空字符串"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"JSON 格式错误：位置 {self.pos} 处应为 {chars!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字和 true/false 可能被缓冲区截断，恰好在末尾结束时读入更多数据后重新解析
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_json_array(file, key: str) -> Iterator:
+    """逐个产出顶层对象中 key 数组的元素，其他键的值解析后丢弃"""
+    reader = _JsonReader(file)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name != key:
+            reader.value()
+        elif reader.expect('[') and reader.peek() == ']':
+            reader.expect(']')
+        else:
+            while True:
+                yield reader.value()
+                if reader.expect(',]') == ']':
+                    break
+        if reader.expect(',}') == '}':
+            return
+
+
+def _entry(name, url, user_name, pwd) -> Optional[Dict]:
+    """转为 {'site', 'user_name', 'pwd'}，网站取网址的主机名，没有网址时用名称；没有密码返回 None"""
+    if not pwd:
+        return None
+    site = (urlparse(url).hostname or url) if url else name
+    if not site:
+        return None
+    return {'site': site, 'user_name': user_name or '', 'pwd': pwd}
+
+
+def detect_format(path) -> str:
+    """按扩展名和 CSV 表头识别导出格式"""
+    if path.lower().endswith('.json'):
+        return 'bitwarden-json'
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = next(csv.reader(f), [])
+    for file_format, columns in CSV_FORMATS.items():
+        if all(column in header for column in columns if column is not None):
+            return file_format
+    raise ValueError(f"无法识别的导出格式，表头为 {header}")
+
+
+def read_entries(path, file_format: Optional[str] = None) -> Iterator[Optional[Dict]]:
+    """流式读取导出文件，逐条产出 {'site', 'user_name', 'pwd'}，无法导入的条目产出 None
+    :param path: Chrome/Firefox/Bitwarden 导出的 CSV，或 Bitwarden 导出的未加密 JSON
+    :param file_format: CSV_FORMATS 中的格式或 'bitwarden-json'，默认自动识别
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'bitwarden-json':
+            for item in _iter_json_array(f, 'items'):
+                login = item.get('login') or {}
+                if item.get('type') != BITWARDEN_LOGIN_TYPE:
+                    yield None
+                    continue
+                uris = login.get('uris') or [{}]
+                yield _entry(item.get('name'), uris[0].get('uri'), login.get('username'), login.get('password'))
+            return
+        name_column, url_column, user_column, pwd_column = CSV_FORMATS[file_format]
+        for row in csv.DictReader(f):
+            if file_format == 'bitwarden' and row.get('type', 'login') != 'login':
+                yield None
+                continue
+            yield _entry(row.get(name_column) if name_column else None, row[url_column], row[user_column],
+                         row[pwd_column])
+
+
+def _exists(db: SQLiteDB, index_key: Optional[bytes], entry: Dict, table_name: str) -> bool:
+    """库中是否已有相同网站和用户名的记录，由 (site, user_name) 或 (site, user_name_bidx) 索引完成"""
+    if index_key is not None:
+        return bool(find_by_user_name(db, index_key, entry['user_name'], entry['site'], ['id'], table_name))
+    return bool(db.select(table_name, ['id'], 'site = ? AND user_name = ?', (entry['site'], entry['user_name']),
+                          fetch_all=False))
+
+
+def import_file(db_path, cipher: EncryptedMessage, path, file_format: Optional[str] = None,
+                table_name: str = 'user', batch_size: int = IMPORT_BATCH_SIZE, max_workers: Optional[int] = None,
+                cancel_event: Optional[threading.Event] = None,
+                progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """把浏览器或 Bitwarden 的导出文件导入库中
+
+    文件流式读取，每 batch_size 条为一批：跳过库中和本批中已有的网站 + 用户名，
+    密码（及加密存储的用户名）交给 encrypt_many 并行加密，再用 insert_many 在一个事务中写入。
+    之前的批次已经提交，跨批次的重复由库中的查询发现，内存占用与文件大小无关。
+    :param db_path: 数据库文件路径，需已迁移
+    :param cipher: 已解锁的密码器
+    :param path: 导出文件路径
+    :param file_format: 见 read_entries
+    :param table_name: 表名
+    :param batch_size: 每个事务导入的行数
+    :param max_workers: 并行加密的并发数
+    :param cancel_event: 置位后在当前批次结束时停止，已提交的批次保留
+    :param progress: 每批提交后在工作线程中调用，参数为当前统计
+    :return: {'read', 'imported', 'duplicates', 'invalid', 'elapsed'}
+    :raises KeyMismatch: cipher 不是本库的密钥
+    """
+    stats = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'elapsed': 0.0}
+    start = time.perf_counter()
+    entries = read_entries(path, file_format)
+    with SQLiteDB(db_path, pooled=True) as db:
+        verify_secret_key(db, cipher.secret_key, table_name=table_name)
+        raw_pwd = get_pwd_storage(db) == PWD_STORAGE_BLOB
+        index_key = get_index_key(db, cipher.secret_key) if is_user_name_encrypted(db) else None
+        while cancel_event is None or not cancel_event.is_set():
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            stats['read'] += len(batch)
+            rows = []
+            seen = set()
+            for entry in batch:
+                if entry is None:
+                    stats['invalid'] += 1
+                    continue
+                user_name = entry['user_name'] if index_key is None else normalize(entry['user_name'])
+                if (entry['site'], user_name) in seen or _exists(db, index_key, entry, table_name):
+                    stats['duplicates'] += 1
+                    continue
+                seen.add((entry['site'], user_name))
+                rows.append(entry)
+            if rows:
+                pwds = cipher.encrypt_many((row['pwd'] for row in rows), raw=raw_pwd, max_workers=max_workers)
+                if index_key is None:
+                    datas = [{'site': row['site'], 'user_name': row['user_name'], 'pwd': pwd}
+                             for row, (pwd, _) in zip(rows, pwds)]
+                else:
+                    user_names = cipher.encrypt_many((row['user_name'] for row in rows), raw=True,
+                                                     max_workers=max_workers)
+                    datas = [{'site': row['site'], 'user_name': None, 'user_name_enc': user_name_enc,
+                              'user_name_bidx': compute(index_key, row['user_name']), 'pwd': pwd}
+                             for row, (pwd, _), (user_name_enc, _) in zip(rows, pwds, user_names)]
+                with db.transaction():
+                    db.insert_many(table_name, datas)
+                stats['imported'] += len(datas)
+            stats['elapsed'] = time.perf_counter() - start
+            if progress is not None:
+                progress(dict(stats))
+    stats['elapsed'] = time.perf_counter() - start
+    print(f"导入完成：读取 {stats['read']} 条，导入 {stats['imported']} 条，跳过重复 {stats['duplicates']} 条、"
+          f"无效 {stats['invalid']} 条，{stats['read'] / max(stats['elapsed'], 1e-9):.0f} 条/秒")
+    return stats
+
+
+def benchmark_import(rows: int = 50000):
+    """生成 rows 行的 Chrome 导出文件并导入临时库，第二次导入全部为重复"""
+    import tempfile
+    from db.migrations import migrate
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        csv_path = os.path.join(tmp, 'chrome.csv')
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FORMATS['chrome'] + ('note',))
+            for i in range(rows):
+                writer.writerow([f'site{i % 5000}', f'https://site{i % 5000}.example.com/login',
+                                 f'user{i}@example.com', f'P@ssw0rd-{i:08d}', ''])
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+        for label in ('首次导入', '重复导入'):
+            stats = import_file(db_path, cipher, csv_path)
+            print(f"{label}: {stats['read']} 行 {stats['elapsed']:.2f} 秒，导入 {stats['imported']}，"
+                  f"重复 {stats['duplicates']}")
+
+
+def main(argv=None):
+    import argparse
+    from db.migrations import migrate
+
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+    parser = argparse.ArgumentParser(description="从浏览器或 Bitwarden 的导出文件导入密码")
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help="导入 CSV 或 JSON 导出文件")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=list(CSV_FORMATS) + ['bitwarden-json'], default=None,
+                               help="导出格式，默认自动识别")
+    import_parser.add_argument('--db', default=os.path.join(config_dir, 'sqlite_db.db'), help="数据库文件")
+    import_parser.add_argument('--key-file', default=os.path.join(config_dir, 'secret_key.skf'),
+                               help="库密钥文件，默认 config/secret_key.skf")
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    commands.add_parser('bench', help="测量导入 50000 行的耗时")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        benchmark_import()
+        return
+    with open(args.key_file, 'r', encoding='utf-8') as f:
+        cipher = EncryptedMessage(f.read().strip())
+    with SQLiteDB(args.db) as db:
+        migrate(db)
+    import_file(args.db, cipher, args.path, args.format, batch_size=args.batch_size,
+                progress=lambda stats: print(f"已读取 {stats['read']} 条，导入 {stats['imported']} 条，"
+                                             f"{stats['read'] / max(stats['elapsed'], 1e-9):.0f} 条/秒"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+from itertools import tee
+from typing import List, Optional, Tuple
+
+from cryptography.fernet import InvalidToken
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta
+
+# meta 表中保存由库密钥计算的校验值，用于在解锁时确认密钥属于本库
+KEY_CHECK_META_KEY = 'key_check'
+# 旧库没有校验值时，用最近多少条记录确认密钥
+KEY_CHECK_SAMPLE = 20
+# 由库密钥加密的列
+ENCRYPTED_COLUMNS = ('pwd', 'user_name_enc')
+
+
+class KeyMismatch(ValueError):
+    """密钥不属于本库"""
+    def __init__(self, message: str, has_check: bool):
+        """
+        :param has_check: 库中是否已有校验值，没有时只是无法解密最近的记录，可以由用户确认后采用该密钥
+        """
+        super().__init__(message)
+        self.has_check = has_check
+
+
+def _key_check_mac(secret_key: str, salt: bytes) -> bytes:
+    return hmac.new(base64.urlsafe_b64decode(secret_key), b'lockbox:key-check:' + salt, hashlib.sha256).digest()
+
+
+def set_key_check(db: SQLiteDB, secret_key: str):
+    """写入 secret_key 的校验值，新建库、采用新密钥和密钥轮换时调用"""
+    salt = os.urandom(16)
+    set_meta(db, KEY_CHECK_META_KEY, json.dumps({
+        'salt': base64.b64encode(salt).decode('utf-8'),
+        'mac': base64.b64encode(_key_check_mac(secret_key, salt)).decode('utf-8'),
+    }))
+
+
+def can_decrypt(cipher: EncryptedMessage, encrypted) -> bool:
+    try:
+        cipher.decrypt(encrypted)
+    except InvalidToken:
+        return False
+    return True
+
+
+def verify_secret_key(db: SQLiteDB, secret_key: str, adopt: bool = False, table_name: str = 'user'):
+    """确认 secret_key 是本库的密钥，在解锁时、任何写入和批量任务之前调用
+
+    有校验值时重新计算并用 hmac.compare_digest 做常量时间比较，不需要解密任何记录；
+    旧库没有校验值时，能解密最近的记录之一（或库中还没有记录）即视为通过，并写入校验值。
+    :param db: 已连接的 SQLiteDB
+    :param secret_key: 待确认的库密钥
+    :param adopt: 没有校验值且无法解密最近的记录时仍采用该密钥并写入校验值
+    :param table_name: 表名
+    :raises KeyMismatch: 密钥不属于本库
+    """
+    value = get_meta(db, KEY_CHECK_META_KEY)
+    if value is not None:
+        check = json.loads(value)
+        mac = _key_check_mac(secret_key, base64.b64decode(check['salt']))
+        if not hmac.compare_digest(mac, base64.b64decode(check['mac'])):
+            raise KeyMismatch("密钥与本库不匹配", has_check=True)
+        return
+    if not adopt:
+        samples = db.select_page(table_name, None, KEY_CHECK_SAMPLE, columns=['pwd'],
+                                 where='pwd IS NOT NULL', descending=True)
+        cipher = EncryptedMessage(secret_key)
+        if samples and not any(can_decrypt(cipher, row['pwd']) for row in samples):
+            raise KeyMismatch("密钥无法解密库中最近的记录", has_check=False)
+    with db.transaction():
+        set_key_check(db, secret_key)
+
+
+def find_foreign_rows(db_path, cipher: EncryptedMessage, table_name: str = 'user',
+                      max_workers: Optional[int] = None, processes: bool = False,
+                      cancel_event: Optional[threading.Event] = None) -> Tuple[int, List[int]]:
+    """并行扫描全库，找出无法用 cipher（含轮换中的旧密钥）解密的记录
+
+    记录以流的方式读出，交给 EncryptedMessage.decrypt_many 分块并行解密，内存占用与记录数无关。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器
+    :param table_name: 表名
+    :param max_workers: 并发数，见 EncryptedMessage.decrypt_many
+    :param processes: True 使用进程池
+    :param cancel_event: 置位后停止扫描，返回已扫描部分的结果
+    :return: (扫描的记录数, 无法解密的记录 id 列表)
+    """
+    foreign = []
+    scanned = 0
+    last_id = None
+    with SQLiteDB(db_path, pooled=True) as db:
+        values = ((row['id'], row[column]) for row in db.iter_select(table_name, ['id'] + list(ENCRYPTED_COLUMNS))
+                  for column in ENCRYPTED_COLUMNS if row[column] is not None)
+        ids, encrypted = tee(values)
+        results = cipher.decrypt_many((value for _, value in encrypted), max_workers=max_workers,
+                                      processes=processes)
+        for (record_id, _), (_, error) in zip(ids, results):
+            if record_id != last_id:
+                scanned += 1
+                last_id = record_id
+            if error is not None and (not foreign or foreign[-1] != record_id):
+                foreign.append(record_id)
+            if cancel_event is not None and cancel_event.is_set():
+                break
+        results.close()
+    return scanned, foreign
@@ -0,0 +1,182 @@
+import json
+import threading
+from typing import Callable, List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta, delete_meta
+from db.migrations import ATTACHMENT_TABLE, internal_rewrite
+from blind_index import rewrap_index_key
+from key_check import set_key_check, verify_secret_key
+from unlock_session import has_master_password, save_wrapped_key, unwrap_secret_key, wrap_secret_key
+
+# meta 表中保存进行中的轮换：被新密钥包装的旧密钥和已处理到的记录 id
+ROTATION_META_KEY = 'key_rotation'
+ROTATION_BATCH_SIZE = 500
+# 由库密钥加密、轮换时需要重新加密的列
+ROTATED_COLUMNS = ('pwd', 'user_name_enc')
+# 附件内容由各自的内容密钥加密，轮换时只重新加密附件名和内容密钥
+ROTATED_ATTACHMENT_COLUMNS = ('name', 'data_key')
+
+
+def _load_state(db: SQLiteDB) -> Optional[dict]:
+    value = get_meta(db, ROTATION_META_KEY)
+    return None if value is None else json.loads(value)
+
+
+def is_rotating(db: SQLiteDB) -> bool:
+    return get_meta(db, ROTATION_META_KEY) is not None
+
+
+def get_old_keys(db: SQLiteDB, secret_key: str) -> List[str]:
+    """返回进行中的轮换的旧密钥，没有轮换或 secret_key 不是新密钥时返回空列表"""
+    state = _load_state(db)
+    if state is None:
+        return []
+    wrapper = Fernet(secret_key)
+    try:
+        return [wrapper.decrypt(key).decode('utf-8') for key in state['old_keys']]
+    except InvalidToken:
+        return []
+
+
+def start_rotation(db: SQLiteDB, old_key: str, new_key: str, password: Optional[str] = None,
+                   before_commit: Optional[Callable[[], None]] = None) -> List[str]:
+    """开始把库密钥从 old_key 换成 new_key
+
+    只记录轮换状态，不改动任何记录：旧密钥被新密钥包装后保存在 meta 中，
+    用新密钥解锁时即可同时取得旧密钥，已有记录立即可读，之后由 rotate_vault 在后台逐批重新加密。
+    上一次轮换尚未完成时，它的旧密钥会一并保留。
+    :param db: 已连接的 SQLiteDB
+    :param old_key: 当前的库密钥
+    :param new_key: 新的库密钥
+    :param password: 已设置主密码时必须提供，用于改为包装新密钥
+    :param before_commit: 在保存轮换状态的写事务提交之前调用，例如把新密钥写入密钥文件；抛出异常时整个轮换回滚
+    :return: 解密仍需要的全部旧密钥
+    :raises KeyMismatch: old_key 不是本库的密钥
+    :raises ValueError: 未提供主密码或主密码与 old_key 不匹配
+    """
+    verify_secret_key(db, old_key)
+    old_keys = [old_key] + get_old_keys(db, old_key)
+    rewrap = has_master_password(db)
+    if rewrap:
+        if not password:
+            raise ValueError("已设置主密码，请输入主密码")
+        if unwrap_secret_key(db, password) != old_key:
+            raise ValueError("主密码与当前密钥不匹配")
+    wrapper = Fernet(new_key)
+    state = {'old_keys': [wrapper.encrypt(key.encode('utf-8')).decode('utf-8') for key in old_keys],
+             'checkpoint': 0}
+    # KDF 校准和派生耗时较长，在取得写锁之前完成
+    wrapped = wrap_secret_key(new_key, password) if rewrap else None
+    with db.transaction():
+        if wrapped is not None:
+            save_wrapped_key(db, *wrapped)
+        rewrap_index_key(db, old_key, new_key)
+        set_key_check(db, new_key)
+        set_meta(db, ROTATION_META_KEY, json.dumps(state))
+        if before_commit is not None:
+            before_commit()
+    return old_keys
+
+
+def rotate_vault(db_path, cipher: EncryptedMessage, table_name: str = 'user',
+                 batch_size: int = ROTATION_BATCH_SIZE, max_workers: Optional[int] = None,
+                 cancel_event: Optional[threading.Event] = None,
+                 progress: Optional[Callable[[int], None]] = None) -> int:
+    """在后台把仍由旧密钥加密的记录逐批用新密钥重新加密
+
+    每批一个短事务，同时把已处理的最后一个 id 写入 meta 作为检查点，
+    取消或退出后再次调用会从检查点继续。记录处理完后再处理附件，全部完成后删除轮换状态，旧密钥不再保存。
+    :param db_path: 数据库文件路径
+    :param cipher: 由新密钥和旧密钥构造的密码器
+    :param table_name: 表名
+    :param batch_size: 每个事务处理的行数
+    :param max_workers: 重新加密的并发数，见 EncryptedMessage.rotate_many
+    :param cancel_event: 置位后在当前批次结束时停止
+    :param progress: 每批提交后调用，参数为累计重新加密的值的个数
+    :return: 本次重新加密的值的个数（ROTATED_COLUMNS 中每列分别计数）
+    """
+    rotated = failed = 0
+    with SQLiteDB(db_path, pooled=True) as db:
+        state = _load_state(db)
+        if state is None:
+            return 0
+        while cancel_event is None or not cancel_event.is_set():
+            rows = db.select_page(table_name, state['checkpoint'], batch_size,
+                                  columns=['id'] + list(ROTATED_COLUMNS))
+            if not rows:
+                with db.transaction():
+                    attachment_rotated, attachment_failed = _rotate_attachments(db, cipher, max_workers)
+                    rotated += attachment_rotated
+                    failed += attachment_failed
+                    delete_meta(db, ROTATION_META_KEY)
+                print(f"密钥轮换完成，{failed} 个密文无法用新旧密钥解密，保持原样")
+                break
+            values = [(row, column) for row in rows for column in ROTATED_COLUMNS if row[column] is not None]
+            results = list(cipher.rotate_many((row[column] for row, column in values), max_workers=max_workers))
+            # 重新加密不改变内容，不作为本地修改同步
+            with db.transaction(), internal_rewrite(db):
+                for (row, column), (new_value, error) in zip(values, results):
+                    if error is not None:
+                        failed += 1
+                        continue
+                    if new_value is None:
+                        continue
+                    # 带上原值作为条件，轮换期间被修改或已被懒加密的行不会被覆盖
+                    db.cursor.execute(f"UPDATE {table_name} SET {column} = ? WHERE id = ? AND {column} = ?",
+                                      (new_value, row['id'], row[column]))
+                    rotated += db.cursor.rowcount
+                state['checkpoint'] = rows[-1]['id']
+                set_meta(db, ROTATION_META_KEY, json.dumps(state))
+            if progress is not None:
+                progress(rotated)
+    return rotated
+
+
+def _rotate_attachments(db: SQLiteDB, cipher: EncryptedMessage, max_workers: Optional[int]):
+    """重新加密全部附件的附件名和内容密钥，附件数量远少于记录，在调用方的事务中一次完成"""
+    rotated = failed = 0
+    rows = db.select(ATTACHMENT_TABLE, ['id'] + list(ROTATED_ATTACHMENT_COLUMNS))
+    values = [(row, column) for row in rows for column in ROTATED_ATTACHMENT_COLUMNS]
+    results = cipher.rotate_many((row[column] for row, column in values), max_workers=max_workers)
+    for (row, column), (new_value, error) in zip(values, results):
+        if error is not None:
+            failed += 1
+        elif new_value is not None:
+            db.cursor.execute(f"UPDATE {ATTACHMENT_TABLE} SET {column} = ? WHERE id = ? AND {column} = ?",
+                              (new_value, row['id'], row[column]))
+            rotated += db.cursor.rowcount
+    return rotated, failed
+
+
+def benchmark_rotation(rows: int = 100000):
+    """在临时库中测量 rows 条记录的密钥轮换耗时"""
+    import os
+    import tempfile
+    import time
+    from db.bench import fake_rows
+    from db.migrations import migrate
+
+    old_key, new_key = EncryptedMessage.generate_secret_key(), EncryptedMessage.generate_secret_key()
+    datas = list(fake_rows(rows))
+    for data, (pwd, _) in zip(datas, EncryptedMessage(old_key).encrypt_many(
+            f"P@ssw0rd-{data['id']:08d}" for data in datas)):
+        data['pwd'] = pwd
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many('user', datas)
+            old_keys = start_rotation(db, old_key, new_key)
+        cipher = EncryptedMessage(new_key, old_keys=old_keys)
+        start = time.perf_counter()
+        count = rotate_vault(db_path, cipher)
+        elapsed = time.perf_counter() - start
+        print(f"轮换 {count} 条记录 {elapsed:.2f} 秒  {count / elapsed:.0f} 条/秒")
+
+
+if __name__ == '__main__':
+    benchmark_rotation()
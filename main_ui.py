@@ -1,22 +1,42 @@
 import os
 import sys
+import time
 from pathlib import Path
 
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QFrame, QScrollArea,
+    QLabel, QLineEdit, QPushButton, QFrame, QInputDialog, QMessageBox, QFileDialog, QMenu,
 )
-from PyQt6.QtGui import QIcon, QFont
-from PyQt6.QtCore import QSize, Qt
+from PyQt6.QtGui import QIcon, QFont, QCursor
+from PyQt6.QtCore import QSize, QTimer
+from cryptography.fernet import InvalidToken
 
-from encrypted_file import EncryptedMessage
+from encrypted_file import EncryptedMessage, atomic_write
 from UI.add_password_ui import AddPasswordDialog
 from UI.setting_ui import SettingsDialog
 from UI.secret_key_ui import SecretKeyDialog
 from UI.BaseAppMessage import BaseAppMessage
-from db.db_tools import SQLiteDB
-from qr_code import generate_qrcode
+from db.db_tools import SQLiteDB, connection_manager
+from db.migrations import USER_TABLE, migrate
+from db.change_bus import DELETE, UPDATE, change_bus
+from db.change_feed import ChangeFeed
+from db.pwd_storage import PWD_STORAGE_BLOB, get_pwd_storage, convert_pwd_storage
+from qr_code import make_qrcode
 from exc_chrome import launch_chrome
+from worker import ChangeSignals, JobRunner
+from record_cache import RecordCache
+from blind_index import (ENCRYPTED_PLACEHOLDER, decrypt_user_names, encrypt_user_names, find_by_user_name,
+                         get_index_key, is_user_name_encrypted, user_name_values)
+from scrubber import scrub_due, scrub_vault
+from attachments import add_attachment, count_attachments, delete_attachments, export_attachment, list_attachments
+from importer import import_file
+from backup import backup_due, export_vault, scheduled_backup
+from sync import SYNC_INTERVAL, get_sync_dir, get_sync_state, set_sync_dir, sync_vault
+from key_check import KeyMismatch, find_foreign_rows, verify_secret_key
+from key_rotation import get_old_keys, start_rotation, rotate_vault
+from unlock_session import (SessionLocked, UnlockSession, has_master_password, is_secret_key, set_master_password,
+                            unwrap_secret_key)
+from UI.password_list_view import PasswordListView
 
 
 def get_configs_path():
@@ -30,10 +50,80 @@ def get_configs_path():
 SECRET_KEY_PATH, SQLITE_DB_PATH = get_configs_path()
 
 
+def write_key_file(secret_key, path=SECRET_KEY_PATH):
+    """把库密钥原子地写入密钥文件，写入中途出错或断电时原文件保持原样"""
+    with atomic_write(path) as f:
+        f.write(secret_key.encode('utf-8'))
+
+# 定时增量备份的目录
+BACKUP_DIR = SQLITE_DB_PATH.parent / "backups"
+# 多久检查一次是否需要定时备份（毫秒），实际间隔见 backup.BACKUP_INTERVAL
+BACKUP_CHECK_MS = 3600 * 1000
+# 记录与明文的两层缓存，工作线程中的 *_record 函数共用
+record_cache = RecordCache(SQLITE_DB_PATH)
+# 列表滚动到底部时每次从数据库读取的记录数
+PAGE_SIZE = 100
+# 搜索框停止输入多久后开始搜索（毫秒）及最多显示的结果数
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_LIMIT = 200
+# 列表显示需要读取的列，user_name_enc 在显示前解密到 user_name
+LIST_COLUMNS = ['id', 'user_name', 'user_name_enc', 'site']
+# 检查其他进程修改的间隔、收到变更后等待合并的时间（毫秒），以及按 id 读取时每条语句的 id 数
+CHANGE_POLL_MS = 1000
+CHANGE_DEBOUNCE_MS = 50
+REFRESH_CHUNK = 500
+# 读到仍由旧密钥加密的记录时顺便用新密钥重新加密，不必等后台轮换处理到它
+LAZY_ROTATION = True
+
+
 class PasswordManager(QMainWindow):
     def __init__(self, position = (100, 100, 800, 500)):
         super().__init__()
         SQLiteDB.create_db(SQLITE_DB_PATH)
+        # 数据库读写和加解密都在线程池中执行，避免阻塞界面
+        self.runner = JobRunner(parent=self)
+        # 解锁后缓存密码器，session_source 为解锁时密钥框中的密钥（主密码解锁时为空）
+        self.session = UnlockSession()
+        self.session_source = ''
+        # 后台重新加密记录的密钥轮换任务
+        self.rotation_job = None
+        # 后台完整性检查任务
+        self.scrub_job = None
+        # 批量导入任务
+        self.import_job = None
+        self.session_timer = QTimer(self)
+        self.session_timer.setInterval(10000)
+        self.session_timer.timeout.connect(self.check_session)
+        self.session_timer.start()
+        # 定时增量备份，启动后先检查一次
+        self.backup_job = None
+        self.backup_timer = QTimer(self)
+        self.backup_timer.setInterval(BACKUP_CHECK_MS)
+        self.backup_timer.timeout.connect(self.start_backup_job)
+        self.backup_timer.start()
+        QTimer.singleShot(0, self.start_backup_job)
+        # 设置了同步目录后，解锁期间定时与其他副本同步
+        self.sync_job = None
+        self.sync_dir = None
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setInterval(SYNC_INTERVAL * 1000)
+        self.sync_timer.timeout.connect(self.auto_sync)
+        self.sync_timer.start()
+        # 行级变更通知：本进程的提交立即通知，其他进程的提交定时检查，列表只刷新受影响的行
+        self.change_feed = ChangeFeed(SQLITE_DB_PATH)
+        self.change_signals = ChangeSignals(self)
+        self.change_signals.changed.connect(self.on_rows_changed)
+        change_bus.subscribe(self.change_signals.changed.emit)
+        self.change_timer = QTimer(self)
+        self.change_timer.setInterval(CHANGE_POLL_MS)
+        self.change_timer.timeout.connect(self.poll_changes)
+        self.change_timer.start()
+        # 等待读取并刷新的记录 id，短时间内的多次变更合并为一次读取
+        self.pending_rows = set()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(CHANGE_DEBOUNCE_MS)
+        self.refresh_timer.timeout.connect(self.refresh_rows)
         self.setWindowTitle("密码管理器")
         self.setGeometry(*position)
 
@@ -78,14 +168,16 @@ class PasswordManager(QMainWindow):
         self.init_ui()
         self.center_window()
 
-    def connect_and_read_db(self, db_path):
-        with SQLiteDB(db_path) as db:
-            db.create_table('user',
-                            {'id': 'INTEGER', 'user_name': 'TEXT', 'pwd': 'TEXT', 'site': 'TEXT'},
-                            'id')
-            datas = db.select(table_name='user', columns= ['id', 'user_name', 'pwd', 'site'])
-        # print(f'Datas : {datas}')
-        return datas
+    def connect_and_read_db(self, db_path, after_id=None, limit=PAGE_SIZE, cipher=None):
+        """读取一页记录（按 id 降序），在工作线程中执行，cipher 为 None 时加密的用户名显示为占位文字"""
+        with SQLiteDB(db_path, pooled=True) as db:
+            if after_id is None:
+                migrate(db)
+            rows = db.select_page('user', after_id, limit, columns=LIST_COLUMNS, descending=True)
+            counts = count_attachments(db, [row['id'] for row in rows])
+        for row in rows:
+            row['attachments'] = counts.get(row['id'], 0)
+        return decrypt_user_names(rows, cipher)
 
     def center_window(self):
         """将窗口移动到屏幕中央"""
@@ -121,12 +213,18 @@ class PasswordManager(QMainWindow):
         content_layout.addWidget(toolbar)
 
         # 密码列表区域
-        self.password_list = self.create_password_list(self.connect_and_read_db(SQLITE_DB_PATH))
+        self.password_list = self.create_password_list()
         content_layout.addWidget(self.password_list, stretch=1)
+        self.reload_password_list()
+        # 已有的 base64 密文在后台逐批转换为 BLOB 存储，转换期间照常使用
+        self.runner.submit(self.convert_storage_record, pass_cancel_event=True,
+                           on_result=lambda _: record_cache.clear(), on_error=self.show_job_error)
 
         # 状态栏
         self.status_bar = self.create_status_bar()
         content_layout.addWidget(self.status_bar)
+        self.runner.submit(self.sync_status_record, on_result=self.on_sync_status,
+                           on_error=lambda error: print(f"读取同步状态失败: {error!r}"))
 
         main_layout.addWidget(content_widget, stretch=4)
 
@@ -134,12 +232,33 @@ class PasswordManager(QMainWindow):
         self.get_secret_key(SECRET_KEY_PATH)
 
     def get_secret_key(self, default_key_path):
-        if os.path.exists(default_key_path):
-            with open(default_key_path, "r") as f:
-                lines = f.readlines()
-                if lines:
-                    key = lines[0].strip()
-                    self.key_box.setText(key)
+        """未设置主密码时把密钥文件中的库密钥填入密钥框；已设置主密码时不读取，并提示删除密钥文件"""
+        self.runner.submit(self.key_file_record, default_key_path,
+                           on_result=lambda result: self.on_key_file_read(default_key_path, *result),
+                           on_error=lambda error: print(f"读取密钥文件失败: {error!r}"))
+
+    def on_key_file_read(self, key_path, key, protected):
+        if key and self.key_box.text() == "" and not self.session.is_unlocked:
+            self.key_box.setText(key)
+        if protected:
+            self.offer_delete_key_file(key_path)
+
+    def offer_delete_key_file(self, key_path=SECRET_KEY_PATH):
+        """设置主密码后密钥文件中的明文库密钥会绕过主密码，询问是否删除"""
+        if not os.path.exists(key_path):
+            return
+        answer = QMessageBox.question(
+            self, "密钥文件",
+            f"已设置主密码，但 {key_path} 中仍保存着库密钥明文，能读取该文件的人无需主密码即可解密全部记录。"
+            f"\n确认已另行妥善保存库密钥后，是否删除该文件？")
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            os.remove(key_path)
+        except OSError as e:
+            BaseAppMessage().show_message(f"删除密钥文件失败: {e}", 2500)
+            return
+        BaseAppMessage().show_message("密钥文件已删除，之后请用主密码解锁", 2500)
 
     def create_sidebar(self):
         sidebar = QFrame()
@@ -160,6 +279,13 @@ class PasswordManager(QMainWindow):
             ("社交媒体", "icons/social.png", self.show_disabled_feature_alert),
             ("金融", "icons/finance.png", self.show_disabled_feature_alert),
             ("生成密钥", "icons/work.png", self.generate_key),
+            ("主密码", "icons/work.png", self.master_password),
+            ("轮换密钥", "icons/work.png", self.rotate_key),
+            ("密钥检查", "icons/work.png", self.check_keys),
+            ("加密用户名", "icons/work.png", self.protect_user_names),
+            ("导入密码", "icons/work.png", self.import_passwords),
+            ("导出备份", "icons/work.png", self.export_backup),
+            ("同步", "icons/work.png", self.sync_now),
             ("回收站", "icons/trash.png", self.show_disabled_feature_alert),
             ("设置", "icons/settings.png", self.settings),
         ]
@@ -215,6 +341,298 @@ class PasswordManager(QMainWindow):
         self.secret_key_dialog = SecretKeyDialog(k)
         self.secret_key_dialog.show()
 
+    def require_cipher(self, callback):
+        """取得已解锁的密码器后调用 callback(cipher)
+
+        未解锁时在工作线程中解锁（主密码需要先派生密钥），完成后再回调。
+        """
+        text = self.key_box.text()
+        if self.session.is_unlocked and text in ('', self.session_source):
+            callback(self.session.cipher)
+            return
+        if text == '':
+            BaseAppMessage().show_message("请在上方密钥栏填写密钥或主密码", 2500)
+            return
+        # 需要读取数据库中进行中的密钥轮换，主密码还需要派生密钥，都在工作线程中完成
+        self.runner.submit(self.unlock_record, text,
+                           on_result=lambda keys: self.on_unlocked(keys, callback, text),
+                           on_error=lambda error: self.on_unlock_failed(error, text, callback))
+
+    def on_unlock_failed(self, error, text, callback):
+        """旧库还没有密钥校验值、而密钥无法解密最近的记录时，由用户决定是否仍采用该密钥"""
+        if not isinstance(error, KeyMismatch) or error.has_check:
+            self.show_job_error(error)
+            return
+        answer = QMessageBox.question(self, "密钥检查",
+                                      f"{error}，继续使用会让库中出现由不同密钥加密的记录。仍要使用此密钥吗？")
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        self.runner.submit(self.unlock_record, text, True,
+                           on_result=lambda keys: self.on_unlocked(keys, callback, text),
+                           on_error=self.show_job_error)
+
+    def unlocked_cipher(self):
+        """已解锁时返回密码器，否则返回 None，用于列表中解密用户名"""
+        try:
+            return self.session.cipher
+        except SessionLocked:
+            return None
+
+    def on_unlocked(self, keys, callback=None, source=''):
+        """keys 为 unlock_record 返回的 (库密钥, 轮换中的旧密钥)"""
+        secret_key, old_keys = keys
+        self.session.unlock(secret_key, old_keys)
+        if is_secret_key(source):
+            self.session_source = source
+        else:
+            self.session_source = ''
+            # 主密码不留在输入框中
+            self.key_box.clear()
+            self.key_box.setPlaceholderText("已解锁")
+        if old_keys:
+            # 上次的密钥轮换尚未完成，从检查点继续
+            self.start_rotation_job()
+        # 已开启用户名加密时，继续未完成的转换或加密同步收到的明文用户名；未开启时什么也不做
+        self.runner.submit(self.encrypt_user_names_record, self.session.cipher, pass_cancel_event=True,
+                           on_error=lambda error: print(f"用户名加密未完成: {error!r}"))
+        self.queue_row_refresh(self.password_model.ids_with_user_name(ENCRYPTED_PLACEHOLDER))
+        self.start_scrub_job()
+        if callback is not None:
+            callback(self.session.cipher)
+
+    def start_scrub_job(self):
+        """解锁后在后台继续或开始完整性检查，每轮间隔 SCRUB_INTERVAL"""
+        if self.scrub_job is not None:
+            return
+        self.scrub_job = self.runner.submit(self.scrub_record, self.session.cipher, pass_cancel_event=True,
+                                            on_result=self.on_scrub_finished, on_error=self.on_scrub_failed)
+
+    def on_scrub_finished(self, state):
+        self.scrub_job = None
+        if state is not None and state['checkpoint'] is None and state['failed']:
+            BaseAppMessage().show_message(f"完整性检查发现 {state['failed']} 个问题", 5000)
+
+    def on_scrub_failed(self, error):
+        self.scrub_job = None
+        print(f"完整性检查未完成: {error!r}")
+
+    def unlock_by_key_box(self):
+        """密钥框回车时用主密码提前解锁"""
+        text = self.key_box.text()
+        if text and not is_secret_key(text):
+            self.require_cipher(lambda cipher: BaseAppMessage().show_message("已解锁", 1500))
+
+    def check_session(self):
+        """会话空闲超时后恢复密钥框提示，并清除过期或已锁定会话的明文缓存"""
+        record_cache.purge_expired()
+        if not self.session.is_unlocked:
+            record_cache.clear_plaintext()
+        if self.key_box.placeholderText() == "已解锁" and not self.session.is_unlocked:
+            self.key_box.setPlaceholderText("密钥或主密码")
+            BaseAppMessage().show_message("长时间未操作，已自动锁定", 2500)
+
+    def master_password(self):
+        """用当前密钥设置主密码，之后可以只输入主密码解锁"""
+        def ask(cipher):
+            password, ok = QInputDialog.getText(self, "主密码", "设置主密码:", QLineEdit.EchoMode.Password)
+            if not ok or not password:
+                return
+            confirm, ok = QInputDialog.getText(self, "主密码", "再次输入主密码:", QLineEdit.EchoMode.Password)
+            if not ok or confirm != password:
+                BaseAppMessage().show_message("两次输入的主密码不一致", 2500)
+                return
+            self.runner.submit(self.master_password_record, self.session.secret_key, password,
+                               on_result=lambda _: self.on_master_password_set(), on_error=self.show_job_error)
+        self.require_cipher(ask)
+
+    def on_master_password_set(self):
+        BaseAppMessage().show_message("主密码已设置", 2500)
+        self.offer_delete_key_file()
+
+    def protect_user_names(self):
+        """用户确认后把明文用户名改为加密存储，完成后压缩数据库清除残留的明文"""
+        def ask(cipher):
+            answer = QMessageBox.question(
+                self, "加密用户名",
+                "用户名将改为加密存储，之后只能按网站搜索，或输入完整的用户名精确查找，无法撤销。\n"
+                "转换完成后会压缩整个数据库以清除残留的明文，期间其他修改需要等待。是否继续？")
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+            self.runner.submit(self.encrypt_user_names_record, cipher, True, pass_cancel_event=True,
+                               on_result=self.on_user_names_encrypted, on_error=self.show_job_error)
+        self.require_cipher(ask)
+
+    def on_user_names_encrypted(self, count):
+        self.update_search_placeholder(True)
+        BaseAppMessage().show_message(f"已加密 {count} 个用户名", 2500)
+
+    def update_search_placeholder(self, user_name_encrypted):
+        self.search_box.setPlaceholderText("搜索网站或完整用户名" if user_name_encrypted else "搜索网站或用户名")
+
+    def check_keys(self):
+        """并行扫描全库，找出由其他密钥加密、当前密钥无法解密的记录"""
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.scan_keys_record, cipher, pass_cancel_event=True,
+            on_result=self.on_keys_checked, on_error=self.show_job_error))
+
+    def on_keys_checked(self, result):
+        scanned, foreign = result
+        if foreign:
+            ids = ', '.join(str(record_id) for record_id in foreign[:10])
+            BaseAppMessage().show_message(f"{len(foreign)} 条记录无法用当前密钥解密（id: {ids}）", 5000)
+        else:
+            BaseAppMessage().show_message(f"全部 {scanned} 条记录均可用当前密钥解密", 2500)
+
+    def rotate_key(self):
+        """生成新的库密钥并在后台用它重新加密全部记录，轮换期间照常使用"""
+        def ask(cipher):
+            password, ok = QInputDialog.getText(self, "轮换密钥", "已设置主密码时请输入主密码，否则留空:",
+                                                QLineEdit.EchoMode.Password)
+            if not ok:
+                return
+            new_key = EncryptedMessage.generate_secret_key()
+            self.runner.submit(self.start_rotation_record, self.session.secret_key, new_key, password,
+                               on_result=lambda old_keys: self.on_rotation_started(new_key, old_keys),
+                               on_error=self.show_job_error)
+        self.require_cipher(ask)
+
+    def on_rotation_started(self, new_key, old_keys):
+        self.session.unlock(new_key, old_keys)
+        record_cache.clear()
+        if self.session_source:
+            self.session_source = new_key
+            self.key_box.setText(new_key)
+        self.secret_key_dialog = SecretKeyDialog(new_key)
+        self.secret_key_dialog.show()
+        self.start_rotation_job()
+
+    def start_rotation_job(self):
+        if self.rotation_job is not None:
+            return
+        self.rotation_job = self.runner.submit(
+            self.rotate_vault_record, self.session.cipher, pass_cancel_event=True,
+            on_result=self.on_rotation_finished, on_error=self.on_rotation_failed)
+
+    def on_rotation_finished(self, count):
+        self.rotation_job = None
+        record_cache.clear()
+        BaseAppMessage().show_message(f"密钥轮换完成，已重新加密 {count} 条记录", 2500)
+
+    def on_rotation_failed(self, error):
+        self.rotation_job = None
+        self.show_job_error(error)
+
+
+    def import_passwords(self):
+        """从 Chrome/Firefox/Bitwarden 的导出文件批量导入，进度显示在状态栏"""
+        if self.import_job is not None:
+            BaseAppMessage().show_message("正在导入，请稍候", 2500)
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "导入密码", "", "导出文件 (*.csv *.json)")
+        if not path:
+            return
+
+        def start(cipher):
+            self.import_job = self.runner.submit(
+                self.import_record, path, cipher, pass_cancel_event=True, on_progress=self.on_import_progress,
+                on_result=self.on_import_finished, on_error=self.on_import_failed)
+        self.require_cipher(start)
+
+    def on_import_progress(self, stats):
+        self.status_progress.setText(f"📥 导入中：已读取 {stats['read']} 条，导入 {stats['imported']} 条，"
+                                     f"{stats['read'] / max(stats['elapsed'], 1e-9):.0f} 条/秒")
+
+    def on_import_finished(self, stats):
+        self.import_job = None
+        self.status_progress.setText("")
+        BaseAppMessage().show_message(
+            f"已导入 {stats['imported']} 条，跳过重复 {stats['duplicates']} 条、无效 {stats['invalid']} 条，"
+            f"用时 {stats['elapsed']:.1f} 秒", 5000)
+
+    def on_import_failed(self, error):
+        self.import_job = None
+        self.status_progress.setText("")
+        self.show_job_error(error)
+
+    def start_backup_job(self):
+        """到期时在后台做一次增量备份，不需要解锁：备份中的密码仍是密文"""
+        if self.backup_job is not None:
+            return
+        self.backup_job = self.runner.submit(self.backup_record, pass_cancel_event=True,
+                                             on_result=self.on_backup_finished, on_error=self.on_backup_failed)
+
+    def on_backup_finished(self, result):
+        self.backup_job = None
+
+    def on_backup_failed(self, error):
+        self.backup_job = None
+        print(f"定时备份未完成: {error!r}")
+
+    def export_backup(self):
+        """把整个库导出为由库密钥加密的文件"""
+        path, _ = QFileDialog.getSaveFileName(self, "导出备份", "lockbox-export.lbx", "LockBox 导出 (*.lbx)")
+        if not path:
+            return
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.export_record, path, cipher, key='export',
+            on_result=lambda counts: BaseAppMessage().show_message(
+                f"已导出 {counts.get('user', 0)} 条记录到 {path}，用时 {counts['elapsed']:.1f} 秒", 3000),
+            on_error=self.show_job_error))
+
+    def sync_now(self):
+        """立即同步，第一次使用时选择共享目录（网盘或局域网共享中的文件夹）"""
+        sync_dir = self.sync_dir
+        if sync_dir is None:
+            sync_dir = QFileDialog.getExistingDirectory(self, "选择同步目录")
+            if not sync_dir:
+                return
+        self.require_cipher(lambda cipher: self.start_sync_job(cipher, sync_dir, quiet=False))
+
+    def auto_sync(self):
+        if self.sync_dir is not None and self.session.is_unlocked:
+            self.start_sync_job(self.session.cipher, self.sync_dir, quiet=True)
+
+    def start_sync_job(self, cipher, sync_dir, quiet):
+        if self.sync_job is not None:
+            if not quiet:
+                BaseAppMessage().show_message("正在同步，请稍候", 2500)
+            return
+        self.status_sync.setText("🔄 同步中…")
+        self.sync_job = self.runner.submit(
+            self.sync_record, cipher, sync_dir, pass_cancel_event=True,
+            on_result=lambda stats: self.on_sync_finished(stats, sync_dir, quiet),
+            on_error=lambda error: self.on_sync_failed(error, quiet))
+
+    def on_sync_finished(self, stats, sync_dir, quiet):
+        self.sync_job = None
+        self.sync_dir = sync_dir
+        self.update_sync_status(stats)
+        if not quiet:
+            BaseAppMessage().show_message(f"同步完成：发送 {stats['sent']} 条，收到 {stats['received']} 条，"
+                                          f"冲突 {stats['conflicts']} 条", 3000)
+
+    def on_sync_failed(self, error, quiet):
+        self.sync_job = None
+        self.status_sync.setText("🔄 同步失败")
+        if quiet:
+            print(f"自动同步失败: {error!r}")
+        else:
+            self.show_job_error(error)
+
+    def on_sync_status(self, status):
+        self.sync_dir, last_sync = status
+        self.update_sync_status(last_sync)
+
+    def update_sync_status(self, stats):
+        """状态栏显示上次同步的时间和双方交换的变更数、字节数"""
+        if stats is None:
+            self.status_sync.setText("🔄 尚未同步")
+            return
+        at = time.localtime(stats['at'])
+        day = "今天" if at[:3] == time.localtime()[:3] else time.strftime("%m-%d", at)
+        self.status_sync.setText(f"🔄 最后同步: {day} {time.strftime('%H:%M', at)}  "
+                                 f"↑{stats['sent']} 条 {stats['bytes_sent'] / 1024:.1f} KB  "
+                                 f"↓{stats['received']} 条 {stats['bytes_received'] / 1024:.1f} KB")
 
     def create_toolbar(self):
         toolbar = QWidget()
@@ -227,10 +645,26 @@ class PasswordManager(QMainWindow):
         toolbar_layout.addWidget(title)
 
         # 搜索框
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("搜索网站或用户名")
+        self.runner.submit(self.user_name_encrypted_record, on_result=self.update_search_placeholder,
+                           on_error=lambda error: print(f"读取用户名加密状态失败: {error!r}"))
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setMinimumWidth(160)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        # 每次输入都重新计时，停止输入后才真正搜索
+        self.search_box.textChanged.connect(lambda _: self.search_timer.start())
+        toolbar_layout.addWidget(self.search_box, stretch=1)
+
+        # 密钥框
         self.key_box = QLineEdit()
         self.key_box.setEchoMode(QLineEdit.EchoMode.PasswordEchoOnEdit)
-        self.key_box.setPlaceholderText("密钥")
+        self.key_box.setPlaceholderText("密钥或主密码")
         self.key_box.setMinimumWidth(200)
+        self.key_box.returnPressed.connect(self.unlock_by_key_box)
         toolbar_layout.addWidget(self.key_box, stretch=1)
 
         # 添加按钮
@@ -242,7 +676,7 @@ class PasswordManager(QMainWindow):
         return toolbar
 
     def add_password(self):
-        if self.key_box.text() == "":
+        if self.key_box.text() == "" and not self.session.is_unlocked:
             BaseAppMessage().show_message('请在顶部密钥框填写您的密钥！', 2500)
             return
         self.sub_window = AddPasswordDialog()
@@ -258,163 +692,415 @@ class PasswordManager(QMainWindow):
 
 
     def create_password_list(self, datas=None):
-        self.scroll_area = QScrollArea()
-        # self.scroll_area.setStyleSheet("border: 2px solid red;")
-        self.scroll_area.setWidgetResizable(True)
-
-        container = QWidget()
-        self.container_layout = QVBoxLayout(container)
-        self.container_layout.setContentsMargins(5, 5, 5, 5)
-        self.container_layout.setSpacing(10)
-
-        self.max_id = 0
-        used_id = set()
+        # 只绘制可见行的列表，不再为每条记录创建一组控件
+        self.password_view = PasswordListView()
+        self.password_model = self.password_view.list_model
+        self.password_view.delegate.action_triggered.connect(self.on_row_action)
+        self.password_view.delegate.site_clicked.connect(launch_chrome)
+        self.password_model.fetch_requested.connect(self.load_password_page)
+
+        # 当前正在加载列表的任务（分页加载或搜索），新的加载开始前取消
+        self.list_job = None
         if datas is not None:
-            for data in datas:
-                used_id.add(data['id'])
-                if data['id'] >= self.max_id:
-                    self.max_id = data['id']
-                self.create_password_item(data)
-        if self.max_id == 0:
-            self.id_pool = {1,2,3,4,5,6,7,8,9,10}
-        else:
-            self.id_pool = {i for i in range(1, self.max_id + 5)} - used_id
-
-
-        self.container_layout.addStretch()
-        self.scroll_area.setWidget(container)
-
-        return self.scroll_area
-
-    def create_password_item(self, data):
+            self.add_loaded_items(datas)
+
+        return self.password_view
+
+    def clear_password_list(self):
+        self.password_model.clear()
+
+    def reload_password_list(self):
+        """清空列表并从第一页重新懒加载，首屏耗时与记录总数无关"""
+        self.password_model.clear(has_more=True)
+        self.password_model.fetchMore()
+
+    def load_password_page(self, after_id=None):
+        """在工作线程中读取下一页记录，由模型的 fetchMore 触发"""
+        self.list_job = self.runner.submit(self.connect_and_read_db, SQLITE_DB_PATH, after_id,
+                                           cipher=self.unlocked_cipher(),
+                                           on_result=self.on_password_page_loaded,
+                                           on_error=self.on_password_page_failed)
+
+    def run_search(self):
+        if self.list_job is not None:
+            self.list_job.cancel()
+        query = self.search_box.text().strip()
+        if not query:
+            self.reload_password_list()
+            return
+        self.list_job = self.runner.submit(self.search_records, query, self.unlocked_cipher(),
+                                           on_result=self.show_search_results, on_error=self.show_job_error)
+
+    def show_search_results(self, datas):
+        self.clear_password_list()
+        self.add_loaded_items(datas)
+
+    def on_password_page_loaded(self, datas):
+        self.password_model.append_page(datas, has_more=len(datas) == PAGE_SIZE)
+
+    def on_password_page_failed(self, error):
+        self.password_model.fetch_failed()
+        self.show_job_error(error)
+
+    def poll_changes(self):
+        """检查其他进程的提交，有变更时由 ChangeFeed 发布"""
+        self.runner.submit(self.change_feed.poll, key='change_feed',
+                           on_error=lambda error: print(f"读取变更失败: {error!r}"))
+
+    def on_rows_changed(self, changes):
+        """收到行级变更：删除的行直接移除，新增和修改的行合并后按 id 读取，不重新加载整个列表"""
+        browsing = not self.search_box.text().strip()
+        refresh = []
+        for change in changes:
+            if change.table != USER_TABLE:
+                continue
+            record_cache.invalidate_many(change.ids)
+            if change.op == DELETE:
+                self.pending_rows.difference_update(change.ids)
+                self.password_model.remove_records(change.ids)
+            elif change.op == UPDATE:
+                refresh += [record_id for record_id in change.ids if self.password_model.has_record(record_id)]
+            elif browsing:
+                # 搜索结果不插入新记录；一次新增超过一页时只显示最新的一页，其余由懒加载读取
+                ids = sorted(change.ids, reverse=True)
+                if len(ids) > PAGE_SIZE:
+                    if self.list_job is not None:
+                        self.list_job.cancel()
+                    ids = ids[:PAGE_SIZE]
+                    self.password_model.truncate(ids[-1])
+                refresh += ids
+        self.queue_row_refresh(refresh)
+
+    def queue_row_refresh(self, record_ids):
+        if not record_ids:
+            return
+        self.pending_rows.update(record_ids)
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start()
+
+    def refresh_rows(self):
+        record_ids, self.pending_rows = sorted(self.pending_rows), set()
+        if record_ids:
+            self.runner.submit(self.read_records, record_ids, self.unlocked_cipher(),
+                               on_result=self.apply_row_changes, on_error=self.show_job_error)
+
+    def apply_row_changes(self, result):
+        """把按 id 读出的记录合并到列表：已删除的移除，已加载的更新，浏览时按位置插入新记录"""
+        record_ids, rows = result
+        found = {row['id'] for row in rows}
+        self.password_model.remove_records([record_id for record_id in record_ids if record_id not in found])
+        missing = self.password_model.update_records(rows)
+        if missing and not self.search_box.text().strip():
+            self.password_model.insert_records(missing)
+
+    def add_loaded_items(self, datas):
+        """把数据库中读出的记录追加到列表末尾（记录按 id 降序到达）"""
+        self.password_model.append_records(datas)
+
+    def create_password_item(self, data, index=0):
         site = data['site']
         username = data['user_name']
-        pwd = data['pwd']
         record_id = data.get('id')
         if record_id is None:
-            if self.id_pool:
-                record_id = self.id_pool.pop()
-            else:
-                record_id = self.max_id + 1
-            if self.max_id <= record_id:
-                self.max_id = record_id
-
-            # 入库前转为密文
-            transformer = EncryptedMessage(self.key_box.text())
-            # secret_user_name = transformer.encrypt(username)
-            secret_user_pwd = transformer.encrypt(pwd)
-
-            # 插入数据
-            with SQLiteDB(SQLITE_DB_PATH) as db:
-                db.insert('user', {'id': record_id, 'site': site, 'user_name': username, 'pwd': secret_user_pwd})
-
-
-        item = QFrame()
-        item.setStyleSheet("""
-            QFrame {
-                background-color: #2E2E2E;
-                border-radius: 6px;
-            }
-        """)
-        item.setMinimumHeight(80)
-
-        item.pwd = pwd
-        item.record_id = record_id
-
-        layout = QHBoxLayout(item)
-        layout.setContentsMargins(15, 10, 15, 10)
-
-        # 网站图标
-        icon = QLabel()
-        icon.setPixmap(QIcon("icons/website.png").pixmap(40, 40))
-        layout.addWidget(icon)
-
-        # 信息区域
-        info_widget = QWidget()
-        info_layout = QVBoxLayout(info_widget)
-        info_layout.setContentsMargins(0, 0, 0, 0)
-
-        item.site_label = QLabel(site)
-        item.site_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
-
-        item.site_label.setCursor(Qt.CursorShape.PointingHandCursor)  # 设置手型光标
-
-        # 通过事件过滤器实现点击
-        item.site_label.mousePressEvent = lambda event, url=site: (
-            launch_chrome(url) if event.button() == Qt.MouseButton.LeftButton else None
-        )
-
-        info_layout.addWidget(item.site_label)
-
-        item.user_label = QLabel(username)
-        item.user_label.setStyleSheet("color: #AAAAAA;")
-        info_layout.addWidget(item.user_label)
-
-        layout.addWidget(info_widget, stretch=1)
-
-        # 操作按钮
-        btn_widget = QWidget()
-        btn_layout = QHBoxLayout(btn_widget)
-        btn_layout.setContentsMargins(0, 0, 0, 0)
-
-        item.copy_btn = QPushButton("复制密码")
-        item.copy_btn.setStyleSheet("background-color: transparent;color: rgb(255, 255, 255);font-size:14px")
-        item.copy_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        item.copy_btn.clicked.connect(lambda: self.cp_btn(item))
-        btn_layout.addWidget(item.copy_btn)
-
-        item.qr_code_btn = QPushButton("二维码")
-        item.qr_code_btn.setStyleSheet("background-color: transparent;color: rgb(255, 255, 255);font-size:14px")
-        item.qr_code_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        item.qr_code_btn.clicked.connect(lambda: self.qr_code_btn(item))
-        btn_layout.addWidget(item.qr_code_btn)
-
-        item.del_btn = QPushButton("删除")
-        item.del_btn.setStyleSheet("background-color: transparent;color: rgb(255, 255, 255);font-size:14px")
-        item.del_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        item.del_btn.clicked.connect(lambda: self.del_btn(item))
-        btn_layout.addWidget(item.del_btn)
-
-        layout.addWidget(btn_widget)
-
-        self.container_layout.insertWidget(0, item)
-
-    def qr_code_btn(self, item):
-        if self.key_box.text() == '':
-            BaseAppMessage().show_message("请在上方密钥栏填写密钥", 2500)
+            # 加密和入库在工作线程中按提交顺序执行，id 由数据库分配后再创建列表项
+            self.require_cipher(lambda cipher: self.runner.submit(
+                self.insert_record, site, username, data['pwd'], cipher, key='insert',
+                on_result=lambda new_id: self.create_password_item({**data, 'id': new_id}, index),
+                on_error=self.show_job_error))
             return
-        key_text = self.key_box.text()
-        transformer = EncryptedMessage(key_text)
-        with SQLiteDB(SQLITE_DB_PATH) as db:
-            res = db.select('user', ['pwd'], f'id={item.record_id}', fetch_all=False)
-
-        qr_site_info = item.site_label.text()
-        qr_user_name = item.user_label.text()
-        qr_pwd_info = transformer.decrypt(res[0]['pwd'])
 
-        generate_qrcode(f"site:{qr_site_info}\nuser:{qr_user_name}\npwd:{qr_pwd_info}")
+        # 入库完成前列表可能已经重新加载，新记录已在其中
+        if self.password_model.row_of(record_id) >= 0:
+            return
+        self.password_model.insert_record({'id': record_id, 'site': site, 'user_name': username,
+                                           'attachments': data.get('attachments', 0)}, index)
+
+    def on_row_action(self, action, item):
+        """列表行内按钮被点击，item 为 {'id', 'site', 'user_name', 'attachments'}"""
+        if action == 'copy':
+            self.cp_btn(item)
+        elif action == 'qr_code':
+            self.qr_code_btn(item)
+        elif action == 'attachment':
+            self.attachment_btn(item)
+        elif action == 'delete':
+            self.del_btn(item)
+
+    # 以下 *_record 函数在工作线程中执行，不能访问界面控件
+    @staticmethod
+    def insert_record(site, username, pwd, cipher):
+        # 入库前转为密文，用户名改为加密存储后同时写入盲索引
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            if get_pwd_storage(db) == PWD_STORAGE_BLOB:
+                secret_user_pwd = cipher.encrypt_bytes(pwd)
+            else:
+                secret_user_pwd = cipher.encrypt(pwd)
+            data = {'site': site, **user_name_values(db, cipher, username), 'pwd': secret_user_pwd}
+            return db.insert('user', data)
+
+    @staticmethod
+    def search_records(query, cipher=None):
+        """网站全文搜索；已解锁时再按盲索引精确匹配加密的用户名，放在结果最前面"""
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            rows = db.search(query, SEARCH_LIMIT, columns=LIST_COLUMNS)
+            if cipher is not None:
+                try:
+                    index_key = get_index_key(db, cipher.secret_key)
+                except InvalidToken:
+                    index_key = None
+                if index_key is not None:
+                    exact = find_by_user_name(db, index_key, query, columns=LIST_COLUMNS)
+                    ids = {row['id'] for row in exact}
+                    rows = exact + [row for row in rows if row['id'] not in ids]
+            rows = rows[:SEARCH_LIMIT]
+            counts = count_attachments(db, [row['id'] for row in rows])
+        for row in rows:
+            row['attachments'] = counts.get(row['id'], 0)
+        return decrypt_user_names(rows, cipher)
+
+    @staticmethod
+    def read_records(record_ids, cipher=None):
+        """按 id 读取列表显示的字段，返回 (record_ids, 记录)，已删除的记录不在结果中"""
+        rows = []
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            for start in range(0, len(record_ids), REFRESH_CHUNK):
+                chunk = record_ids[start:start + REFRESH_CHUNK]
+                chunk_rows = db.select('user', LIST_COLUMNS, f"id IN ({', '.join('?' * len(chunk))})", tuple(chunk))
+                counts = count_attachments(db, [row['id'] for row in chunk_rows])
+                for row in chunk_rows:
+                    row['attachments'] = counts.get(row['id'], 0)
+                rows += chunk_rows
+        return record_ids, decrypt_user_names(rows, cipher)
+
+    @staticmethod
+    def decrypt_record(record_id, cipher):
+        # 短时间内重复复制、生成二维码直接命中缓存
+        return record_cache.get_password(record_id, cipher, rotate=LAZY_ROTATION)
+
+    @staticmethod
+    def qrcode_record(record_id, site, username, cipher):
+        # 列表中的用户名可能是占位文字，以库中的为准
+        username = record_cache.get_user_name(record_id, cipher)
+        pwd = PasswordManager.decrypt_record(record_id, cipher)
+        return make_qrcode(f"site:{site}\nuser:{username}\npwd:{pwd}")
+
+    @staticmethod
+    def unlock_record(text, adopt=False):
+        """text 为库密钥或主密码，确认密钥属于本库后返回 (库密钥, 轮换中的旧密钥)"""
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            secret_key = text if is_secret_key(text) else unwrap_secret_key(db, text)
+            verify_secret_key(db, secret_key, adopt)
+            return secret_key, get_old_keys(db, secret_key)
+
+    @staticmethod
+    def key_file_record(key_path):
+        """返回 (密钥文件中的库密钥, 是否已设置主密码)；已设置主密码或没有密钥文件时不读取文件，库密钥为 None"""
+        if not os.path.exists(key_path):
+            return None, False
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            migrate(db)
+            if has_master_password(db):
+                return None, True
+        with open(key_path, "r") as f:
+            lines = f.readlines()
+        return (lines[0].strip() if lines else None), False
+
+    @staticmethod
+    def master_password_record(secret_key, password):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            return set_master_password(db, secret_key, password)
+
+    @staticmethod
+    def convert_storage_record(cancel_event=None):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            migrate(db)
+        return convert_pwd_storage(SQLITE_DB_PATH, PWD_STORAGE_BLOB, cancel_event=cancel_event)
+
+    @staticmethod
+    def start_rotation_record(old_key, new_key, password):
+        """开始轮换；使用默认密钥文件且未设置主密码时，文件在轮换提交之前原子地换成新密钥
+
+        设置了主密码时不把库密钥明文写入磁盘，密钥文件保持原样。提交失败时把文件改回旧密钥，
+        文件中的密钥始终能打开库。
+        """
+        written = []
+
+        def update_key_file():
+            # 在写事务中检查，与保存轮换状态看到的是同一个库状态
+            if os.path.exists(SECRET_KEY_PATH) and not has_master_password(db):
+                write_key_file(new_key)
+                written.append(new_key)
+
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            try:
+                return start_rotation(db, old_key, new_key, password or None, before_commit=update_key_file)
+            except BaseException:
+                if written:
+                    write_key_file(old_key)
+                raise
+
+    @staticmethod
+    def rotate_vault_record(cipher, cancel_event=None):
+        return rotate_vault(SQLITE_DB_PATH, cipher, cancel_event=cancel_event)
+
+    @staticmethod
+    def encrypt_user_names_record(cipher, enable=False, cancel_event=None):
+        return encrypt_user_names(SQLITE_DB_PATH, cipher, cancel_event=cancel_event, enable=enable, vacuum=enable)
+
+    @staticmethod
+    def user_name_encrypted_record():
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            migrate(db)
+            return is_user_name_encrypted(db)
+
+    @staticmethod
+    def scan_keys_record(cipher, cancel_event=None):
+        return find_foreign_rows(SQLITE_DB_PATH, cipher, cancel_event=cancel_event)
+
+    @staticmethod
+    def scrub_record(cipher, cancel_event=None):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            if not scrub_due(db):
+                return None
+        return scrub_vault(SQLITE_DB_PATH, cipher, cancel_event=cancel_event)
+
+    @staticmethod
+    def import_record(path, cipher, cancel_event=None, progress=None):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            migrate(db)
+        return import_file(SQLITE_DB_PATH, cipher, path, cancel_event=cancel_event, progress=progress)
+
+    @staticmethod
+    def sync_status_record():
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            migrate(db)
+            return get_sync_dir(db), get_sync_state(db)['last_sync']
+
+    @staticmethod
+    def sync_record(cipher, sync_dir, cancel_event=None):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            if get_sync_dir(db) != sync_dir:
+                with db.transaction():
+                    set_sync_dir(db, sync_dir)
+        return sync_vault(SQLITE_DB_PATH, cipher, sync_dir, cancel_event=cancel_event)
+
+    @staticmethod
+    def backup_record(cancel_event=None):
+        if not backup_due(BACKUP_DIR):
+            return None
+        return scheduled_backup(SQLITE_DB_PATH, BACKUP_DIR, cancel_event=cancel_event)
+
+    @staticmethod
+    def export_record(path, cipher):
+        return export_vault(SQLITE_DB_PATH, cipher, path)
+
+    @staticmethod
+    def list_attachments_record(record_id, cipher):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            return list_attachments(db, cipher, record_id)
+
+    @staticmethod
+    def add_attachment_record(record_id, path, cipher):
+        """加密并存入附件，返回记录的附件数"""
+        add_attachment(SQLITE_DB_PATH, cipher, record_id, path)
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            return count_attachments(db, [record_id]).get(record_id, 0)
+
+    @staticmethod
+    def export_attachment_record(attachment_id, path, cipher):
+        export_attachment(SQLITE_DB_PATH, cipher, attachment_id, path)
+        return path
+
+    @staticmethod
+    def delete_attachment_record(record_id, attachment_id):
+        """删除一个附件，返回记录剩余的附件数"""
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            delete_attachments(db, record_id, attachment_id)
+            return count_attachments(db, [record_id]).get(record_id, 0)
+
+    @staticmethod
+    def delete_record(record_id):
+        with SQLiteDB(SQLITE_DB_PATH, pooled=True) as db:
+            with db.transaction():
+                db.delete('user', 'id = ?', (record_id,))
+                delete_attachments(db, record_id)
+        record_cache.invalidate(record_id)
+
+    def show_job_error(self, error):
+        if isinstance(error, InvalidToken):
+            BaseAppMessage().show_message("密钥错误，无法解密", 2500)
+        elif isinstance(error, KeyMismatch):
+            BaseAppMessage().show_message(str(error), 2500)
+        else:
+            BaseAppMessage().show_message(f"操作失败: {error}", 2500)
 
+    def qr_code_btn(self, item):
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.qrcode_record, item['id'], item['site'], item['user_name'], cipher, key=item['id'],
+            on_result=lambda img: img.show(), on_error=self.show_job_error))
 
     def cp_btn(self, item):
-        if self.key_box.text() == '':
-            BaseAppMessage().show_message("请在上方密钥栏填写密钥", 2500)
-            return
-        # copy_app = QApplication([])  # 必须创建 QApplication 实例?
-        key_text = self.key_box.text()
-        transformer = EncryptedMessage(key_text)
-        with SQLiteDB(SQLITE_DB_PATH) as db:
-            res = db.select('user', ['pwd'], f'id={item.record_id}', fetch_all=False)
-            text = transformer.decrypt(res[0]['pwd'])
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.decrypt_record, item['id'], cipher, key=item['id'],
+            on_result=self.copy_to_clipboard, on_error=self.show_job_error))
+
+    def copy_to_clipboard(self, text):
         clipboard = QApplication.clipboard()
         clipboard.setText(text)
 
         BaseAppMessage().show_message(f"{text} 已复制到剪贴板", 2500)
 
+    def attachment_btn(self, item):
+        """读取附件列表后在鼠标位置弹出菜单：导出、删除已有附件或添加新附件"""
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.list_attachments_record, item['id'], cipher, key=item['id'],
+            on_result=lambda attachments: self.show_attachment_menu(item, attachments),
+            on_error=self.show_job_error))
+
+    def show_attachment_menu(self, item, attachments):
+        menu = QMenu(self)
+        for attachment in attachments:
+            label = f"{attachment['name']}（{(attachment['size'] + 1023) // 1024} KB）"
+            menu.addAction(f"导出 {label}", lambda a=attachment: self.export_attachment(a))
+        if attachments:
+            delete_menu = menu.addMenu("删除附件")
+            for attachment in attachments:
+                delete_menu.addAction(attachment['name'], lambda a=attachment: self.delete_attachment(item, a))
+            menu.addSeparator()
+        menu.addAction("添加附件…", lambda: self.add_attachment(item))
+        menu.exec(QCursor.pos())
+
+    def add_attachment(self, item):
+        path, _ = QFileDialog.getOpenFileName(self, "选择附件")
+        if not path:
+            return
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.add_attachment_record, item['id'], path, cipher, key=item['id'],
+            on_result=lambda count: self.on_attachments_changed(item['id'], count, "附件已添加"),
+            on_error=self.show_job_error))
+
+    def export_attachment(self, attachment):
+        path, _ = QFileDialog.getSaveFileName(self, "导出附件", attachment['name'])
+        if not path:
+            return
+        self.require_cipher(lambda cipher: self.runner.submit(
+            self.export_attachment_record, attachment['id'], path, cipher, key=attachment['record_id'],
+            on_result=lambda dst: BaseAppMessage().show_message(f"已导出到 {dst}", 2500),
+            on_error=self.show_job_error))
+
+    def delete_attachment(self, item, attachment):
+        self.runner.submit(self.delete_attachment_record, item['id'], attachment['id'], key=item['id'],
+                           on_result=lambda count: self.on_attachments_changed(item['id'], count, "附件已删除"),
+                           on_error=self.show_job_error)
+
+    def on_attachments_changed(self, record_id, count, message):
+        self.password_model.set_attachments(record_id, count)
+        BaseAppMessage().show_message(message, 2500)
+
     def del_btn(self, item):
-        item.deleteLater()
-        self.container_layout.removeWidget(item)
-        with SQLiteDB(SQLITE_DB_PATH) as db:
-            db.delete('user', f"id={item.record_id}")
+        self.password_model.remove_record(item['id'])
+        self.runner.submit(self.delete_record, item['id'], key=item['id'],
+                           on_error=self.show_job_error)
 
     def create_status_bar(self):
         status_bar = QWidget()
@@ -424,12 +1110,16 @@ class PasswordManager(QMainWindow):
         status_encrypted = QLabel("🔒 已加密")
         status_layout.addWidget(status_encrypted)
 
-        status_sync = QLabel("🔄 最后同步: 今天 15:30")
-        status_layout.addWidget(status_sync)
+        self.status_sync = QLabel("🔄 尚未同步")
+        status_layout.addWidget(self.status_sync)
 
         status_stats = QLabel("📊 总计: 42 个项目")
         status_layout.addWidget(status_stats, stretch=1)
 
+        # 后台批量任务的进度
+        self.status_progress = QLabel("")
+        status_layout.addWidget(self.status_progress)
+
         status_layout.addWidget(QLabel("v1.0.0"))
 
         return status_bar
@@ -438,5 +1128,10 @@ class PasswordManager(QMainWindow):
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = PasswordManager()
+    # 退出前等待排队中的修改写完，再关闭所有长连接
+    app.aboutToQuit.connect(window.runner.shutdown)
+    app.aboutToQuit.connect(window.change_feed.close)
+    app.aboutToQuit.connect(connection_manager.close_all)
+    app.aboutToQuit.connect(record_cache.clear)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -1,5 +1,9 @@
 import qrcode
 
+def make_qrcode(text='test'):
+    """只生成二维码图片，不显示，可在工作线程中调用"""
+    return qrcode.make(text)
+
 def generate_qrcode(text='test'):
-    img = qrcode.make(text)
+    img = make_qrcode(text)
     img.show()
\ No newline at end of file
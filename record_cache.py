@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.migrations import internal_rewrite
+
+# 第一层：记录（含密文）的条数上限
+RECORD_CACHE_SIZE = 4096
+# 第二层：明文的条数上限和存活秒数
+PLAINTEXT_CACHE_SIZE = 16
+PLAINTEXT_TTL = 30
+# invalidate_many 一次超过这么多 id 时整体换代，不再逐个记录代数
+BULK_INVALIDATE_SIZE = 64
+
+
+class _Plaintext:
+    __slots__ = ('buffer', 'cipher', 'expires')
+
+    def __init__(self, text: str, cipher: EncryptedMessage, expires: float):
+        self.buffer = bytearray(text.encode('utf-8'))
+        self.cipher = cipher
+        self.expires = expires
+
+    def wipe(self):
+        """原地清零明文，尽力而为：已经交给调用方的 str 副本无法清除"""
+        self.buffer[:] = bytes(len(self.buffer))
+        self.cipher = None
+
+
+class RecordCache:
+    """界面与 SQLiteDB/EncryptedMessage 之间的两层缓存，可在多个工作线程中同时使用
+
+    第一层按 id 缓存记录（site、用户名和密文），读穿透，写入时由调用方 invalidate；
+    第二层是很小的明文 LRU，条目超过 ttl 秒或被挤出时原地清零。
+    每个 id 有一个代数，invalidate 时加一，清空或批量失效时整体换代；读取数据库前记下代数，
+    读取期间被 invalidate 过的结果不放入缓存，避免把旧密文或旧明文一直留在缓存中。
+    代数同样只保留最近 record_size 个 id，被挤出的 id 无法再比较，挤出时整体换代，
+    因此内存占用与库的大小无关，代价只是正在进行的读取偶尔不放入缓存。
+    同一条记录短时间内重复复制、生成二维码不再查询数据库和解密，也不会让所有明文常驻内存。
+    """
+    def __init__(self, db_path, record_size: int = RECORD_CACHE_SIZE,
+                 plaintext_size: int = PLAINTEXT_CACHE_SIZE, plaintext_ttl: float = PLAINTEXT_TTL,
+                 table_name: str = 'user'):
+        """
+        :param db_path: 数据库文件路径
+        :param record_size: 第一层最多缓存的记录数
+        :param plaintext_size: 第二层最多缓存的明文数
+        :param plaintext_ttl: 明文的存活秒数
+        :param table_name: 表名
+        """
+        self.db_path = db_path
+        self.record_size = record_size
+        self.plaintext_size = plaintext_size
+        self.plaintext_ttl = plaintext_ttl
+        self.table_name = table_name
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._plaintexts = OrderedDict()
+        # 最近被 invalidate 过的 id 的代数，最多 record_size 个；
+        # _epoch 在清空缓存、批量失效或挤出代数时加一，之前记下的所有代数都不再相等
+        self._generations = OrderedDict()
+        self._epoch = 0
+
+    def _generation(self, record_id: int):
+        """record_id 当前的代数，需持有锁"""
+        return self._epoch, self._generations.get(record_id, 0)
+
+    def get_record(self, record_id: int) -> Optional[Dict]:
+        """返回 {'id', 'site', 'user_name', 'user_name_enc', 'pwd'}，未缓存时从数据库读取，不存在返回 None"""
+        with self._lock:
+            record = self._records.get(record_id)
+            if record is not None:
+                self._records.move_to_end(record_id)
+                return record
+            generation = self._generation(record_id)
+        with SQLiteDB(self.db_path, pooled=True) as db:
+            rows = db.select(self.table_name, ['id', 'site', 'user_name', 'user_name_enc', 'pwd'], 'id = ?',
+                             (record_id,), fetch_all=False)
+        if not rows:
+            return None
+        self._put_record(rows[0], generation)
+        return rows[0]
+
+    def _put_record(self, record: Dict, generation):
+        with self._lock:
+            if self._generation(record['id']) != generation:
+                return
+            self._records[record['id']] = record
+            self._records.move_to_end(record['id'])
+            while len(self._records) > self.record_size:
+                self._records.popitem(last=False)
+
+    def get_password(self, record_id: int, cipher: EncryptedMessage, rotate: bool = False) -> str:
+        """返回记录的明文密码
+        :param record_id: 记录 id
+        :param cipher: 已解锁的密码器，明文只在同一个密码器下命中
+        :param rotate: 密文由旧密钥加密时顺便重新加密并写回数据库
+        :raises LookupError: 记录不存在
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._plaintexts.get(record_id)
+            if entry is not None and entry.cipher is cipher and entry.expires > now:
+                self._plaintexts.move_to_end(record_id)
+                return entry.buffer.decode('utf-8')
+            generation = self._generation(record_id)
+        record = self.get_record(record_id)
+        if record is None:
+            raise LookupError("记录不存在")
+        if rotate and cipher.old_keys:
+            text, new_pwd = cipher.decrypt_rotated(record['pwd'])
+            if new_pwd is not None:
+                with SQLiteDB(self.db_path, pooled=True) as db:
+                    with db.transaction(), internal_rewrite(db):
+                        db.update(self.table_name, {'pwd': new_pwd}, 'id = ? AND pwd = ?',
+                                  (record_id, record['pwd']))
+                self.invalidate(record_id)
+        else:
+            text = cipher.decrypt(record['pwd'])
+        with self._lock:
+            if self._generation(record_id) != generation:
+                # 解密期间记录被修改（包括上面的重新加密）或会话已锁定，明文不放入缓存
+                return text
+            old = self._plaintexts.pop(record_id, None)
+            if old is not None:
+                old.wipe()
+            self._plaintexts[record_id] = _Plaintext(text, cipher, now + self.plaintext_ttl)
+            while len(self._plaintexts) > self.plaintext_size:
+                self._plaintexts.popitem(last=False)[1].wipe()
+        return text
+
+    def get_user_name(self, record_id: int, cipher: EncryptedMessage) -> str:
+        """返回记录的用户名，加密存储时解密
+        :raises LookupError: 记录不存在
+        """
+        record = self.get_record(record_id)
+        if record is None:
+            raise LookupError("记录不存在")
+        if record['user_name'] is None and record['user_name_enc'] is not None:
+            return cipher.decrypt(record['user_name_enc'])
+        return record['user_name']
+
+    def invalidate(self, record_id: int):
+        """记录被修改或删除后调用"""
+        with self._lock:
+            self._generations[record_id] = self._generations.pop(record_id, 0) + 1
+            if len(self._generations) > self.record_size:
+                self._generations.popitem(last=False)
+                self._epoch += 1
+            self._drop(record_id)
+
+    def invalidate_many(self, record_ids):
+        """一批记录被修改或删除后调用，数量较多时（导入、同步、密钥轮换）整体换代而不逐个记录代数"""
+        record_ids = list(record_ids)
+        if len(record_ids) <= BULK_INVALIDATE_SIZE:
+            for record_id in record_ids:
+                self.invalidate(record_id)
+            return
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            for record_id in record_ids:
+                self._drop(record_id)
+
+    def _drop(self, record_id: int):
+        """从两层缓存中移除一条记录，需持有锁"""
+        self._records.pop(record_id, None)
+        entry = self._plaintexts.pop(record_id, None)
+        if entry is not None:
+            entry.wipe()
+
+    def purge_expired(self):
+        """清除过期的明文，由界面定时调用"""
+        now = time.monotonic()
+        with self._lock:
+            for record_id in [k for k, entry in self._plaintexts.items() if entry.expires <= now]:
+                self._plaintexts.pop(record_id).wipe()
+
+    def clear_plaintext(self):
+        """清除全部明文，会话锁定时调用"""
+        with self._lock:
+            for entry in self._plaintexts.values():
+                entry.wipe()
+            self._plaintexts.clear()
+            self._epoch += 1
+            self._generations.clear()
+
+    def clear(self):
+        """清除两层缓存，批量改写密文（密钥轮换、存储格式转换）后调用"""
+        self.clear_plaintext()
+        with self._lock:
+            self._records.clear()
+
+
+def benchmark_cache(rows: int = 1000, repeats: int = 1000):
+    """比较同一条记录重复操作时未命中（查询 + 解密）与命中缓存的耗时"""
+    import os
+    import tempfile
+    from db.migrations import migrate
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        with SQLiteDB(db_path) as db:
+            migrate(db)
+            db.insert_many('user', [{'site': f'site{i}', 'user_name': f'user{i}',
+                                     'pwd': cipher.encrypt_bytes(f'P@ssw0rd-{i}')} for i in range(rows)])
+        record_id = rows // 2
+        for label, cache in (('无缓存', None), ('命中缓存', RecordCache(db_path))):
+            if cache is not None:
+                cache.get_password(record_id, cipher)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                # 无缓存时每次都是新的 RecordCache，相当于查询数据库并解密
+                (cache or RecordCache(db_path)).get_password(record_id, cipher)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<6} {elapsed / repeats * 1e6:8.1f} us/次")
+
+
+if __name__ == '__main__':
+    benchmark_cache()
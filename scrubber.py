@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from encrypted_file import EncryptedMessage
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta
+from db.migrations import SCRUB_FAILURE_TABLE
+from key_check import ENCRYPTED_COLUMNS
+
+# meta 表中保存进行中的检查进度和上一轮的结果
+SCRUB_META_KEY = 'scrub_state'
+SCRUB_BATCH_SIZE = 500
+# 检查任务占用时间的比例上限，其余时间休眠，把数据库和 CPU 让给界面和其他写入
+SCRUB_DUTY_CYCLE = 0.5
+# 两轮完整检查之间的最短间隔（秒）
+SCRUB_INTERVAL = 24 * 3600
+
+
+def get_scrub_state(db: SQLiteDB) -> Optional[Dict]:
+    """返回 {'checkpoint', 'verified', 'failed', 'elapsed', ...}，从未检查过时返回 None"""
+    value = get_meta(db, SCRUB_META_KEY)
+    return None if value is None else json.loads(value)
+
+
+def scrub_due(db: SQLiteDB, interval: float = SCRUB_INTERVAL) -> bool:
+    """是否需要检查：有未完成的一轮，或上一轮结束已超过 interval 秒"""
+    state = get_scrub_state(db)
+    return (state is None or state['checkpoint'] is not None
+            or time.time() - state.get('finished_at', 0) > interval)
+
+
+def get_scrub_failures(db: SQLiteDB) -> List[Dict]:
+    """上一次检查发现的问题"""
+    return db.select(SCRUB_FAILURE_TABLE, ['record_id', 'column_name', 'error', 'found_at'])
+
+
+def _quick_check(db: SQLiteDB) -> List[str]:
+    rows = db.connection.execute("PRAGMA quick_check").fetchall()
+    return [row[0] for row in rows if row[0] != 'ok']
+
+
+def scrub_vault(db_path, cipher: EncryptedMessage, table_name: str = 'user',
+                batch_size: int = SCRUB_BATCH_SIZE, duty_cycle: float = SCRUB_DUTY_CYCLE,
+                max_workers: Optional[int] = None, cancel_event: Optional[threading.Event] = None,
+                progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """后台完整性检查：按 id 顺序逐批验证每个密文都能通过认证，并执行 PRAGMA quick_check
+
+    进度保存在 meta 中，取消或退出后再次调用从检查点继续；一轮开始时先执行 quick_check，
+    并清空上一轮的问题记录。每批密文交给 decrypt_many 并行验证，验证结果和检查点在一个短事务中写入，
+    之后按 duty_cycle 休眠，使检查只占用一部分时间。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器
+    :param table_name: 表名
+    :param batch_size: 每批验证的行数
+    :param duty_cycle: 工作时间占比（0~1），1 表示不休眠
+    :param max_workers: 并行验证的并发数
+    :param cancel_event: 置位后在当前批次结束时停止
+    :param progress: 每批结束后在工作线程中调用，参数为当前进度
+    :return: 当前进度，'checkpoint' 为 None 表示本轮已完成
+    """
+    with SQLiteDB(db_path, pooled=True) as db:
+        state = get_scrub_state(db)
+        if state is None or state['checkpoint'] is None:
+            # 开始新一轮
+            problems = _quick_check(db)
+            state = {'checkpoint': 0, 'verified': 0, 'failed': len(problems), 'elapsed': 0.0,
+                     'started_at': time.time(), 'quick_check': problems or ['ok']}
+            with db.transaction():
+                db.delete(SCRUB_FAILURE_TABLE, '1 = 1')
+                for problem in problems:
+                    db.insert(SCRUB_FAILURE_TABLE, {'record_id': None, 'column_name': None, 'error': problem,
+                                                    'found_at': time.time()})
+                set_meta(db, SCRUB_META_KEY, json.dumps(state))
+        while cancel_event is None or not cancel_event.is_set():
+            start = time.perf_counter()
+            rows = db.select_page(table_name, state['checkpoint'], batch_size,
+                                  columns=['id'] + list(ENCRYPTED_COLUMNS))
+            if not rows:
+                state['checkpoint'] = None
+                state['finished_at'] = time.time()
+                with db.transaction():
+                    set_meta(db, SCRUB_META_KEY, json.dumps(state))
+                break
+            values = [(row['id'], column, row[column]) for row in rows for column in ENCRYPTED_COLUMNS
+                      if row[column] is not None]
+            results = cipher.decrypt_many((value for _, _, value in values), max_workers=max_workers)
+            failures = [(record_id, column, repr(error)) for (record_id, column, _), (_, error)
+                        in zip(values, results) if error is not None]
+            state['checkpoint'] = rows[-1]['id']
+            state['verified'] += len(values)
+            state['failed'] += len(failures)
+            with db.transaction():
+                for record_id, column, error in failures:
+                    db.insert(SCRUB_FAILURE_TABLE, {'record_id': record_id, 'column_name': column, 'error': error,
+                                                    'found_at': time.time()})
+                elapsed = time.perf_counter() - start
+                state['elapsed'] += elapsed
+                set_meta(db, SCRUB_META_KEY, json.dumps(state))
+            if progress is not None:
+                progress(dict(state))
+            if 0 < duty_cycle < 1:
+                pause = elapsed * (1 - duty_cycle) / duty_cycle
+                if cancel_event is None:
+                    time.sleep(pause)
+                else:
+                    cancel_event.wait(pause)
+    if state['checkpoint'] is None and state['elapsed']:
+        print(f"完整性检查完成：验证 {state['verified']} 个密文，发现 {state['failed']} 个问题，"
+              f"{state['verified'] / state['elapsed']:.0f} 个/秒（不含休眠）")
+    return state
@@ -0,0 +1,427 @@
+import io
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from encrypted_file import EncryptedMessage, atomic_write
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta
+from db.migrations import REPLICA_ID_META_KEY, SYNC_CHANGE_TABLE, USER_TABLE
+from attachments import delete_attachments
+from backup import IterReader, LineWriter, decode_row, json_line
+from blind_index import compute, get_index_key, is_user_name_encrypted
+from key_check import verify_secret_key
+
+# meta 中保存的同步目录，以及按副本 id 保存的同步进度
+SYNC_DIR_META_KEY = 'sync_dir'
+SYNC_STATE_META_KEY = 'sync_state'
+SYNC_FORMAT = 'lockbox-sync'
+SYNC_VERSION = 1
+SYNC_FILE_SUFFIX = '.lbxs'
+# 自己的变更文件达到这个数量时，把全部本地变更合并为一个文件并删除旧文件
+SYNC_COMPACT_FILES = 50
+# 一个变更文件的条数超过本地记录数的这个比例时，不逐行维护全文索引，导入后一次重建
+SYNC_FTS_REBUILD_RATIO = 0.25
+# 导入变更文件时每个写事务最多写入的条数，避免长时间占用写锁
+SYNC_BATCH_LINES = 1000
+# 两次自动同步之间的间隔（秒）
+SYNC_INTERVAL = 300
+# 同步交换的列，附件按本地记录 id 关联，不参与同步
+SYNC_COLUMNS = ('site', 'user_name', 'user_name_enc', 'pwd')
+STAMP_COLUMNS = ('version', 'modified_at', 'origin')
+
+
+def get_replica_id(db: SQLiteDB) -> str:
+    return get_meta(db, REPLICA_ID_META_KEY)
+
+
+def get_sync_dir(db: SQLiteDB) -> Optional[str]:
+    return get_meta(db, SYNC_DIR_META_KEY)
+
+
+def set_sync_dir(db: SQLiteDB, sync_dir: str):
+    set_meta(db, SYNC_DIR_META_KEY, sync_dir)
+
+
+def get_sync_state(db: SQLiteDB) -> Dict:
+    """本副本的同步进度：{'exported_seq', 'file_no', 'imported': {副本 id: 文件编号}, 'last_sync'}
+
+    导入到一半的文件记在 'partial': {副本 id: [文件编号, 已写入的条数]} 中，
+    为重建全文索引而暂时删除的触发器记在 'fts_trigger' 中。
+
+    按副本 id 保存，从导出文件恢复出的新副本不会沿用原副本的进度。
+    """
+    value = get_meta(db, f'{SYNC_STATE_META_KEY}:{get_replica_id(db)}')
+    if value is None:
+        return {'exported_seq': 0, 'file_no': 0, 'imported': {}, 'last_sync': None}
+    return json.loads(value)
+
+
+def _save_state(db: SQLiteDB, replica_id: str, state: Dict):
+    set_meta(db, f'{SYNC_STATE_META_KEY}:{replica_id}', json.dumps(state))
+
+
+def _stamp(row) -> Tuple:
+    """版本戳：先比较版本号，相同时比较修改时间，再相同时比较副本 id，各副本得出同样的胜者"""
+    return row['version'], row['modified_at'] or 0.0, row['origin'] or ''
+
+
+def _list_files(folder) -> List[Tuple[int, str]]:
+    """folder 中的变更文件 [(编号, 路径)]，按编号升序"""
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        stem, suffix = os.path.splitext(name)
+        if suffix == SYNC_FILE_SUFFIX and stem.isdigit():
+            files.append((int(stem), os.path.join(folder, name)))
+    return sorted(files)
+
+
+def _change_lines(db: SQLiteDB, replica_id: str, file_no: int, after_seq: int, max_seq: int,
+                  counts: Dict) -> Iterator[bytes]:
+    changes = db.connection.execute(f"SELECT count(*) FROM {SYNC_CHANGE_TABLE} WHERE seq > ? AND seq <= ? "
+                                    f"AND local = 1", (after_seq, max_seq)).fetchone()[0]
+    yield json_line('header', {'format': SYNC_FORMAT, 'version': SYNC_VERSION, 'replica_id': replica_id,
+                               'file_no': file_no, 'changes': changes, 'created_at': time.time()})
+    columns = ', '.join(f'u.{column}' for column in SYNC_COLUMNS)
+    cursor = db.connection.execute(
+        f"SELECT c.uid, c.version, c.modified_at, c.origin, c.deleted, {columns} FROM {SYNC_CHANGE_TABLE} c "
+        f"LEFT JOIN {USER_TABLE} u ON u.uid = c.uid WHERE c.local = 1 AND c.seq > ? AND c.seq <= ? ORDER BY c.seq",
+        (after_seq, max_seq))
+    try:
+        for row in cursor:
+            counts['change'] += 1
+            row = dict(row)
+            if row['deleted']:
+                # 墓碑只需要版本戳
+                for column in SYNC_COLUMNS:
+                    del row[column]
+            yield json_line('change', row)
+    finally:
+        cursor.close()
+
+
+def _export_changes(db: SQLiteDB, cipher: EncryptedMessage, folder, replica_id: str, state: Dict,
+                    compact: bool, max_workers: Optional[int]) -> Tuple[int, int]:
+    """把上次导出后的本地变更写成一个新的变更文件，compact 时写入全部本地变更并删除旧文件
+    :return: (变更条数, 文件字节数)
+    """
+    if not compact and not db.connection.execute(
+            f"SELECT 1 FROM {SYNC_CHANGE_TABLE} WHERE seq > ? AND local = 1 LIMIT 1",
+            (state['exported_seq'],)).fetchone():
+        # 只有从其他副本收到的变更，不需要写文件
+        state['exported_seq'] = db.connection.execute(
+            f"SELECT coalesce(max(seq), 0) FROM {SYNC_CHANGE_TABLE}").fetchone()[0]
+        return 0, 0
+    # 先占用文件编号再写文件：中途退出时下次换用新的编号，已读过同名旧文件的副本不会漏掉变更
+    state['file_no'] += 1
+    file_no = state['file_no']
+    with db.transaction():
+        _save_state(db, replica_id, state)
+    path = os.path.join(folder, f'{file_no:08d}{SYNC_FILE_SUFFIX}')
+    counts = {'change': 0}
+    with db.transaction(immediate=False):
+        max_seq = db.connection.execute(f"SELECT coalesce(max(seq), 0) FROM {SYNC_CHANGE_TABLE}").fetchone()[0]
+        lines = _change_lines(db, replica_id, file_no, 0 if compact else state['exported_seq'], max_seq, counts)
+        with atomic_write(path) as dst:
+            cipher.encrypt_stream(io.BufferedReader(IterReader(lines), 1 << 20), dst, max_workers=max_workers)
+    state['exported_seq'] = max_seq
+    with db.transaction():
+        _save_state(db, replica_id, state)
+    if compact:
+        for old_no, old_path in _list_files(folder):
+            if old_no < file_no:
+                os.unlink(old_path)
+    return counts['change'], os.path.getsize(path)
+
+
+def _user_name_values(row: Dict, cipher: EncryptedMessage, index_key: Optional[bytes]) -> Dict:
+    """按本库的存储方式得到 user_name 相关列，两个库的盲索引密钥不同，盲索引在本地重新计算"""
+    user_name = row['user_name']
+    if user_name is None and row['user_name_enc'] is not None:
+        user_name = cipher.decrypt(row['user_name_enc'])
+    if index_key is None or user_name is None:
+        return {'user_name': user_name, 'user_name_enc': None, 'user_name_bidx': None}
+    return {'user_name': None, 'user_name_enc': row['user_name_enc'] or cipher.encrypt_bytes(user_name),
+            'user_name_bidx': compute(index_key, user_name)}
+
+
+def _apply_change(db: SQLiteDB, row: Dict, cipher: EncryptedMessage, index_key: Optional[bytes]) -> Tuple[bool, bool]:
+    """按版本戳把一条远端变更合并到本库，版本戳不大于本地的变更被丢弃
+
+    写入时带上远端的版本戳，触发器不会把它当作本地修改；sync_change 中记为非本地变更，不会再发送回去。
+    :return: (是否写入, 是否与本地修改冲突)
+    """
+    current = db.cursor.execute(f"SELECT id, version, modified_at, origin FROM {USER_TABLE} WHERE uid = ?",
+                                (row['uid'],)).fetchone()
+    change = db.cursor.execute(f"SELECT version, modified_at, origin, deleted, local FROM {SYNC_CHANGE_TABLE} "
+                               f"WHERE uid = ?", (row['uid'],)).fetchone()
+    # 双方基于同一版本各自修改过即为冲突，由版本戳决定保留哪一方
+    conflict = (change is not None and change['local'] == 1 and row['version'] <= change['version']
+                and _stamp(row) != _stamp(change))
+    known = current if current is not None else change if change is not None and change['deleted'] else None
+    if known is not None and _stamp(row) <= _stamp(known):
+        return False, conflict
+    stamp = tuple(row[column] for column in STAMP_COLUMNS)
+    record_id = current['id'] if current is not None else None
+    if row['deleted']:
+        if current is not None:
+            delete_attachments(db, current['id'])
+            db.cursor.execute(f"DELETE FROM {USER_TABLE} WHERE id = ?", (current['id'],))
+    else:
+        values = {'site': row['site'], 'pwd': row['pwd'], **_user_name_values(row, cipher, index_key),
+                  **dict(zip(STAMP_COLUMNS, stamp))}
+        if current is None:
+            values['uid'] = row['uid']
+            db.cursor.execute(f"INSERT INTO {USER_TABLE} ({', '.join(values)}) "
+                              f"VALUES ({', '.join('?' * len(values))})", tuple(values.values()))
+            record_id = db.cursor.lastrowid
+        else:
+            db.cursor.execute(f"UPDATE {USER_TABLE} SET {', '.join(f'{column} = ?' for column in values)} "
+                              f"WHERE id = ?", (*values.values(), current['id']))
+    db.cursor.execute(f"INSERT OR REPLACE INTO {SYNC_CHANGE_TABLE} "
+                      f"(uid, version, modified_at, origin, deleted, local, record_id) VALUES (?, ?, ?, ?, ?, 0, ?)",
+                      (row['uid'], *stamp, 1 if row['deleted'] else 0, record_id))
+    return True, conflict
+
+
+def _import_changes(db: SQLiteDB, cipher: EncryptedMessage, sync_dir, replica_id: str, state: Dict, stats: Dict,
+                    max_workers: Optional[int], cancel_event: Optional[threading.Event]):
+    """读取其他副本尚未导入的变更文件
+
+    每 SYNC_BATCH_LINES 条变更与文件内的进度在一个事务中写入，解密在事务之外进行，
+    其他连接的写入最多等待一批；中断后从记下的条数继续。
+    """
+    try:
+        _import_files(db, cipher, sync_dir, replica_id, state, stats, max_workers, cancel_event)
+    finally:
+        if 'fts_trigger' in state:
+            with db.transaction():
+                _restore_fts_trigger(db, state)
+                _save_state(db, replica_id, state)
+
+
+def _restore_fts_trigger(db: SQLiteDB, state: Dict):
+    """重建全文索引并恢复导入前删除的触发器，在事务中调用"""
+    if 'fts_trigger' in state:
+        db.execute_sql(f"INSERT INTO {USER_TABLE}_fts ({USER_TABLE}_fts) VALUES ('rebuild')")
+        sql = state.pop('fts_trigger')
+        # 用户名加密完成后全文索引会连同触发器一起重建，此时不再恢复旧的定义
+        if not db.select('sqlite_master', ['name'], "type = 'trigger' AND name = ?", (f'{USER_TABLE}_fts_ai',),
+                         fetch_all=False):
+            db.execute_sql(sql)
+
+
+def _import_files(db: SQLiteDB, cipher: EncryptedMessage, sync_dir, replica_id: str, state: Dict, stats: Dict,
+                  max_workers: Optional[int], cancel_event: Optional[threading.Event]):
+    index_key = get_index_key(db, cipher.secret_key) if is_user_name_encrypted(db) else None
+    fts_trigger = f'{USER_TABLE}_fts_ai'
+    partial = state.setdefault('partial', {})
+    for remote_id in sorted(os.listdir(sync_dir)):
+        folder = os.path.join(sync_dir, remote_id)
+        if remote_id == replica_id or not os.path.isdir(folder):
+            continue
+        for file_no, path in _list_files(folder):
+            if file_no <= state['imported'].get(remote_id, 0):
+                continue
+            if cancel_event is not None and cancel_event.is_set():
+                raise InterruptedError("同步已取消")
+            try:
+                src = open(path, 'rb')
+            except FileNotFoundError:
+                # 对方刚合并了旧文件，合并后的文件编号更大，下次同步时读取
+                continue
+            done = partial[remote_id][1] if partial.get(remote_id, [None])[0] == file_no else 0
+            header = []
+            batch = []
+            seen = [0]
+
+            def flush(last: bool):
+                nonlocal done
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("同步已取消")
+                with db.transaction():
+                    for row in batch:
+                        applied, conflict = _apply_change(db, row, cipher, index_key)
+                        stats['applied'] += applied
+                        stats['conflicts'] += conflict
+                    done += len(batch)
+                    if not last:
+                        partial[remote_id] = [file_no, done]
+                    else:
+                        _restore_fts_trigger(db, state)
+                        partial.pop(remote_id, None)
+                        state['imported'][remote_id] = file_no
+                    _save_state(db, replica_id, state)
+                batch.clear()
+
+            def apply_line(line: bytes):
+                record = json.loads(line)
+                kind, row = record['type'], decode_row(record['row'])
+                if kind == 'header':
+                    if (row.get('format') != SYNC_FORMAT or row.get('version') != SYNC_VERSION
+                            or row.get('replica_id') != remote_id):
+                        raise ValueError(f"{path} 不是副本 {remote_id} 的同步文件")
+                    header.append(row)
+                    rows = db.connection.execute(f"SELECT count(*) FROM {USER_TABLE}").fetchone()[0]
+                    if 'fts_trigger' not in state and row.get('changes', 0) - done > rows * SYNC_FTS_REBUILD_RATIO:
+                        # 触发器的定义与删除在同一个事务中记入进度，中断后由下一次同步重建索引并恢复
+                        trigger = db.select('sqlite_master', ['sql'], "type = 'trigger' AND name = ?",
+                                            (fts_trigger,), fetch_all=False)
+                        if trigger:
+                            with db.transaction():
+                                db.execute_sql(f"DROP TRIGGER {fts_trigger}")
+                                state['fts_trigger'] = trigger[0]['sql']
+                                _save_state(db, replica_id, state)
+                    return
+                if not header:
+                    raise ValueError(f"{path} 缺少头部")
+                seen[0] += 1
+                if seen[0] <= done:
+                    # 上次已写入
+                    return
+                stats['received'] += 1
+                batch.append(row)
+                if len(batch) >= SYNC_BATCH_LINES:
+                    flush(last=False)
+
+            with src:
+                writer = LineWriter(apply_line)
+                cipher.decrypt_stream(src, writer, max_workers)
+                writer.close()
+            flush(last=True)
+            stats['bytes_received'] += os.path.getsize(path)
+
+
+def _new_replica(db: SQLiteDB, old_id: str, state: Dict) -> str:
+    """改用新的副本 id，之后把原 id 目录中本库没有写过的文件当作另一个副本的变更导入"""
+    replica_id = os.urandom(8).hex()
+    state['imported'][old_id] = state['file_no']
+    state['file_no'] = 0
+    with db.transaction():
+        set_meta(db, REPLICA_ID_META_KEY, replica_id)
+        _save_state(db, replica_id, state)
+    print(f"副本 {old_id} 的目录中有本库没有写过的变更文件，本库是复制来的副本，改用新的副本 id {replica_id}")
+    return replica_id
+
+
+def sync_vault(db_path, cipher: EncryptedMessage, sync_dir, max_workers: Optional[int] = None,
+               cancel_event: Optional[threading.Event] = None) -> Dict:
+    """通过共享目录与其他副本交换变更
+
+    每个副本只在 sync_dir/<副本 id>/ 下写入自己的变更文件，文件内容是由库密钥加密的 JSON Lines，
+    只包含上次同步后由触发器记入 sync_change 的本地变更。先按版本戳合并其他副本的新文件，
+    再导出本地变更；自己的文件达到 SYNC_COMPACT_FILES 个时合并为一个。
+    各副本必须使用同一个库密钥。
+    :param db_path: 数据库文件路径
+    :param cipher: 已解锁的密码器
+    :param sync_dir: 共享目录
+    :param max_workers: 加解密的并发数
+    :param cancel_event: 置位后在下一批变更之前停止，已写入的变更保留，下次同步从中断处继续
+    :return: {'sent', 'received', 'applied', 'conflicts', 'bytes_sent', 'bytes_received', 'elapsed', 'at'}
+    :raises KeyMismatch: cipher 不是本库的密钥
+    :raises InvalidToken: 变更文件不是由同一个库密钥加密或已被改动
+    """
+    start = time.perf_counter()
+    stats = {'sent': 0, 'received': 0, 'applied': 0, 'conflicts': 0, 'bytes_sent': 0, 'bytes_received': 0}
+    with SQLiteDB(db_path, pooled=True) as db:
+        verify_secret_key(db, cipher.secret_key)
+        replica_id = get_replica_id(db)
+        state = get_sync_state(db)
+        folder = os.path.join(sync_dir, replica_id)
+        own = _list_files(folder)
+        if own and own[-1][0] > state['file_no']:
+            replica_id = _new_replica(db, replica_id, state)
+            folder = os.path.join(sync_dir, replica_id)
+            own = []
+        os.makedirs(folder, exist_ok=True)
+        _import_changes(db, cipher, sync_dir, replica_id, state, stats, max_workers, cancel_event)
+        stats['sent'], stats['bytes_sent'] = _export_changes(db, cipher, folder, replica_id, state,
+                                                             len(own) >= SYNC_COMPACT_FILES, max_workers)
+        stats['elapsed'] = time.perf_counter() - start
+        stats['at'] = time.time()
+        state['last_sync'] = stats
+        with db.transaction():
+            _save_state(db, replica_id, state)
+    print(f"同步完成：发送 {stats['sent']} 条变更（{stats['bytes_sent']} 字节），"
+          f"收到 {stats['received']} 条（{stats['bytes_received']} 字节），写入 {stats['applied']} 条，"
+          f"冲突 {stats['conflicts']} 条，用时 {stats['elapsed']:.2f} 秒")
+    return stats
+
+
+def benchmark_sync(rows: int = 100000, changes: int = 100):
+    """两个 rows 行的副本：首次同步全部记录，之后修改 changes 行、删除 changes // 10 行再同步"""
+    import tempfile
+    from db.bench import fake_rows
+    from db.migrations import migrate
+
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key())
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_dir = os.path.join(tmp, 'shared')
+        os.mkdir(sync_dir)
+        paths = [os.path.join(tmp, name) for name in ('a.db', 'b.db')]
+        for path in paths:
+            with SQLiteDB(path) as db:
+                migrate(db)
+                # 生成的密文是假的，直接采用密钥
+                verify_secret_key(db, cipher.secret_key, adopt=True)
+        with SQLiteDB(paths[0]) as db:
+            db.insert_many(USER_TABLE, list(fake_rows(rows)))
+        for label, path in (('首次发送', paths[0]), ('首次接收', paths[1])):
+            stats = sync_vault(path, cipher, sync_dir)
+            print(f"{label}: {stats['elapsed']:.2f} 秒")
+        with SQLiteDB(paths[0]) as db:
+            with db.transaction():
+                step = rows // changes
+                for record_id in range(1, rows + 1, step):
+                    db.cursor.execute(f"UPDATE {USER_TABLE} SET pwd = ? WHERE id = ?", (f'changed-{record_id}',
+                                                                                          record_id))
+                db.cursor.execute(f"DELETE FROM {USER_TABLE} WHERE id % ? = 2 AND id <= ?",
+                                  (step, changes // 10 * step))
+        for label, path in (('增量发送', paths[0]), ('增量接收', paths[1])):
+            stats = sync_vault(path, cipher, sync_dir)
+            print(f"{label}: {stats['elapsed']:.3f} 秒")
+        with SQLiteDB(paths[0]) as a, SQLiteDB(paths[1]) as b:
+            query = f"SELECT uid, version, site, user_name, pwd FROM {USER_TABLE} ORDER BY uid"
+            same = a.connection.execute(query).fetchall() == b.connection.execute(query).fetchall()
+        print(f"两个副本{'一致' if same else '不一致'}")
+
+
+def main(argv=None):
+    import argparse
+    from db.migrations import migrate
+
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+    parser = argparse.ArgumentParser(description="通过共享目录同步两个 LockBox 库")
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync_parser = commands.add_parser('sync', help="与共享目录中的其他副本交换变更")
+    sync_parser.add_argument('--dir', default=None, help="共享目录，默认使用库中保存的目录")
+    sync_parser.add_argument('--db', default=os.path.join(config_dir, 'sqlite_db.db'), help="数据库文件")
+    sync_parser.add_argument('--key-file', default=os.path.join(config_dir, 'secret_key.skf'),
+                             help="库密钥文件，默认 config/secret_key.skf")
+    commands.add_parser('bench', help="测量 100000 行副本的首次同步和增量同步")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        benchmark_sync()
+        return
+    with open(args.key_file, 'r', encoding='utf-8') as f:
+        cipher = EncryptedMessage(f.read().strip())
+    with SQLiteDB(args.db) as db:
+        migrate(db)
+        sync_dir = args.dir or get_sync_dir(db)
+        if sync_dir is None:
+            parser.error("库中没有保存同步目录，请用 --dir 指定")
+        if args.dir:
+            with db.transaction():
+                set_sync_dir(db, args.dir)
+    sync_vault(args.db, cipher, sync_dir)
+
+
+if __name__ == '__main__':
+    main()
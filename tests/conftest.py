@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录下，按脚本方式导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encrypted_file import EncryptedMessage  # noqa: E402
+
+
+@pytest.fixture
+def cipher():
+    return EncryptedMessage(EncryptedMessage.generate_secret_key())
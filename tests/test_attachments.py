@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import time
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+import attachments
+from attachments import add_attachment, count_attachments, export_attachment, list_attachments
+from db.db_tools import SQLiteDB
+from db.migrations import ATTACHMENT_TABLE, USER_TABLE, migrate
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def vault(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        record_id = db.insert(USER_TABLE, {'site': 'example.com', 'user_name': 'me', 'pwd': cipher.encrypt('pwd')})
+    return path, record_id
+
+
+@pytest.fixture
+def plain(tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(os.urandom(20 * CHUNK_SIZE + 123))
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def small_commits(monkeypatch):
+    # 让测试文件也分成多个写入事务
+    monkeypatch.setattr(attachments, 'ATTACHMENT_COMMIT_SIZE', 4 * CHUNK_SIZE)
+
+
+def attachment_ids(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return [row[0] for row in db.connection.execute(f"SELECT id FROM {ATTACHMENT_TABLE}").fetchall()]
+
+
+def test_round_trip(vault, plain, cipher, tmp_path):
+    path, record_id = vault
+    info = add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)
+    assert info['name'] == 'report.pdf' and info['size'] == os.path.getsize(plain)
+    with SQLiteDB(path, pooled=True) as db:
+        assert [row['name'] for row in list_attachments(db, cipher, record_id)] == ['report.pdf']
+        assert count_attachments(db, [record_id]) == {record_id: 1}
+    out = str(tmp_path / 'out.pdf')
+    assert export_attachment(path, cipher, info['id'], out) == info['size']
+    with open(plain, 'rb') as a, open(out, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_tampered_content_is_rejected(vault, plain, cipher, tmp_path):
+    path, record_id = vault
+    attachment_id = add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)['id']
+    with SQLiteDB(path, pooled=True) as db:
+        with db.transaction(), db.connection.blobopen(ATTACHMENT_TABLE, 'data', attachment_id) as blob:
+            blob.seek(5 * CHUNK_SIZE)
+            byte = blob.read(1)
+            blob.seek(5 * CHUNK_SIZE)
+            blob.write(bytes([byte[0] ^ 1]))
+    out = str(tmp_path / 'out.pdf')
+    with pytest.raises(InvalidToken):
+        export_attachment(path, cipher, attachment_id, out)
+    assert not os.path.exists(out)
+
+
+def test_write_lock_released_between_batches(vault, plain, cipher, monkeypatch):
+    path, record_id = vault
+    flush = attachments._BlobWriter.flush
+    seen = []
+
+    def flush_then_write(writer):
+        flush(writer)
+        # 不等待锁的连接也能在两批之间写入，未完成的附件对列表和计数不可见
+        other = sqlite3.connect(path, timeout=0)
+        try:
+            other.execute(f"UPDATE {USER_TABLE} SET site = ? WHERE id = ?", (f'site-{len(seen)}', record_id))
+            other.commit()
+        finally:
+            other.close()
+        with SQLiteDB(path, pooled=True) as db:
+            seen.append((len(list_attachments(db, cipher, record_id)), count_attachments(db, [record_id])))
+
+    monkeypatch.setattr(attachments._BlobWriter, 'flush', flush_then_write)
+    add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)
+    assert len(seen) > 2
+    assert all(state == (0, {}) for state in seen)
+
+
+def test_failure_removes_incomplete_row(vault, plain, cipher, monkeypatch):
+    path, record_id = vault
+
+    def fail(writer):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(attachments._BlobWriter, 'flush', fail)
+    with pytest.raises(OSError):
+        add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)
+    assert attachment_ids(path) == []
+
+
+def test_record_deleted_during_write(vault, plain, cipher, monkeypatch):
+    path, record_id = vault
+    flush = attachments._BlobWriter.flush
+
+    def flush_then_delete(writer):
+        flush(writer)
+        with SQLiteDB(path, pooled=True) as db:
+            db.delete(USER_TABLE, 'id = ?', (record_id,))
+
+    monkeypatch.setattr(attachments._BlobWriter, 'flush', flush_then_delete)
+    with pytest.raises(LookupError):
+        add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)
+    assert attachment_ids(path) == []
+
+
+def test_stale_incomplete_rows_are_cleaned(vault, plain, cipher):
+    path, record_id = vault
+    with SQLiteDB(path, pooled=True) as db:
+        with db.transaction():
+            db.cursor.execute(f"INSERT INTO {ATTACHMENT_TABLE} (record_id, created_at, data) VALUES (NULL, ?, x'00')",
+                              (time.time() - attachments.ATTACHMENT_STALE_SECONDS - 1,))
+    add_attachment(path, cipher, record_id, plain, chunk_size=CHUNK_SIZE)
+    with SQLiteDB(path, pooled=True) as db:
+        assert [row[0] for row in db.connection.execute(f"SELECT record_id FROM {ATTACHMENT_TABLE}")] == [record_id]
@@ -0,0 +1,210 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+import backup
+from attachments import add_attachment, export_attachment
+from backup import (apply_delta, export_vault, list_backups, restore_backup, restore_export, scheduled_backup,
+                    write_delta)
+from db.db_tools import SQLiteDB
+from db.meta import get_meta
+from db.migrations import ATTACHMENT_TABLE, REPLICA_ID_META_KEY, USER_TABLE, migrate
+from key_check import verify_secret_key
+
+
+@pytest.fixture
+def vault(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+        db.insert_many(USER_TABLE, [{'site': f'site{i:03d}.example.com', 'user_name': f'user{i}',
+                                     'pwd': cipher.encrypt(f'pwd{i}')} for i in range(200)])
+    return path
+
+
+def sites(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute(f"SELECT site FROM {USER_TABLE} ORDER BY id")]
+    finally:
+        connection.close()
+
+
+def replica_id(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return get_meta(db, REPLICA_ID_META_KEY)
+
+
+def execute(path, sql, params=()):
+    with SQLiteDB(path, pooled=True) as db:
+        with db.transaction():
+            db.cursor.execute(sql, params)
+
+
+def flip_byte(path, offset):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 1]))
+
+
+def test_delta_round_trip(vault, tmp_path):
+    old = str(tmp_path / 'old.db')
+    shutil.copyfile(vault, old)
+    execute(vault, f"UPDATE {USER_TABLE} SET site = 'changed.example.com' WHERE id = 5")
+    execute(vault, f"INSERT INTO {USER_TABLE} (site, user_name, pwd) VALUES (?, ?, ?)",
+            ('new.example.com', 'new', 'x' * 5000))
+    delta = str(tmp_path / 'delta.lbd')
+    changed, old_hash, new_hash = write_delta(old, vault, delta)
+    assert 0 < changed < os.path.getsize(vault) // backup._page_size(vault)
+    assert old_hash == backup._file_hash(old) and new_hash == backup._file_hash(vault)
+    apply_delta(old, delta)
+    assert backup._file_hash(old) == new_hash
+    # 重复应用结果不变
+    apply_delta(old, delta)
+    assert backup._file_hash(old) == new_hash
+
+
+def test_delta_to_smaller_file(vault, tmp_path):
+    old = str(tmp_path / 'old.db')
+    shutil.copyfile(vault, old)
+    execute(vault, f"DELETE FROM {USER_TABLE} WHERE id > 10")
+    with SQLiteDB(vault) as db:
+        db.execute_sql("VACUUM")
+    assert os.path.getsize(vault) < os.path.getsize(old)
+    delta = str(tmp_path / 'delta.lbd')
+    new_hash = write_delta(old, vault, delta)[2]
+    apply_delta(old, delta)
+    assert backup._file_hash(old) == new_hash
+
+
+def test_delta_rejects_bad_input(vault, tmp_path):
+    other = str(tmp_path / 'other.db')
+    connection = sqlite3.connect(other)
+    connection.execute("PRAGMA page_size = 8192")
+    connection.execute("CREATE TABLE t (x)")
+    connection.close()
+    with pytest.raises(ValueError):
+        write_delta(other, vault, str(tmp_path / 'mismatch.lbd'))
+    old = str(tmp_path / 'old.db')
+    shutil.copyfile(vault, old)
+    execute(vault, f"UPDATE {USER_TABLE} SET site = 'changed.example.com' WHERE id = 5")
+    delta = str(tmp_path / 'delta.lbd')
+    write_delta(old, vault, delta)
+    with open(delta, 'r+b') as f:
+        f.truncate(os.path.getsize(delta) - 1)
+    with pytest.raises(ValueError):
+        apply_delta(old, delta)
+    with pytest.raises(ValueError):
+        apply_delta(old, vault)
+
+
+def test_backup_chain_with_retention(vault, tmp_path, monkeypatch):
+    backup_dir = str(tmp_path / 'backups')
+    # 同一毫秒内的两次备份会得到相同的增量文件名
+    clock = iter(range(1_000_000, 2_000_000, 10))
+    monkeypatch.setattr(backup.time, 'time', lambda: next(clock))
+    states = []
+    for i in range(6):
+        execute(vault, f"UPDATE {USER_TABLE} SET site = ? WHERE id = ?", (f'edit{i}.example.com', i + 1))
+        result = scheduled_backup(vault, backup_dir, keep=3, pause=0)
+        assert result['pages'] > 0
+        states.append(sites(vault))
+    points = list_backups(backup_dir)
+    assert len(points) == 3
+    assert sorted(name for name in os.listdir(backup_dir) if name.startswith('delta-')) == \
+        sorted(delta['file'] for delta in backup.load_manifest(backup_dir)['deltas'])
+    for point, state in zip(points, states[-3:]):
+        dst = str(tmp_path / f'restored{point["index"]}.db')
+        restore_backup(backup_dir, point['index'], dst)
+        assert sites(dst) == state
+    # 数据库没有变化时不产生还原点
+    assert scheduled_backup(vault, backup_dir, keep=3, pause=0)['pages'] == 0
+    assert len(list_backups(backup_dir)) == 3
+
+
+def test_backup_recovers_from_stale_latest(vault, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    scheduled_backup(vault, backup_dir, pause=0)
+    # latest.db 与清单不一致（例如上次在替换前退出），由备份链重建后再计算增量
+    execute(vault, f"UPDATE {USER_TABLE} SET site = 'stale.example.com' WHERE id = 1")
+    flip_byte(os.path.join(backup_dir, backup.BACKUP_LATEST), os.path.getsize(vault) // 2)
+    scheduled_backup(vault, backup_dir, pause=0)
+    dst = str(tmp_path / 'restored.db')
+    restore_backup(backup_dir, -1, dst)
+    assert sites(dst) == sites(vault)
+
+
+def test_tampered_delta_is_rejected(vault, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    scheduled_backup(vault, backup_dir, pause=0)
+    execute(vault, f"UPDATE {USER_TABLE} SET site = 'changed.example.com' WHERE id = 1")
+    scheduled_backup(vault, backup_dir, pause=0)
+    delta = backup.load_manifest(backup_dir)['deltas'][0]['file']
+    flip_byte(os.path.join(backup_dir, delta), os.path.getsize(os.path.join(backup_dir, delta)) - 10)
+    dst = str(tmp_path / 'restored.db')
+    with pytest.raises(ValueError):
+        restore_backup(backup_dir, 1, dst)
+    assert not os.path.exists(dst)
+    # 更早的还原点不受影响
+    restore_backup(backup_dir, 0, dst)
+
+
+def test_export_round_trip(vault, cipher, tmp_path):
+    record_id = 7
+    plain = tmp_path / 'note.txt'
+    plain.write_bytes(os.urandom(3 * backup.EXPORT_ATTACHMENT_CHUNK // 2))
+    attachment_id = add_attachment(vault, cipher, record_id, str(plain))['id']
+    # 还在写入中的附件不导出
+    execute(vault, f"INSERT INTO {ATTACHMENT_TABLE} (record_id, created_at, data) VALUES (NULL, 0, x'00')")
+    export_path = str(tmp_path / 'vault.lbx')
+    counts = export_vault(vault, cipher, export_path)
+    assert (counts[USER_TABLE], counts[ATTACHMENT_TABLE]) == (200, 1)
+
+    restored = str(tmp_path / 'restored.db')
+    counts = restore_export(export_path, cipher, restored)
+    assert (counts[USER_TABLE], counts[ATTACHMENT_TABLE], counts['attachment_data']) == (200, 1, 2)
+    assert sites(restored) == sites(vault)
+    out = str(tmp_path / 'out.txt')
+    export_attachment(restored, cipher, attachment_id, out)
+    assert open(out, 'rb').read() == plain.read_bytes()
+    with SQLiteDB(restored, pooled=True) as db:
+        verify_secret_key(db, cipher.secret_key)
+        assert get_meta(db, REPLICA_ID_META_KEY) != replica_id(vault)
+        # 恢复时暂时删除的全文索引触发器已重建，索引包含恢复的和之后新增的记录
+        assert db.select('sqlite_master', ['name'], "type = 'trigger' AND name = ?", (f'{USER_TABLE}_fts_ai',))
+        with db.transaction():
+            db.cursor.execute(f"INSERT INTO {USER_TABLE} (site, user_name, pwd) VALUES ('later.example.org', 'u', 'p')")
+        match = f"SELECT COUNT(*) FROM {USER_TABLE}_fts WHERE {USER_TABLE}_fts MATCH ?"
+        assert db.connection.execute(match, ('"site042"',)).fetchone()[0] == 1
+        assert db.connection.execute(match, ('"later.example.org"',)).fetchone()[0] == 1
+    with pytest.raises(FileExistsError):
+        restore_export(export_path, cipher, restored)
+
+
+def test_tampered_export_leaves_nothing(vault, cipher, tmp_path):
+    export_path = str(tmp_path / 'vault.lbx')
+    export_vault(vault, cipher, export_path)
+    flip_byte(export_path, os.path.getsize(export_path) // 2)
+    restored = str(tmp_path / 'restored.db')
+    with pytest.raises(InvalidToken):
+        restore_export(export_path, cipher, restored)
+    assert [name for name in os.listdir(tmp_path) if name.startswith('restored')] == []
+
+
+def test_cancelled_export_keeps_previous_file(vault, cipher, tmp_path):
+    export_path = str(tmp_path / 'vault.lbx')
+    export_vault(vault, cipher, export_path)
+    previous = open(export_path, 'rb').read()
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(InterruptedError):
+        export_vault(vault, cipher, export_path, cancel_event=cancel)
+    assert open(export_path, 'rb').read() == previous
+    assert sorted(os.listdir(tmp_path)) == ['vault.db', 'vault.lbx']
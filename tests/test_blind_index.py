@@ -0,0 +1,104 @@
+import os
+
+from blind_index import encrypt_user_names, find_by_user_name, get_index_key, is_user_name_encrypted
+from db.db_tools import SQLiteDB
+from db.migrations import USER_TABLE, migrate
+from key_check import verify_secret_key
+
+NAMES = [f'plaintext-user-{i:03d}@example.com' for i in range(300)]
+
+
+def make_vault(path, cipher):
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+        db.insert_many(USER_TABLE, [{'site': f'site{i:03d}.example.com', 'user_name': name, 'pwd': 'x'}
+                                    for i, name in enumerate(NAMES)])
+
+
+def file_bytes(path):
+    data = b''
+    for suffix in ('', '-wal', '-journal'):
+        if os.path.exists(path + suffix):
+            with open(path + suffix, 'rb') as f:
+                data += f.read()
+    return data
+
+
+def fts_columns(db):
+    return [column[0] for column in db.connection.execute(f"SELECT * FROM {USER_TABLE}_fts LIMIT 0").description]
+
+
+def test_encrypt_user_names_requires_opt_in(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    make_vault(path, cipher)
+    assert encrypt_user_names(path, cipher) == 0
+    with SQLiteDB(path, pooled=True) as db:
+        assert not is_user_name_encrypted(db)
+        assert len(db.search('plaintext-user-042', columns=['id'])) == 1
+
+
+def test_encrypt_user_names_leaves_no_plaintext(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    make_vault(path, cipher)
+    assert NAMES[0].encode() in file_bytes(path)
+
+    assert encrypt_user_names(path, cipher, batch_size=50, enable=True, vacuum=True) == len(NAMES)
+
+    data = file_bytes(path)
+    assert not any(name.encode() in data for name in NAMES)
+    with SQLiteDB(path, pooled=True) as db:
+        assert is_user_name_encrypted(db)
+        # 索引结构仍是迁移定义的两列，加密的用户名不在其中
+        assert fts_columns(db) == ['site', 'user_name']
+        assert db.search('plaintext-user-042', columns=['id']) == []
+        index_key = get_index_key(db, cipher.secret_key)
+        assert len(find_by_user_name(db, index_key, NAMES[7].upper(), columns=['id'])) == 1
+        assert [row['site'] for row in db.search('site042', columns=['site'])] == ['site042.example.com']
+        with db.transaction():
+            db.cursor.execute(f"UPDATE {USER_TABLE} SET site = 'renamed.example.org' WHERE site = 'site001.example.com'")
+        assert len(db.search('renamed', columns=['id'])) == 1
+        assert db.search('site001', columns=['id']) == []
+
+
+def test_opted_in_vault_encrypts_new_plaintext_on_resume(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    make_vault(path, cipher)
+    encrypt_user_names(path, cipher, enable=True)
+    assert encrypt_user_names(path, cipher) == 0
+    # 例如同步收到的明文用户名，解锁时不需要再次选择即可加密，索引中也不留下明文
+    with SQLiteDB(path) as db:
+        db.insert(USER_TABLE, {'site': 'synced.example.com', 'user_name': 'synced-user', 'pwd': 'x'})
+    assert encrypt_user_names(path, cipher) == 1
+    assert b'synced-user' not in file_bytes(path)
+    with SQLiteDB(path, pooled=True) as db:
+        assert db.search('synced-user', columns=['id']) == []
+        assert db.connection.execute(f"SELECT count(*) FROM {USER_TABLE} WHERE user_name IS NOT NULL").fetchone()[0] == 0
+
+
+def test_migration_restores_site_only_fts(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    make_vault(path, cipher)
+    fts = f'{USER_TABLE}_fts'
+    # 之前的版本加密用户名后留下的只含 site 的索引
+    with SQLiteDB(path) as db:
+        with db.transaction():
+            for trigger in ('ai', 'ad', 'au'):
+                db.cursor.execute(f"DROP TRIGGER {fts}_{trigger}")
+            db.cursor.execute(f"DROP TABLE {fts}")
+            db.cursor.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(site, content='{USER_TABLE}', "
+                              f"content_rowid='id', tokenize='trigram case_sensitive 0')")
+            db.cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+            db.cursor.execute("PRAGMA user_version = 10")
+        migrate(db)
+        assert fts_columns(db) == ['site', 'user_name']
+        assert len(db.search('plaintext-user-042', columns=['id'])) == 1
+        assert {f'{fts}_ai', f'{fts}_ad', f'{fts}_au'} <= {row['name'] for row in db.select(
+            'sqlite_master', ['name'], "type = 'trigger'")}
+
+
+def test_encrypt_user_names_is_idempotent(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    make_vault(path, cipher)
+    encrypt_user_names(path, cipher, enable=True)
+    assert encrypt_user_names(path, cipher, enable=True) == 0
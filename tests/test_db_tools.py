@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from db.db_tools import SQLiteDB, connection_manager
+from db.migrations import USER_TABLE, migrate
+
+
+def synchronous(connection):
+    return connection.execute("PRAGMA synchronous").fetchone()[0]
+
+
+def test_pooled_connections_are_kept_per_profile(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path, pooled=True, profile='fast') as fast:
+        assert synchronous(fast.connection) == 0
+        fast_connection = fast.connection
+    with SQLiteDB(path, pooled=True) as default:
+        # 之后的普通写入不会复用 synchronous=OFF 的连接
+        assert default.connection is not fast_connection
+        assert synchronous(default.connection) == 2
+        default_connection = default.connection
+    with SQLiteDB(path, pooled=True, profile='fast') as fast:
+        assert fast.connection is fast_connection
+    custom = {'synchronous': 'NORMAL'}
+    with SQLiteDB(path, pooled=True, profile=custom) as db:
+        assert synchronous(db.connection) == 1
+        assert connection_manager.get(path, dict(custom)) is db.connection
+
+    connection_manager.reset(path, 'fast')
+    assert connection_manager.get(path, 'fast') is not fast_connection
+    assert connection_manager.get(path) is default_connection
+
+
+def journal_mode(connection):
+    return connection.execute("PRAGMA journal_mode").fetchone()[0]
+
+
+def test_default_profile_keeps_the_rollback_journal(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        assert journal_mode(db.connection) == 'delete'
+    with SQLiteDB(path, profile='balanced') as db:
+        assert journal_mode(db.connection) == 'wal'
+    # WAL 保留在文件中，默认配置打开时改回回滚日志
+    with SQLiteDB(path, profile=None) as db:
+        assert journal_mode(db.connection) == 'wal'
+    with SQLiteDB(path) as db:
+        assert journal_mode(db.connection) == 'delete'
+
+
+def test_only_database_errors_reset_the_pooled_connection(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path, pooled=True) as db:
+        db.execute_sql("CREATE TABLE t (x INTEGER)")
+        connection = db.connection
+    with pytest.raises(InterruptedError):
+        with SQLiteDB(path, pooled=True) as db:
+            db.cursor.execute("INSERT INTO t VALUES (1)")
+            raise InterruptedError
+    with SQLiteDB(path, pooled=True) as db:
+        # 连接保留，未提交的修改已回滚
+        assert db.connection is connection
+        assert not db.connection.in_transaction
+        assert db.select('t') == []
+    with pytest.raises(sqlite3.OperationalError):
+        with SQLiteDB(path, pooled=True) as db:
+            db.execute_sql("SELECT * FROM missing")
+    with SQLiteDB(path, pooled=True) as db:
+        assert db.connection is not connection
+
+
+def test_close_all_drops_thread_local_connections(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    connection = connection_manager.get(path)
+    connection_manager.close_all()
+    with SQLiteDB(path, pooled=True) as db:
+        assert db.connection is not connection
+        assert db.select('sqlite_master') == []
+
+
+def test_short_search_terms_are_combined_with_and(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        ab_cd, ab_ef, xy_cd, literal = (db.insert(USER_TABLE, {'site': site, 'user_name': name, 'pwd': 'x'})
+                                        for site, name in (('ab.example.com', 'cd'), ('ab.example.com', 'ef'),
+                                                           ('xy.example.com', 'cd'), ('ab cd', 'zz')))
+
+        def search(query):
+            return {row['id'] for row in db.search(query)}
+
+        # 每个词分别按前缀匹配网站或用户名，而不是把整个输入当作一个前缀
+        assert search('ab cd') == search('cd ab') == {ab_cd}
+        assert search('ab') == {ab_cd, ab_ef, literal}
+        # 短词与长词混合时同样逐词匹配
+        assert search('xy.example cd') == {xy_cd}
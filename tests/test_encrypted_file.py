@@ -0,0 +1,149 @@
+import base64
+import io
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from encrypted_file import (BACKENDS, FERNET_VERSION, FILE_MAGIC, FORMAT_VERSION, _BACKENDS_BY_ID, _FILE_HEADER_SIZE,
+                            _FILE_TAG_SIZE, CipherBackend, EncryptedMessage, _file_aead, _file_nonce)
+
+CHUNK_SIZE = 16
+# 三块：16 + 16 + 8 字节
+PLAINTEXT = bytes(range(40))
+
+
+def encrypt_stream(cipher, data, chunk_size=CHUNK_SIZE):
+    dst = io.BytesIO()
+    cipher.encrypt_stream(io.BytesIO(data), dst, chunk_size, max_workers=2)
+    return dst.getvalue()
+
+
+def decrypt_stream(cipher, data):
+    dst = io.BytesIO()
+    cipher.decrypt_stream(io.BytesIO(data), dst, max_workers=2)
+    return dst.getvalue()
+
+
+def split_chunks(data, chunk_size=CHUNK_SIZE):
+    """把 encrypt_stream 的输出拆成头部和各分块密文"""
+    size = chunk_size + _FILE_TAG_SIZE
+    body = data[_FILE_HEADER_SIZE:]
+    return data[:_FILE_HEADER_SIZE], [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_incomplete_backend_fails_on_instantiation():
+    key = EncryptedMessage.generate_secret_key()
+
+    class SealOnly(CipherBackend):
+        def seal(self, data):
+            return data
+
+    class Identity(SealOnly):
+        def open(self, token):
+            return token
+
+    with pytest.raises(TypeError):
+        SealOnly(key)
+    # 构造函数不是抽象方法，子类只需实现 seal/open
+    assert Identity(key).open(b'x') == b'x'
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_round_trip_per_backend(name):
+    key = EncryptedMessage.generate_secret_key()
+    cipher = EncryptedMessage(key, backend=name)
+    algorithm_id = BACKENDS[name].algorithm_id
+    for text in ('', 'p', '密码 P@ssw0rd' * 50):
+        token = cipher.encrypt(text)
+        raw = cipher.encrypt_bytes(text)
+        if algorithm_id == FERNET_VERSION:
+            assert raw[0] == FERNET_VERSION
+        else:
+            assert raw[:2] == bytes([FORMAT_VERSION, algorithm_id])
+        assert base64.urlsafe_b64decode(token)[:1] == raw[:1]
+        # 解密时按头部选择算法，不依赖当前使用的算法
+        for reader in (cipher, EncryptedMessage(key, backend='aes-gcm')):
+            assert reader.decrypt(token) == text
+            assert reader.decrypt(raw) == text
+    with pytest.raises(InvalidToken):
+        EncryptedMessage(EncryptedMessage.generate_secret_key()).decrypt(cipher.encrypt('x'))
+
+
+@pytest.mark.parametrize('algorithm_id', sorted(_BACKENDS_BY_ID))
+@pytest.mark.parametrize('data', [b'', PLAINTEXT[:8], PLAINTEXT[:32], PLAINTEXT])
+def test_stream_round_trip_per_backend(algorithm_id, data):
+    cipher = EncryptedMessage(EncryptedMessage.generate_secret_key(), backend=_BACKENDS_BY_ID[algorithm_id].name)
+    encrypted = encrypt_stream(cipher, data)
+    assert encrypted[:len(FILE_MAGIC)] == FILE_MAGIC
+    assert encrypted[5] == algorithm_id
+    assert decrypt_stream(cipher, encrypted) == data
+
+
+def test_stream_with_fernet_backend_uses_aes_gcm(cipher):
+    encrypted = encrypt_stream(cipher, PLAINTEXT)
+    assert encrypted[5] == BACKENDS['aes-gcm'].algorithm_id
+    assert decrypt_stream(cipher, encrypted) == PLAINTEXT
+
+
+@pytest.mark.parametrize('data', [PLAINTEXT, PLAINTEXT[:32]])
+def test_truncated_stream_is_rejected(cipher, data):
+    encrypted = encrypt_stream(cipher, data)
+    header, chunks = split_chunks(encrypted)
+    # 去掉最后一块（包括恰好在分块边界处截断）、截断到块中间、只剩头部或头部不完整
+    for truncated in (header + b''.join(chunks[:-1]), encrypted[:-1], encrypted[:-_FILE_TAG_SIZE - 1],
+                      header, header[:-1]):
+        with pytest.raises(InvalidToken):
+            decrypt_stream(cipher, truncated)
+
+
+def test_reordered_chunks_are_rejected(cipher):
+    header, chunks = split_chunks(encrypt_stream(cipher, PLAINTEXT + PLAINTEXT[:16]))
+    assert len(chunks) == 4
+    for order in ((1, 0, 2, 3), (0, 2, 1, 3)):
+        with pytest.raises(InvalidToken):
+            decrypt_stream(cipher, header + b''.join(chunks[i] for i in order))
+
+
+def test_flipped_last_flag_is_rejected(cipher):
+    """用正确的子密钥重新加密，只改动 nonce 中的最后一块标记，解密方按位置判断，仍无法通过认证"""
+    header, _ = split_chunks(encrypt_stream(cipher, PLAINTEXT))
+    aead = _file_aead(cipher.secret_key, header[5], header[10:])
+    pieces = [PLAINTEXT[i:i + CHUNK_SIZE] for i in range(0, len(PLAINTEXT), CHUNK_SIZE)]
+
+    def forge(last_flags):
+        return header + b''.join(aead.encrypt(_file_nonce(i, last), piece, header)
+                                 for i, (piece, last) in enumerate(zip(pieces, last_flags)))
+
+    assert decrypt_stream(cipher, forge([False, False, True])) == PLAINTEXT
+    for flags in ([False, False, False], [True, False, True], [False, True, True]):
+        with pytest.raises(InvalidToken):
+            decrypt_stream(cipher, forge(flags))
+
+
+def test_tampered_header_is_rejected(cipher):
+    encrypted = encrypt_stream(cipher, PLAINTEXT)
+    other_id = next(i for i in _BACKENDS_BY_ID if i != encrypted[5])
+    for offset, value in ((4, 0x02), (5, other_id), (5, 0x7f), (9, CHUNK_SIZE + 1), (_FILE_HEADER_SIZE - 1, 0)):
+        tampered = bytearray(encrypted)
+        tampered[offset] = value if tampered[offset] != value else value ^ 1
+        with pytest.raises(InvalidToken):
+            decrypt_stream(cipher, bytes(tampered))
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_legacy_fernet_tokens_still_decrypt(name):
+    key = EncryptedMessage.generate_secret_key()
+    token = Fernet(key).encrypt('旧密码'.encode('utf-8'))
+    cipher = EncryptedMessage(key, backend=name)
+    assert cipher.decrypt(token.decode('utf-8')) == '旧密码'
+    # BLOB 存储的是 base64 解码后的原始令牌，首字节为 0x80
+    raw = base64.urlsafe_b64decode(token)
+    assert raw[0] == FERNET_VERSION
+    assert cipher.decrypt(raw) == '旧密码'
+    text, rotated = cipher.decrypt_rotated(raw)
+    assert text == '旧密码'
+    if name == 'fernet':
+        assert rotated is None
+    else:
+        assert rotated[:2] == bytes([FORMAT_VERSION, BACKENDS[name].algorithm_id])
+        assert cipher.decrypt(rotated) == '旧密码'
@@ -0,0 +1,125 @@
+import csv
+import json
+import threading
+
+import pytest
+
+from blind_index import encrypt_user_names, find_by_user_name, get_index_key
+from db.db_tools import SQLiteDB
+from db.migrations import USER_TABLE, migrate
+from encrypted_file import EncryptedMessage
+from importer import detect_format, import_file, read_entries
+from key_check import KeyMismatch, verify_secret_key
+
+
+@pytest.fixture
+def vault(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+        db.insert(USER_TABLE, {'site': 'c.com', 'user_name': 'dave', 'pwd': cipher.encrypt('old')})
+    return path
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def records(path, cipher):
+    with SQLiteDB(path, pooled=True) as db:
+        rows = db.connection.execute(f"SELECT site, user_name, pwd FROM {USER_TABLE} ORDER BY id").fetchall()
+    return [(site, user_name, cipher.decrypt(pwd)) for site, user_name, pwd in rows]
+
+
+def test_csv_dedupe_and_malformed_rows(vault, cipher, tmp_path):
+    path = write_csv(tmp_path / 'chrome.csv', ['name', 'url', 'username', 'password', 'note'], [
+        ['a', 'https://a.com/login', 'alice', 'p1', ''],
+        ['a', 'https://a.com/', 'alice', 'p2', ''],             # 本批内重复
+        ['b', 'https://b.example.com:8443/x?y=1', 'bob', 'p3', ''],
+        ['e', 'https://e.com/', 'erin', '', ''],                # 没有密码
+        ['', '', 'frank', 'p5', ''],                            # 没有网址也没有名称
+        ['Wiki', '', 'carol', 'p6', ''],                        # 没有网址时用名称
+        ['c', 'https://c.com/', 'dave', 'p7', ''],              # 库中已有
+        ['x'],                                                  # 列数不足
+        ['a', 'https://a.com/', 'alice', 'p8', ''],             # 与之前的批次重复
+    ])
+    assert detect_format(path) == 'chrome'
+    stats = import_file(vault, cipher, path, batch_size=2)
+    assert (stats['read'], stats['imported'], stats['duplicates'], stats['invalid']) == (9, 3, 3, 3)
+    assert records(vault, cipher) == [('c.com', 'dave', 'old'), ('a.com', 'alice', 'p1'),
+                                      ('b.example.com', 'bob', 'p3'), ('Wiki', 'carol', 'p6')]
+
+
+def test_firefox_csv_without_name_column(tmp_path):
+    path = write_csv(tmp_path / 'firefox.csv', ['url', 'username', 'password', 'httpRealm'],
+                     [['https://a.com', 'alice', 'p1', ''], ['', 'bob', 'p2', '']])
+    assert detect_format(path) == 'firefox'
+    assert list(read_entries(path)) == [{'site': 'a.com', 'user_name': 'alice', 'pwd': 'p1'}, None]
+
+
+def test_unknown_csv_header(tmp_path):
+    path = write_csv(tmp_path / 'other.csv', ['title', 'secret'], [['a', 'b']])
+    with pytest.raises(ValueError):
+        detect_format(path)
+
+
+def test_bitwarden_json_streams_across_buffer_boundaries(tmp_path):
+    items = [
+        {'type': 1, 'name': 'A', 'login': {'uris': [{'uri': 'https://a.com/'}], 'username': 'alice', 'password': 'p1'}},
+        {'type': 2, 'name': 'note', 'notes': 'not a login'},
+        {'type': 1, 'name': 'Wiki', 'login': {'uris': None, 'username': None, 'password': 'p2'}},
+        {'type': 1, 'name': 'B', 'login': {'uris': [{'uri': 'https://b.com/'}], 'password': None}},
+        {'type': 1, 'name': 'C'},
+    ]
+    # 数组前后的其他键远大于读缓冲区，数字和字符串会被缓冲区截断
+    export = {'encrypted': False, 'folders': [{'id': i, 'name': 'x' * 97} for i in range(1500)],
+              'items': items, 'count': 1234567890}
+    path = tmp_path / 'bitwarden.json'
+    path.write_text(json.dumps(export), encoding='utf-8')
+    assert detect_format(str(path)) == 'bitwarden-json'
+    assert list(read_entries(str(path))) == [{'site': 'a.com', 'user_name': 'alice', 'pwd': 'p1'}, None,
+                                             {'site': 'Wiki', 'user_name': '', 'pwd': 'p2'}, None, None]
+
+
+def test_malformed_json_raises(tmp_path):
+    path = tmp_path / 'bitwarden.json'
+    path.write_text('{"items": [{"type": 1}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(read_entries(str(path)))
+
+
+def test_dedupe_by_blind_index(vault, cipher, tmp_path):
+    encrypt_user_names(vault, cipher, enable=True)
+    path = write_csv(tmp_path / 'chrome.csv', ['name', 'url', 'username', 'password'], [
+        ['c', 'https://c.com/', ' Dave ', 'p1'],                # 规范化后与库中相同
+        ['c', 'https://c.com/', 'erin', 'p2'],
+        ['c', 'https://c.com/', 'ERIN', 'p3'],                  # 规范化后与本批相同
+    ])
+    stats = import_file(vault, cipher, path)
+    assert (stats['imported'], stats['duplicates']) == (1, 2)
+    with SQLiteDB(vault, pooled=True) as db:
+        index_key = get_index_key(db, cipher.secret_key)
+        rows = find_by_user_name(db, index_key, 'erin', 'c.com', ['user_name', 'user_name_enc'])
+    assert len(rows) == 1 and rows[0]['user_name'] is None
+    assert cipher.decrypt(rows[0]['user_name_enc']) == 'erin'
+
+
+def test_cancel_keeps_committed_batches(vault, cipher, tmp_path):
+    path = write_csv(tmp_path / 'chrome.csv', ['name', 'url', 'username', 'password'],
+                     [[f's{i}', f'https://s{i}.com/', 'u', 'p'] for i in range(10)])
+    cancel = threading.Event()
+    stats = import_file(vault, cipher, path, batch_size=3, cancel_event=cancel, progress=lambda _: cancel.set())
+    assert (stats['read'], stats['imported']) == (3, 3)
+    assert len(records(vault, cipher)) == 4
+
+
+def test_wrong_key_is_rejected(vault, tmp_path):
+    path = write_csv(tmp_path / 'chrome.csv', ['name', 'url', 'username', 'password'],
+                     [['a', 'https://a.com/', 'alice', 'p1']])
+    with pytest.raises(KeyMismatch):
+        import_file(vault, EncryptedMessage(EncryptedMessage.generate_secret_key()), path)
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+import encrypted_file
+import unlock_session
+from db.db_tools import SQLiteDB
+from db.migrations import migrate
+from encrypted_file import EncryptedMessage
+from key_check import KeyMismatch, verify_secret_key
+from key_rotation import get_old_keys, is_rotating, start_rotation
+
+
+def test_start_rotation_derives_master_key_outside_write_lock(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+        unlock_session.set_master_password(db, cipher.secret_key, 'correct horse', target=0.01)
+
+    writes = []
+
+    def calibrate(target=0.01, name='scrypt'):
+        # 派生期间其他连接不等待即可写入
+        other = sqlite3.connect(path, timeout=0)
+        other.execute("INSERT INTO meta (key, value) VALUES ('probe', '1')")
+        other.commit()
+        other.close()
+        writes.append(1)
+        return encrypted_file.calibrate_kdf(0.01, name)
+
+    monkeypatch.setattr(unlock_session, 'calibrate_kdf', calibrate)
+    new_key = EncryptedMessage.generate_secret_key()
+    with SQLiteDB(path) as db:
+        assert start_rotation(db, cipher.secret_key, new_key, 'correct horse') == [cipher.secret_key]
+        assert writes == [1]
+        assert unlock_session.unwrap_secret_key(db, 'correct horse') == new_key
+        assert get_old_keys(db, new_key) == [cipher.secret_key]
+
+
+def test_failing_before_commit_rolls_back_the_rotation(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+    new_key = EncryptedMessage.generate_secret_key()
+
+    def full_disk():
+        raise OSError(28, '磁盘已满')
+
+    with SQLiteDB(path) as db:
+        with pytest.raises(OSError):
+            start_rotation(db, cipher.secret_key, new_key, before_commit=full_disk)
+        # 库仍只接受旧密钥，没有留下轮换状态
+        verify_secret_key(db, cipher.secret_key)
+        with pytest.raises(KeyMismatch):
+            verify_secret_key(db, new_key)
+        assert not is_rotating(db)
+
+        calls = []
+        start_rotation(db, cipher.secret_key, new_key, before_commit=lambda: calls.append(is_rotating(db)))
+        assert calls == [True]
+        verify_secret_key(db, new_key)
@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+
+from db.db_tools import SQLiteDB
+from db.meta import get_meta
+from db.migrations import (MIGRATIONS, REPLICA_ID_META_KEY, SCHEMA_VERSION, SYNC_CHANGE_TABLE, USER_TABLE,
+                           get_schema_version, migrate)
+
+# 迁移前（user_version = 0）的库结构，id 由界面在内存中分配，可能不连续
+BASELINE_SCHEMA = "CREATE TABLE user (id INTEGER PRIMARY KEY, user_name TEXT, pwd TEXT, site TEXT)"
+BASELINE_ROWS = [
+    (3, 'alice', 'gAAAAA-pwd-3', 'example.com'),
+    (7, 'bob', 'gAAAAA-pwd-7', 'mail.example.org'),
+    (8, '张三', 'gAAAAA-pwd-8', 'example.com'),
+]
+TRIGGERS = {f'{USER_TABLE}_fts_ai', f'{USER_TABLE}_fts_ad', f'{USER_TABLE}_fts_au',
+            f'{USER_TABLE}_sync_ai', f'{USER_TABLE}_sync_au', f'{USER_TABLE}_sync_ad'}
+
+
+def make_baseline(path):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(BASELINE_SCHEMA)
+        connection.executemany(f"INSERT INTO {USER_TABLE} (id, user_name, pwd, site) VALUES (?, ?, ?, ?)",
+                               BASELINE_ROWS)
+    connection.close()
+
+
+def query(db, sql):
+    return [dict(row) for row in db.connection.execute(sql)]
+
+
+def baseline_columns(rows):
+    return [(r['id'], r['user_name'], r['pwd'], r['site']) for r in rows]
+
+
+def schema_objects(db, object_type):
+    return {row['name'] for row in db.select('sqlite_master', ['name'], 'type = ?', (object_type,))}
+
+
+def test_baseline_schema_migrates_to_latest(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    make_baseline(path)
+    with SQLiteDB(path) as db:
+        assert get_schema_version(db) == 0
+        assert migrate(db) == SCHEMA_VERSION
+        assert get_schema_version(db) == SCHEMA_VERSION == MIGRATIONS[-1][0]
+
+        rows = query(db, f"SELECT * FROM {USER_TABLE} ORDER BY id")
+        assert baseline_columns(rows) == BASELINE_ROWS
+        # uid 回填为互不相同的 32 位十六进制串，版本戳由本库生成
+        replica_id = get_meta(db, REPLICA_ID_META_KEY)
+        assert replica_id
+        uids = [r['uid'] for r in rows]
+        assert all(uid and len(uid) == 32 and int(uid, 16) >= 0 for uid in uids)
+        assert len(set(uids)) == len(uids)
+        assert all(r['version'] == 1 and r['modified_at'] and r['origin'] == replica_id for r in rows)
+        # 已有记录都作为本地变更进入变更日志
+        changes = query(db, f"SELECT * FROM {SYNC_CHANGE_TABLE} ORDER BY seq")
+        assert [(c['uid'], c['record_id'], c['deleted'], c['local']) for c in changes] == \
+               [(r['uid'], r['id'], 0, 1) for r in rows]
+
+        assert TRIGGERS <= schema_objects(db, 'trigger')
+        assert {f'{USER_TABLE}_fts', SYNC_CHANGE_TABLE, 'meta', 'scrub_failure', 'attachment'} <= \
+               schema_objects(db, 'table')
+        assert 'AUTOINCREMENT' in db.select('sqlite_master', ['sql'], 'name = ?', (USER_TABLE,),
+                                            fetch_all=False)[0]['sql'].upper()
+        # 已有数据进入全文索引
+        assert [r['id'] for r in db.search('example.org')] == [7]
+
+        # 迁移后的触发器对新增、修改、删除都生效
+        new_id = db.insert(USER_TABLE, {'user_name': 'carol', 'pwd': 'gAAAAA-pwd-new', 'site': 'new.example.net'})
+        assert new_id > BASELINE_ROWS[-1][0]
+        new_row = db.select(USER_TABLE, ['uid', 'version'], 'id = ?', (new_id,), fetch_all=False)[0]
+        assert new_row['uid'] and new_row['version'] == 1
+        db.update(USER_TABLE, {'pwd': 'gAAAAA-pwd-3b'}, 'id = ?', (3,))
+        db.delete(USER_TABLE, 'id = ?', (8,))
+        changes = {c['record_id']: c for c in db.select(SYNC_CHANGE_TABLE, ['record_id', 'version', 'deleted'])}
+        assert changes[new_id]['version'] == 1 and not changes[new_id]['deleted']
+        assert changes[3]['version'] == 2 and not changes[3]['deleted']
+        assert changes[8]['version'] == 2 and changes[8]['deleted']
+        assert [r['id'] for r in db.search('new.example')] == [new_id]
+
+
+@pytest.mark.parametrize('stop', [version for version, _ in MIGRATIONS[:-1]])
+def test_migration_resumes_from_every_version(tmp_path, stop):
+    path = str(tmp_path / 'vault.db')
+    make_baseline(path)
+    with SQLiteDB(path) as db:
+        assert migrate(db, stop) == stop
+    with SQLiteDB(path) as db:
+        assert migrate(db) == SCHEMA_VERSION
+        rows = query(db, f"SELECT * FROM {USER_TABLE} ORDER BY id")
+        assert baseline_columns(rows) == BASELINE_ROWS
+        assert all(r['uid'] for r in rows)
+        assert TRIGGERS <= schema_objects(db, 'trigger')
+        # 再次调用不做任何事
+        assert migrate(db) == SCHEMA_VERSION
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    make_baseline(path)
+
+    def broken(db):
+        raise sqlite3.OperationalError('迁移失败')
+
+    monkeypatch.setattr('db.migrations.MIGRATIONS', MIGRATIONS[:3] + [(4, broken)])
+    with SQLiteDB(path) as db:
+        with pytest.raises(sqlite3.OperationalError):
+            migrate(db, 4)
+        assert get_schema_version(db) == 0
+        assert schema_objects(db, 'table') == {USER_TABLE}
+        assert baseline_columns(query(db, f"SELECT * FROM {USER_TABLE} ORDER BY id")) == BASELINE_ROWS
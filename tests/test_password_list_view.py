@@ -0,0 +1,71 @@
+import os
+import random
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt6.QtWidgets')
+
+from UI.password_list_view import PasswordListModel  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def record(record_id, site='site'):
+    return {'id': record_id, 'site': site, 'user_name': 'user'}
+
+
+def assert_consistent(model):
+    ids = [model.record(row)['id'] for row in range(model.rowCount())]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids, reverse=True)
+    for row, record_id in enumerate(ids):
+        assert model.has_record(record_id)
+        assert model.row_of(record_id) == row
+
+
+def test_row_index_follows_paging_and_row_changes(app):
+    rng = random.Random(25)
+    model = PasswordListModel()
+    model.clear(has_more=True)
+    next_page, next_new = 10000, 20000
+    for _ in range(300):
+        op = rng.randrange(6)
+        if op == 0 and model.canFetchMore():
+            model.fetchMore()
+            model.append_page([record(i) for i in range(next_page, next_page - 20, -1)], has_more=True)
+            next_page -= 20
+        elif op == 1:
+            count = rng.randrange(1, 5)
+            model.insert_records([record(next_new + i) for i in range(count)])
+            next_new += count
+        elif op == 2 and model.rowCount():
+            model.remove_record(model.record(rng.randrange(model.rowCount()))['id'])
+        elif op == 3 and model.rowCount():
+            rows = rng.sample(range(model.rowCount()), min(5, model.rowCount()))
+            model.remove_records([model.record(row)['id'] for row in rows])
+        elif op == 4 and model.rowCount():
+            model.truncate(model.record(rng.randrange(model.rowCount()))['id'])
+            next_page = model._cursor - 1
+        elif op == 5 and model.rowCount():
+            target = model.record(rng.randrange(model.rowCount()))['id']
+            assert model.update_records([record(target, 'renamed')]) == []
+            model.set_attachments(target, 2)
+            assert model.record(model.row_of(target))['site'] == 'renamed'
+            assert model.record(model.row_of(target))['attachments'] == 2
+        assert_consistent(model)
+
+
+def test_append_page_skips_rows_inserted_by_change_notification(app):
+    model = PasswordListModel()
+    model.clear(has_more=True)
+    model.fetchMore()
+    model.append_page([record(i) for i in range(10, 5, -1)], has_more=True)
+    model.insert_records([record(12), record(11)])
+    model.append_page([record(5), record(4)], has_more=False)
+    assert [model.record(row)['id'] for row in range(model.rowCount())] == [12, 11, 10, 9, 8, 7, 6, 5, 4]
+    assert model.update_records([record(99)]) == [record(99)]
+    assert model.row_of(99) == -1
@@ -0,0 +1,103 @@
+from db.db_tools import SQLiteDB
+from db.migrations import USER_TABLE, migrate
+from record_cache import RecordCache
+
+
+def make_vault(path, cipher):
+    with SQLiteDB(path) as db:
+        migrate(db)
+        return db.insert(USER_TABLE, {'site': 'site', 'user_name': 'user', 'pwd': cipher.encrypt_bytes('old')})
+
+
+def update_during_read(monkeypatch, cache, path, record_id, new_pwd):
+    """让下一次读取在返回旧行之后、放入缓存之前发生一次提交和 invalidate"""
+    select = SQLiteDB.select
+
+    def racing_select(self, *args, **kwargs):
+        rows = select(self, *args, **kwargs)
+        monkeypatch.setattr(SQLiteDB, 'select', select)
+        with SQLiteDB(path) as db:
+            db.update(USER_TABLE, {'pwd': new_pwd}, 'id = ?', (record_id,))
+        cache.invalidate(record_id)
+        return rows
+
+    monkeypatch.setattr(SQLiteDB, 'select', racing_select)
+
+
+def test_invalidate_during_read_is_not_overwritten_by_stale_row(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    record_id = make_vault(path, cipher)
+    cache = RecordCache(path)
+    update_during_read(monkeypatch, cache, path, record_id, cipher.encrypt_bytes('new'))
+    # 正在进行的读取仍返回它读到的行，但不放入缓存
+    assert cipher.decrypt(cache.get_record(record_id)['pwd']) == 'old'
+    assert cipher.decrypt(cache.get_record(record_id)['pwd']) == 'new'
+
+
+def test_invalidate_during_decrypt_is_not_cached_as_plaintext(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    record_id = make_vault(path, cipher)
+    cache = RecordCache(path)
+    update_during_read(monkeypatch, cache, path, record_id, cipher.encrypt_bytes('new'))
+    assert cache.get_password(record_id, cipher) == 'old'
+    assert cache.get_password(record_id, cipher) == 'new'
+
+
+def test_plaintext_is_not_cached_after_session_lock(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    record_id = make_vault(path, cipher)
+    cache = RecordCache(path)
+    select = SQLiteDB.select
+
+    def locking_select(self, *args, **kwargs):
+        cache.clear_plaintext()
+        return select(self, *args, **kwargs)
+
+    monkeypatch.setattr(SQLiteDB, 'select', locking_select)
+    assert cache.get_password(record_id, cipher) == 'old'
+    assert not cache._plaintexts
+
+
+def test_generations_stay_bounded(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    record_id = make_vault(path, cipher)
+    cache = RecordCache(path, record_size=8)
+    for other_id in range(1000, 1100):
+        cache.invalidate(other_id)
+    cache.invalidate_many(range(2000, 12000))
+    assert len(cache._generations) <= 8
+
+    # 读取期间该 id 的代数被挤出，结果同样不放入缓存
+    select = SQLiteDB.select
+
+    def evicting_select(self, *args, **kwargs):
+        rows = select(self, *args, **kwargs)
+        monkeypatch.setattr(SQLiteDB, 'select', select)
+        cache.invalidate(record_id)
+        for other_id in range(100, 120):
+            cache.invalidate(other_id)
+        return rows
+
+    monkeypatch.setattr(SQLiteDB, 'select', evicting_select)
+    cache.get_record(record_id)
+    assert record_id not in cache._records
+
+
+def test_bulk_invalidate_during_read_is_not_cached(tmp_path, cipher, monkeypatch):
+    path = str(tmp_path / 'vault.db')
+    record_id = make_vault(path, cipher)
+    cache = RecordCache(path)
+    select = SQLiteDB.select
+
+    def racing_select(self, *args, **kwargs):
+        rows = select(self, *args, **kwargs)
+        monkeypatch.setattr(SQLiteDB, 'select', select)
+        with SQLiteDB(path) as db:
+            db.update(USER_TABLE, {'pwd': cipher.encrypt_bytes('new')}, 'id = ?', (record_id,))
+        cache.invalidate_many(range(record_id, record_id + 1000))
+        return rows
+
+    monkeypatch.setattr(SQLiteDB, 'select', racing_select)
+    assert cache.get_password(record_id, cipher) == 'old'
+    assert cache.get_password(record_id, cipher) == 'new'
+    assert not cache._generations
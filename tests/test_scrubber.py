@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from blind_index import encrypt_user_names
+from db.db_tools import SQLiteDB
+from db.migrations import USER_TABLE, migrate
+from key_check import verify_secret_key
+from scrubber import get_scrub_failures, get_scrub_state, scrub_due, scrub_vault
+
+ROWS = 50
+
+
+@pytest.fixture
+def vault(tmp_path, cipher):
+    path = str(tmp_path / 'vault.db')
+    with SQLiteDB(path) as db:
+        migrate(db)
+        verify_secret_key(db, cipher.secret_key)
+        db.insert_many(USER_TABLE, [{'site': f'site{i}.example.com', 'user_name': f'user{i}',
+                                     'pwd': cipher.encrypt(f'pwd{i}')} for i in range(ROWS)])
+    return path
+
+
+def corrupt(path, record_id):
+    with SQLiteDB(path, pooled=True) as db:
+        with db.transaction():
+            db.cursor.execute(f"UPDATE {USER_TABLE} SET pwd = 'not a token' WHERE id = ?", (record_id,))
+
+
+def failures(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return sorted((row['record_id'], row['column_name']) for row in get_scrub_failures(db))
+
+
+def test_clean_pass(vault, cipher):
+    encrypt_user_names(vault, cipher, enable=True)
+    state = scrub_vault(vault, cipher, batch_size=7, duty_cycle=1)
+    assert state['checkpoint'] is None
+    assert (state['verified'], state['failed'], state['quick_check']) == (2 * ROWS, 0, ['ok'])
+    assert failures(vault) == []
+    with SQLiteDB(vault, pooled=True) as db:
+        assert not scrub_due(db)
+        assert scrub_due(db, interval=-1)
+
+
+def test_reports_bad_ciphertext(vault, cipher):
+    corrupt(vault, 3)
+    corrupt(vault, 40)
+    state = scrub_vault(vault, cipher, batch_size=10, duty_cycle=1)
+    assert (state['verified'], state['failed']) == (ROWS, 2)
+    assert failures(vault) == [(3, 'pwd'), (40, 'pwd')]
+    # 新一轮开始时清空上一轮的问题
+    with SQLiteDB(vault, pooled=True) as db:
+        with db.transaction():
+            db.cursor.execute(f"UPDATE {USER_TABLE} SET pwd = ? WHERE id IN (3, 40)", (cipher.encrypt('fixed'),))
+    state = scrub_vault(vault, cipher, duty_cycle=1)
+    assert state['failed'] == 0 and failures(vault) == []
+
+
+def test_resumes_from_checkpoint(vault, cipher):
+    corrupt(vault, 45)
+    cancel = threading.Event()
+    state = scrub_vault(vault, cipher, batch_size=10, duty_cycle=1, cancel_event=cancel,
+                        progress=lambda _: cancel.set())
+    assert (state['checkpoint'], state['verified']) == (10, 10)
+    assert failures(vault) == []
+    with SQLiteDB(vault, pooled=True) as db:
+        assert get_scrub_state(db)['checkpoint'] == 10
+        assert scrub_due(db)
+    state = scrub_vault(vault, cipher, batch_size=10, duty_cycle=1)
+    assert state['checkpoint'] is None
+    assert (state['verified'], state['failed']) == (ROWS, 1)
+    assert failures(vault) == [(45, 'pwd')]
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+import sync
+from blind_index import encrypt_user_names
+from db.change_bus import ChangeBus
+from db.change_feed import ChangeFeed
+from db.db_tools import SQLiteDB
+from db.meta import get_meta
+from db.migrations import INTERNAL_REWRITE_META_KEY, SYNC_CHANGE_TABLE, USER_TABLE, internal_rewrite, migrate
+from db.pwd_storage import PWD_STORAGE_BLOB, convert_pwd_storage
+from encrypted_file import EncryptedMessage
+from key_check import verify_secret_key
+from key_rotation import rotate_vault, start_rotation
+
+
+@pytest.fixture
+def sync_dir(tmp_path):
+    path = tmp_path / 'shared'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def make_vault(tmp_path, cipher):
+    def make(name, sites=()):
+        path = str(tmp_path / f'{name}.db')
+        with SQLiteDB(path) as db:
+            migrate(db)
+            verify_secret_key(db, cipher.secret_key)
+        for site in sites:
+            execute(path, f"INSERT INTO {USER_TABLE} (site, user_name, pwd) VALUES (?, ?, ?)",
+                    (site, f'{site}-user', f'{site}-pwd'))
+        return path
+    return make
+
+
+def execute(path, sql, params=()):
+    with SQLiteDB(path, pooled=True) as db:
+        with db.transaction():
+            db.cursor.execute(sql, params)
+
+
+def rows(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return [tuple(row) for row in db.connection.execute(
+            f"SELECT uid, version, site, user_name, pwd FROM {USER_TABLE} ORDER BY uid").fetchall()]
+
+
+def pwd_of(path, site):
+    with SQLiteDB(path, pooled=True) as db:
+        row = db.connection.execute(f"SELECT pwd FROM {USER_TABLE} WHERE site = ?", (site,)).fetchone()
+    return None if row is None else row['pwd']
+
+
+def replica_id(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return sync.get_replica_id(db)
+
+
+def sync_all(cipher, sync_dir, *paths, rounds=2):
+    for _ in range(rounds):
+        for path in paths:
+            sync.sync_vault(path, cipher, sync_dir)
+
+
+def test_edit_edit_conflict_converges(make_vault, cipher, sync_dir):
+    a = make_vault('a', ['s0', 's1'])
+    b = make_vault('b')
+    sync_all(cipher, sync_dir, a, b)
+    assert rows(a) == rows(b)
+
+    execute(a, f"UPDATE {USER_TABLE} SET pwd = 'from-a' WHERE site = 's1'")
+    time.sleep(0.01)
+    execute(b, f"UPDATE {USER_TABLE} SET pwd = 'from-b' WHERE site = 's1'")
+    stats = sync.sync_vault(a, cipher, sync_dir)
+    stats_b = sync.sync_vault(b, cipher, sync_dir)
+    sync_all(cipher, sync_dir, a, b)
+
+    assert stats['conflicts'] + stats_b['conflicts'] >= 1
+    assert rows(a) == rows(b)
+    # 版本号相同，修改时间较晚的一方获胜
+    assert pwd_of(a, 's1') == 'from-b'
+
+
+def test_delete_vs_edit_later_edit_wins(make_vault, cipher, sync_dir):
+    a = make_vault('a', ['s0', 's1', 's2'])
+    b = make_vault('b')
+    sync_all(cipher, sync_dir, a, b)
+
+    execute(a, f"DELETE FROM {USER_TABLE} WHERE site = 's2'")
+    execute(b, f"DELETE FROM {USER_TABLE} WHERE site = 's0'")
+    time.sleep(0.01)
+    execute(b, f"UPDATE {USER_TABLE} SET pwd = 'kept' WHERE site = 's2'")
+    sync_all(cipher, sync_dir, a, b)
+
+    assert rows(a) == rows(b)
+    assert pwd_of(a, 's2') == 'kept'
+    assert pwd_of(a, 's0') is None
+
+
+def test_compaction_keeps_one_file_and_new_replica_catches_up(make_vault, cipher, sync_dir, monkeypatch):
+    monkeypatch.setattr(sync, 'SYNC_COMPACT_FILES', 3)
+    a = make_vault('a', ['s0', 's1'])
+    for i in range(4):
+        execute(a, f"UPDATE {USER_TABLE} SET pwd = ? WHERE site = 's0'", (f'v{i}',))
+        sync.sync_vault(a, cipher, sync_dir)
+    files = sync._list_files(os.path.join(sync_dir, replica_id(a)))
+    assert len(files) < 3
+
+    b = make_vault('b')
+    sync_all(cipher, sync_dir, b, a)
+    assert rows(a) == rows(b)
+    assert pwd_of(b, 's0') == 'v3'
+
+
+def test_copied_vault_gets_new_replica_id(make_vault, tmp_path, cipher, sync_dir):
+    a = make_vault('a', ['s0'])
+    b = make_vault('b')
+    sync_all(cipher, sync_dir, a, b)
+    c = str(tmp_path / 'c.db')
+    src, dst = sqlite3.connect(a), sqlite3.connect(c)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+    execute(a, f"UPDATE {USER_TABLE} SET pwd = 'after-copy' WHERE site = 's0'")
+    sync.sync_vault(a, cipher, sync_dir)
+    execute(c, f"INSERT INTO {USER_TABLE} (site, user_name, pwd) VALUES ('c-only', 'cu', 'pc')")
+    sync.sync_vault(c, cipher, sync_dir)
+    sync_all(cipher, sync_dir, a, b, c)
+
+    assert replica_id(c) != replica_id(a)
+    assert rows(a) == rows(b) == rows(c)
+    assert pwd_of(c, 's0') == 'after-copy'
+    assert pwd_of(a, 'c-only') == 'pc'
+
+
+def test_interrupted_import_resumes_from_saved_offset(make_vault, cipher, sync_dir, monkeypatch):
+    monkeypatch.setattr(sync, 'SYNC_BATCH_LINES', 10)
+    a = make_vault('a', [f'site{i:02d}' for i in range(35)])
+    b = make_vault('b')
+    sync.sync_vault(a, cipher, sync_dir)
+
+    apply_change = sync._apply_change
+    calls = []
+
+    def failing(*args):
+        calls.append(1)
+        if len(calls) > 15:
+            raise RuntimeError("interrupted")
+        return apply_change(*args)
+
+    monkeypatch.setattr(sync, '_apply_change', failing)
+    with pytest.raises(RuntimeError):
+        sync.sync_vault(b, cipher, sync_dir)
+    with SQLiteDB(b, pooled=True) as db:
+        state = sync.get_sync_state(db)
+        assert state['partial'] == {replica_id(a): [1, 10]}
+        assert db.connection.execute(f"SELECT count(*) FROM {USER_TABLE}").fetchone()[0] == 10
+        # 中断时已恢复导入前删除的全文索引触发器
+        assert 'fts_trigger' not in state
+        assert db.select('sqlite_master', ['name'], "type = 'trigger' AND name = ?", (f'{USER_TABLE}_fts_ai',))
+
+    monkeypatch.setattr(sync, '_apply_change', apply_change)
+    stats = sync.sync_vault(b, cipher, sync_dir)
+    assert stats['received'] == 25
+    assert rows(a) == rows(b)
+    with SQLiteDB(b, pooled=True) as db:
+        assert sync.get_sync_state(db)['partial'] == {}
+        assert len(db.search('site34', columns=['id'])) == 1
+
+
+def change_log(path):
+    with SQLiteDB(path, pooled=True) as db:
+        return [tuple(row) for row in db.connection.execute(
+            f"SELECT seq, uid, version FROM {SYNC_CHANGE_TABLE} ORDER BY seq").fetchall()]
+
+
+def test_internal_rewrites_are_not_logged_as_local_changes(make_vault, cipher, sync_dir):
+    a = make_vault('a', ['s0', 's1', 's2'])
+    b = make_vault('b')
+    execute(a, f"UPDATE {USER_TABLE} SET pwd = ?", (cipher.encrypt('secret'),))
+    sync_all(cipher, sync_dir, a, b)
+    before, log_before = rows(a), change_log(a)
+    feed = ChangeFeed(a, ChangeBus())
+
+    # 存储格式转换、密钥轮换和用户名加密只改变密文的形式
+    assert convert_pwd_storage(a, PWD_STORAGE_BLOB) == 3
+    new_key = EncryptedMessage.generate_secret_key()
+    with SQLiteDB(a, pooled=True) as db:
+        start_rotation(db, cipher.secret_key, new_key)
+    rotated = EncryptedMessage(new_key, old_keys=[cipher.secret_key])
+    assert rotate_vault(a, rotated) == 3
+    assert encrypt_user_names(a, rotated, enable=True) == 3
+
+    assert change_log(a) == log_before
+    assert [(uid, version) for uid, version, *_ in rows(a)] == [(uid, version) for uid, version, *_ in before]
+    assert feed.poll() == []
+    feed.close()
+    with SQLiteDB(a, pooled=True) as db:
+        assert get_meta(db, INTERNAL_REWRITE_META_KEY) is None
+    assert sync.sync_vault(a, rotated, sync_dir)['sent'] == 0
+
+    # 之后的本地修改照常记录
+    execute(a, f"UPDATE {USER_TABLE} SET site = 's0-renamed' WHERE site = 's0'")
+    versions = {uid: version for _, uid, version in log_before}
+    _, uid, version = change_log(a)[-1]
+    assert len(change_log(a)) == len(log_before)
+    assert version == versions[uid] + 1
+
+
+def test_internal_rewrite_requires_a_transaction(make_vault):
+    a = make_vault('a')
+    with SQLiteDB(a) as db:
+        with pytest.raises(RuntimeError):
+            with internal_rewrite(db):
+                pass
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from typing import Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from encrypted_file import EncryptedMessage, derive_key, calibrate_kdf, DEFAULT_KDF_TARGET
+from db.db_tools import SQLiteDB
+from db.meta import get_meta, set_meta
+
+# meta 表中保存主密码 KDF 参数和被主密码包装的库密钥
+KDF_META_KEY = 'master_kdf'
+WRAPPED_KEY_META_KEY = 'master_wrapped_key'
+# 空闲多久（秒）后自动锁定
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+class SessionLocked(Exception):
+    """会话未解锁或已超时锁定"""
+
+
+def is_secret_key(text: str) -> bool:
+    """text 是否为合法的 Fernet 密钥（而不是主密码）"""
+    try:
+        Fernet(text)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def has_master_password(db: SQLiteDB) -> bool:
+    return get_meta(db, WRAPPED_KEY_META_KEY) is not None
+
+
+def wrap_secret_key(secret_key: str, password: str, target: float = DEFAULT_KDF_TARGET) -> Tuple[dict, str]:
+    """按当前机器校准 KDF 参数，用主密码派生出的密钥包装库密钥
+
+    校准和派生都有意放慢，不访问数据库，应在开始写事务之前调用。
+    :param secret_key: 库密钥
+    :param password: 主密码
+    :param target: 解锁时派生密钥的目标耗时（秒）
+    :return: (KDF 参数, 包装后的库密钥)，交给 save_wrapped_key 保存
+    """
+    params = calibrate_kdf(target)
+    wrapped = Fernet(derive_key(password, params)).encrypt(secret_key.encode('utf-8'))
+    return params, wrapped.decode('utf-8')
+
+
+def save_wrapped_key(db: SQLiteDB, params: dict, wrapped: str):
+    """保存 wrap_secret_key 的结果，可以在调用方的事务中调用"""
+    with db.transaction():
+        set_meta(db, KDF_META_KEY, json.dumps(params))
+        set_meta(db, WRAPPED_KEY_META_KEY, wrapped)
+
+
+def set_master_password(db: SQLiteDB, secret_key: str, password: str,
+                        target: float = DEFAULT_KDF_TARGET) -> dict:
+    """设置主密码：按当前机器校准 KDF 参数，用派生出的密钥包装库密钥后保存
+
+    库密钥本身不变，已有记录无需重新加密。派生在事务之外完成，写锁只在保存时持有。
+    :param db: 已连接的 SQLiteDB
+    :param secret_key: 当前的库密钥
+    :param password: 新的主密码
+    :param target: 解锁时派生密钥的目标耗时（秒）
+    :return: 使用的 KDF 参数
+    """
+    params, wrapped = wrap_secret_key(secret_key, password, target)
+    save_wrapped_key(db, params, wrapped)
+    return params
+
+
+def unwrap_secret_key(db: SQLiteDB, password: str) -> str:
+    """用主密码解出库密钥，耗时约为校准时的目标耗时
+    :raises LookupError: 尚未设置主密码
+    :raises ValueError: 主密码错误
+    """
+    params = get_meta(db, KDF_META_KEY)
+    wrapped = get_meta(db, WRAPPED_KEY_META_KEY)
+    if params is None or wrapped is None:
+        raise LookupError("尚未设置主密码")
+    try:
+        secret_key = Fernet(derive_key(password, json.loads(params))).decrypt(wrapped)
+    except InvalidToken:
+        raise ValueError("主密码错误") from None
+    return secret_key.decode('utf-8')
+
+
+class UnlockSession:
+    """解锁会话：缓存由库密钥构造的 EncryptedMessage，空闲超时后自动丢弃
+
+    解锁后每次操作只需解密本身，不再重复构造密码器或派生密钥。
+    """
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        """
+        :param idle_timeout: 空闲多少秒后锁定，None 表示不自动锁定
+        """
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._cipher = None
+        self._secret_key = None
+        self._last_used = 0.0
+
+    def unlock(self, secret_key: str, old_keys=()):
+        """用库密钥解锁
+        :param old_keys: 密钥轮换尚未完成时的旧密钥，见 key_rotation.get_old_keys
+        """
+        cipher = EncryptedMessage(secret_key, old_keys=old_keys)
+        with self._lock:
+            self._cipher = cipher
+            self._secret_key = secret_key
+            self._last_used = time.monotonic()
+
+    def lock(self):
+        with self._lock:
+            self._cipher = None
+            self._secret_key = None
+
+    def _expired(self) -> bool:
+        return (self.idle_timeout is not None
+                and time.monotonic() - self._last_used > self.idle_timeout)
+
+    def _check(self) -> bool:
+        """调用方需持有 self._lock，超时的会话会在这里被锁定"""
+        if self._cipher is not None and self._expired():
+            self._cipher = None
+            self._secret_key = None
+        return self._cipher is not None
+
+    @property
+    def is_unlocked(self) -> bool:
+        with self._lock:
+            return self._check()
+
+    @property
+    def cipher(self) -> EncryptedMessage:
+        """返回缓存的密码器并刷新空闲计时
+        :raises SessionLocked: 未解锁或已超时
+        """
+        with self._lock:
+            if not self._check():
+                raise SessionLocked("会话未解锁")
+            self._last_used = time.monotonic()
+            return self._cipher
+
+    @property
+    def secret_key(self) -> str:
+        """当前的库密钥，用于设置主密码"""
+        with self._lock:
+            if not self._check():
+                raise SessionLocked("会话未解锁")
+            return self._secret_key
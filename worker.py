@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobSignals(QObject):
+    """任务信号，在GUI线程创建，工作线程发出的信号会排队回到GUI线程执行"""
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    done = pyqtSignal()
+    progress = pyqtSignal(object)
+
+
+class ChangeSignals(QObject):
+    """行级变更信号，在GUI线程创建，ChangeBus 在任意线程发布的变更排队回到GUI线程"""
+    changed = pyqtSignal(object)
+
+
+class Job(QRunnable):
+    """在线程池中执行的数据库/加解密任务"""
+    def __init__(self, func, *args, key=None, **kwargs):
+        """
+        :param func: 在工作线程中执行的函数
+        :param key: 顺序键，同一个键的任务按提交顺序逐个执行，例如记录 id
+        """
+        super().__init__()
+        self.setAutoDelete(False)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        # 在工作线程中任务结束时调用，用于启动同一个键的下一个任务
+        self.on_complete = None
+        # 长时间运行的任务可以接收 cancel_event 并自行检查
+        self.cancel_event = threading.Event()
+        self.signals = JobSignals()
+
+    def cancel(self):
+        """取消任务，未开始的任务不再执行，已开始的任务不再回传结果"""
+        self.cancel_event.set()
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        try:
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+                return
+            try:
+                result = self.func(*self.args, **self.kwargs)
+            except Exception as e:
+                if self.is_cancelled:
+                    self.signals.cancelled.emit()
+                else:
+                    self.signals.failed.emit(e)
+                return
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+        finally:
+            if self.on_complete is not None:
+                self.on_complete(self)
+            self.signals.done.emit()
+
+
+class JobRunner(QObject):
+    """把数据库和加解密任务放到线程池执行，结果通过Qt信号回到GUI线程
+
+    带 key 的任务按键串行：同一条记录的新增、删除等修改严格按提交顺序执行，
+    不同记录之间的任务仍然并行。同一个键的下一个任务由工作线程直接启动，
+    不依赖GUI事件循环，因此退出时排队中的修改也能执行完。
+    """
+    def __init__(self, max_threads=4, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self._jobs = set()
+        self._lock = threading.Lock()
+        # key -> 等待执行的任务队列，键存在表示该键有任务正在执行
+        self._queues = {}
+
+    def submit(self, func, *args, key=None, on_result=None, on_error=None,
+               pass_cancel_event=False, on_progress=None, **kwargs) -> Job:
+        """提交任务
+        :param func: 在工作线程中执行的函数
+        :param key: 顺序键，None 表示不限制顺序
+        :param on_result: 成功时在GUI线程调用，参数为 func 的返回值
+        :param on_error: 失败时在GUI线程调用，参数为异常对象
+        :param pass_cancel_event: True 时以 cancel_event 关键字参数把取消标志传给 func
+        :param on_progress: 不为 None 时以 progress 关键字参数传给 func 一个回调，
+            func 在工作线程中调用它报告进度，on_progress 在GUI线程收到该参数
+        :return: Job，可调用 cancel() 取消
+        """
+        job = Job(func, *args, key=key, **kwargs)
+        if pass_cancel_event:
+            job.kwargs['cancel_event'] = job.cancel_event
+        if on_progress is not None:
+            job.kwargs['progress'] = job.signals.progress.emit
+            job.signals.progress.connect(on_progress)
+        if on_result is not None:
+            job.signals.finished.connect(on_result)
+        if on_error is not None:
+            job.signals.failed.connect(on_error)
+        job.signals.done.connect(lambda: self._jobs.discard(job))
+        self._jobs.add(job)
+
+        if key is None:
+            self.pool.start(job)
+            return job
+        job.on_complete = self._start_next
+        with self._lock:
+            if key in self._queues:
+                self._queues[key].append(job)
+                return job
+            self._queues[key] = deque()
+        self.pool.start(job)
+        return job
+
+    def _start_next(self, job):
+        """工作线程中调用：启动同一个键排队的下一个任务"""
+        with self._lock:
+            pending = self._queues.get(job.key)
+            if pending:
+                next_job = pending.popleft()
+            else:
+                self._queues.pop(job.key, None)
+                return
+        self.pool.start(next_job)
+
+    def cancel_all(self, include_keyed=True):
+        """取消未完成的任务
+        :param include_keyed: False 时保留带 key 的任务（通常是修改），只取消读取类任务
+        """
+        for job in list(self._jobs):
+            if include_keyed or job.key is None:
+                job.cancel()
+
+    def shutdown(self, timeout_ms=10000):
+        """取消读取类任务，等待排队中的修改执行完，在程序退出时调用"""
+        self.cancel_all(include_keyed=False)
+        self.pool.waitForDone(timeout_ms)